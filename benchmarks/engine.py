@@ -0,0 +1,56 @@
+'''
+Benchmark of the fishing engine against the embedded database.
+
+Plays whole trips without the network: each one casts a line and claims
+the trip, which registers any fish caught along with the leaderboards.
+Reports the cost of each step, so changes to the engine can be measured
+without Postgres latency drowning them out.
+
+Run from the repository root:
+    python benchmarks/engine.py [trips]
+
+Set DATABASE_URL to a sqlite:/// file to include the cost of writing to
+disk; by default the database is held in memory.
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'checker'))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import fishing
+
+TRIPS = 2000
+PLAYERS = 50
+
+
+def main():
+    trips = int(sys.argv[1]) if len(sys.argv) > 1 else TRIPS
+    fishing.rebuildDB(reinsert=True)
+
+    timings = {'cast': 0.0, 'claim': 0.0}
+    catches = 0
+    for number in range(trips):
+        user_id = 1000 + number % PLAYERS
+
+        started = time.perf_counter()
+        fishing.castLine(str(user_id), 'Flats', 'kayak')
+        cast = time.perf_counter()
+        _, player_stats = fishing.claimTrip(user_id)
+        claimed = time.perf_counter()
+        if player_stats is not None:
+            catches += 1
+
+        timings['cast'] += cast - started
+        timings['claim'] += claimed - cast
+
+    print(f'{trips} trips, {catches} catches')
+    for step, seconds in timings.items():
+        print(f'{step:>6}: {seconds / trips * 1e6:.0f} µs each')
+    print(f'{"total":>6}: {trips / sum(timings.values()):.0f} trips a second')
+
+
+if __name__ == '__main__':
+    main()
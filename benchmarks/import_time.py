@@ -0,0 +1,83 @@
+'''
+Benchmark of how long a worker takes to import the app.
+
+Imports response.py (what gunicorn loads) in a fresh interpreter several
+times, with none of the bot's environment variables set, and reports the
+median time along with the slowest of the modules it imports directly.
+
+Run from the repository root:
+    python benchmarks/import_time.py [module]
+'''
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHECKER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'checker')
+
+RUNS = 7
+SLOWEST = 10
+
+# The bot's own variables, which a clean environment shouldn't have
+BOT_VARIABLES = ('DATABASE_URL', 'DB_POOL_SIZE', 'INGEST_WORKERS',
+                 'INGEST_QUEUE_SIZE', 'INGEST_MODE', 'RANDOM_SEED',
+                 'METRICS', 'GROUPME_API_URL', 'token', 'bot_id')
+
+
+def import_once(module, environ):
+    '''Import `module` in a new interpreter, returning the wall time in
+    seconds and the interpreter's -X importtime report.
+    '''
+
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            cwd=CHECKER, env=environ,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    return time.perf_counter() - started, result.stderr
+
+
+def slowest_imports(report, module):
+    '''Return the (cumulative µs, name) of the slowest modules imported
+    directly by `module`.
+    '''
+
+    # Each module is reported after everything it imported, indented two
+    # spaces deeper than its importer
+    children = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 1:
+            if name.strip() == module:
+                return sorted(children, reverse=True)[:SLOWEST]
+            children = []
+    return []
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else 'response'
+    environ = {name: value for name, value in os.environ.items()
+               if name not in BOT_VARIABLES}
+
+    timings = []
+    for _ in range(RUNS):
+        seconds, report = import_once(module, environ)
+        timings.append(seconds)
+
+    print(f'import {module}: {statistics.median(timings) * 1000:.0f} ms '
+          f'(median of {RUNS}, including interpreter start-up)')
+    for cumulative, name in slowest_imports(report, module):
+        print(f'{cumulative / 1000:>8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
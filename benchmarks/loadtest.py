@@ -0,0 +1,331 @@
+'''
+Load test of the webhook: replays synthetic GroupMe traffic against checkit.
+
+Starts the Flask app against the embedded database and a stand-in for the
+GroupMe API served on a local port, then posts a mix of !gofish,
+!fish stats, !fish leaderboard and !fish retry messages from many players
+at a fixed concurrency. Once every command has run, every trip has
+finished and every reply has been posted, it reports:
+
+- webhooks answered a second, and the 50th/90th/99th percentile time to
+  answer one (in 'queue' mode that's only the time to queue the command)
+- for each command, how long it took to run and how many queries it made,
+  which on Postgres is the number of round trips to the database
+- the queries made by trips, and the posts the stand-in API received
+
+Run from the repository root:
+    python benchmarks/loadtest.py [--requests N] [--concurrency N]
+        [--mix gofish=4,stats=2,leaderboard=2,retry=1] [--mode queue|inline]
+
+Set DATABASE_URL to a sqlite:/// file to include the cost of writing to
+disk; by default the database is held in memory.
+'''
+
+import argparse
+import asyncio
+import collections
+import contextvars
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'checker'))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('token', 'loadtest')
+os.environ.setdefault('bot_id', 'loadtest')
+
+from aiohttp import web
+
+# The text posted for each kind of command
+COMMANDS = {'gofish': '!gofish',
+            'stats': '!fish stats',
+            'leaderboard': '!fish leaderboard',
+            'retry': '!fish retry'}
+
+MIX = 'gofish=4,stats=2,leaderboard=2,retry=1'
+
+# How long to wait for the app to finish what the traffic started
+DRAIN_TIMEOUT = 60
+
+
+def parse_mix(mix):
+    '''Turn 'gofish=4,stats=1' into {'gofish': 4, 'stats': 1}.'''
+
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(
+                f'unknown command {name!r}; pick from {", ".join(COMMANDS)}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class FakeGroupMe:
+    '''The parts of the GroupMe API the bot uses, on a local port.
+
+    Lists `players` members for the group and counts the bot's posts.
+    '''
+
+    def __init__(self, players):
+        self.members = [{'user_id': str(user_id),
+                         'name': f'Player {user_id}',
+                         'nickname': f'player{user_id}'}
+                        for user_id in players]
+        self.posts = 0
+        self.member_fetches = 0
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}/v3'
+
+    async def get_group(self, request):
+        self.member_fetches += 1
+        return web.json_response({'response': {'members': self.members}})
+
+    async def post_message(self, request):
+        await request.post()
+        self.posts += 1
+        return web.Response(status=202)
+
+    def start(self):
+        '''Serve the API from a thread of its own.'''
+
+        app = web.Application()
+        app.router.add_get('/v3/groups/{group_id}', self.get_group)
+        app.router.add_post('/v3/bots/post', self.post_message)
+        runner = web.AppRunner(app)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(
+            web.TCPSite(runner, '127.0.0.1', self.port).start())
+        threading.Thread(target=loop.run_forever, name='fake-groupme',
+                         daemon=True).start()
+
+
+class QueryCounter:
+    '''Counts queries by the command which made them.
+
+    The command running is a context variable, so queries a command
+    makes on the scheduler's loop and thread pool are counted as its
+    own; any other query (i.e. one made by a trip) is counted as 'trips'.
+    '''
+
+    def __init__(self):
+        self.command = contextvars.ContextVar('command', default='trips')
+        self._lock = threading.Lock()
+        self.counts = collections.Counter()
+
+    def count(self):
+        with self._lock:
+            self.counts[self.command.get()] += 1
+
+    def install(self, cursor_class):
+        '''Count every query made through `cursor_class`.'''
+
+        # execute_values goes through execute, a statement a page
+        counter = self
+        execute = cursor_class.execute
+
+        def counted(self, *args, **kwargs):
+            counter.count()
+            return execute(self, *args, **kwargs)
+
+        cursor_class.execute = counted
+
+
+def percentiles(samples):
+    '''The 50th, 90th and 99th percentiles of `samples`, in ms.'''
+
+    samples = sorted(samples)
+    if not samples:
+        return {f'p{p}_ms': 0 for p in (50, 90, 99)}
+    return {f'p{p}_ms':
+            samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000
+            for p in (50, 90, 99)}
+
+
+def wait_for(done, timeout=DRAIN_TIMEOUT):
+    '''Poll until `done()` is true, returning False on timeout.'''
+
+    deadline = time.monotonic() + timeout
+    while not done():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(MIX),
+                        help=f'weights of each command (default {MIX})')
+    parser.add_argument('--mode', choices=('queue', 'inline'),
+                        help='INGEST_MODE (default: the setting)')
+    parser.add_argument('--trip-seconds', type=float, default=0,
+                        help='how long every trip lasts')
+    parser.add_argument('--post-rate', type=float, default=0,
+                        help="the dispatcher's posts a second "
+                             '(default: unlimited)')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args()
+
+    players = range(1000, 1000 + args.players)
+    groupme = FakeGroupMe(players)
+    groupme.start()
+    os.environ['GROUPME_API_URL'] = groupme.url
+    if args.mode:
+        os.environ['INGEST_MODE'] = args.mode
+
+    import database
+    import fishing
+    import response
+    import sqlitedb
+    from dispatcher import dispatcher
+    from scheduler import trips
+    from settings import settings
+    from topics import add_topic
+
+    if database.dialect() != 'sqlite':
+        sys.exit('queries are only counted on the embedded database; '
+                 'set DATABASE_URL to sqlite:// or a sqlite:/// file')
+    fishing.rebuildDB(reinsert=True)
+    add_topic('bait')
+
+    # Trips last as long as asked, so they finish during the run
+    fishing.tripDelay = lambda rod_level, rng=random: args.trip_seconds
+    # The real rate limit would make the run last as long as the posts
+    if args.post_rate:
+        dispatcher.rate, dispatcher.burst = args.post_rate, 1
+    else:
+        dispatcher.rate = dispatcher.burst = 1e9
+
+    queries = QueryCounter()
+    queries.install(sqlitedb.SQLiteCursor)
+    command_times = collections.defaultdict(list)
+    names = {text: name for name, text in COMMANDS.items()}
+    handle = response.handle
+
+    def timed_handle(post):
+        name = names[post['text']]
+        running = queries.command.set(name)
+        started = time.perf_counter()
+        try:
+            return handle(post)
+        finally:
+            command_times[name].append(time.perf_counter() - started)
+            queries.command.reset(running)
+
+    response.handle = timed_handle
+
+    # Coroutines inherit the context they're scheduled from, so trips
+    # are scheduled from an empty one to count them separately
+    schedule = trips.schedule
+    trips.schedule = lambda key, coro: contextvars.Context().run(schedule,
+                                                                 key, coro)
+
+    rng = random.Random(args.seed)
+    commands = list(args.mix)
+    weights = [args.mix[name] for name in commands]
+    posts = [{'name': f'Player {user_id}',
+              'user_id': str(user_id),
+              'text': COMMANDS[name]}
+             for user_id, name in zip(rng.choices(players, k=args.requests),
+                                      rng.choices(commands, weights,
+                                                  k=args.requests))]
+
+    local = threading.local()
+    statuses = collections.Counter()
+    webhook_times = []
+
+    def send(post):
+        if not hasattr(local, 'client'):
+            local.client = response.app.test_client()
+        started = time.perf_counter()
+        answer = local.client.post('/', json=post)
+        webhook_times.append(time.perf_counter() - started)
+        statuses[answer.status_code] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for _ in pool.map(send, posts):
+            pass
+    answered = time.perf_counter() - started
+
+    # Let everything the traffic started finish: the queued commands, the
+    # trips (the sweeper and event listener are always pending) and the
+    # replies
+    queue = response.commands
+    drained = wait_for(lambda: queue.counters['handled']
+                       >= queue.counters['accepted'])
+    drained &= wait_for(lambda: trips.pending() <= 2)
+    drained &= wait_for(lambda: dispatcher.counters['queued']
+                        <= dispatcher.counters['sent']
+                        + dispatcher.counters['failed']
+                        + dispatcher.counters['coalesced'])
+    finished = time.perf_counter() - started
+
+    report = {'mode': settings.ingest_mode,
+              'requests': args.requests,
+              'concurrency': args.concurrency,
+              'statuses': dict(statuses),
+              'webhooks_per_second': args.requests / answered,
+              'webhook': percentiles(webhook_times),
+              'drained': drained,
+              'seconds_to_drain': finished,
+              'commands': {},
+              'trip_queries': queries.counts['trips'],
+              'posts_received': groupme.posts,
+              'member_fetches': groupme.member_fetches,
+              'dispatcher': dispatcher.stats(),
+              'queue': queue.stats() if settings.ingest_mode == 'queue'
+              else None,
+              'database': database.stats()}
+    for name, times in sorted(command_times.items()):
+        report['commands'][name] = {'count': len(times),
+                                    'mean_ms': statistics.mean(times) * 1000,
+                                    **percentiles(times),
+                                    'queries_each':
+                                    queries.counts[name] / len(times)}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f'{args.requests} webhooks in {report["mode"]} mode at '
+          f'concurrency {args.concurrency}: '
+          f'{report["webhooks_per_second"]:,.0f} a second, '
+          f'statuses {report["statuses"]}')
+    print('  answered in p50 {p50_ms:.2f} / p90 {p90_ms:.2f} / '
+          'p99 {p99_ms:.2f} ms'.format(**report['webhook']))
+    print(f'  drained in {finished:.1f}s' if drained
+          else f'  NOT drained after {finished:.1f}s')
+    print(f'{"command":<12}{"count":>6}{"mean":>8}{"p50":>8}{"p90":>8}'
+          f'{"p99":>8}{"queries":>9}')
+    for name, row in report['commands'].items():
+        print(f'{name:<12}{row["count"]:>6}{row["mean_ms"]:>8.2f}'
+              f'{row["p50_ms"]:>8.2f}{row["p90_ms"]:>8.2f}'
+              f'{row["p99_ms"]:>8.2f}{row["queries_each"]:>9.1f}')
+    print(f'trips made {report["trip_queries"]} queries')
+    print(f'GroupMe received {groupme.posts} posts and '
+          f'{groupme.member_fetches} member list requests; '
+          f'dispatcher {report["dispatcher"]}')
+
+
+if __name__ == '__main__':
+    main()
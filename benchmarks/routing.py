@@ -0,0 +1,96 @@
+'''
+Micro-benchmark of routing a message to its command handler.
+
+Routes a mix of typical messages through a Router built like the one in
+response.py, with handlers that do nothing, and reports the cost per
+message alongside the regex cascade the router replaced.
+
+Run from the repository root:
+    python benchmarks/routing.py
+'''
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'checker'))
+
+import fishing
+from router import Router, Matcher, parse
+
+MESSAGES = ['!gofish', '!gofish lake dingy', '!fish stats', '!fish lstats',
+            '!fish leaderboard', '!fish leaderboard reef', '!fish retry',
+            '!fish Offshore', '!help', 'lol nice', 'did anyone see the game',
+            'checkers is a good bot']
+
+ROUNDS = 20000
+
+
+def build_router():
+    habitats = Matcher(fishing.HABITATS_SET)
+    boats = Matcher([boat[0] for boat in fishing.BOATS])
+    router = Router()
+    fish_router = Router(default=lambda post, message: None)
+
+    @router.command('!gofish')
+    def gofish(post, message):
+        return habitats.find(message.lower), boats.find(message.lower)
+
+    router.command('!help', '!loaves')(lambda post, message: None)
+    router.command('!fish')(lambda post, message:
+                            fish_router.route_args(post, message))
+    fish_router.command('retry', 'locations', 'boats', 'rods', 'leaderboard',
+                        'lstats', 'stats', *habitats.names)(
+        lambda post, message: habitats.find(message.lower))
+    return router
+
+
+def cascade(post):
+    '''The chain of re.search calls which routing used to be.'''
+
+    if post['text'].lower() == '!help':
+        return
+    elif post['text'].lower() == '!loaves':
+        return
+    elif re.search('^!gofish', post['text'].lower()):
+        re.search("|".join(fishing.HABITATS_SET).lower(), post['text'].lower())
+        re.search("|".join([boat[0] for boat in fishing.BOATS]),
+                  post['text'].lower())
+    elif re.search('^!fish', post['text'].lower()):
+        for pattern in ('retry', 'locations', 'boats|rods', 'leaderboard'):
+            if re.search(pattern, post['text'].lower()):
+                return
+        if re.search("|".join(fishing.HABITATS_SET), post['text'].title()):
+            return
+        for pattern in ('lstats', 'stats'):
+            if re.search(pattern, post['text'].lower()):
+                return
+
+
+def main():
+    router = build_router()
+    posts = [{'text': text, 'user_id': '1'} for text in MESSAGES]
+
+    def run_router():
+        for post in posts:
+            router.route(post)
+
+    def run_cascade():
+        for post in posts:
+            cascade(post)
+
+    def run_parse():
+        for post in posts:
+            parse(post['text'])
+
+    for name, fn in (('parse only', run_parse),
+                     ('router', run_router),
+                     ('regex cascade', run_cascade)):
+        seconds = min(timeit.repeat(fn, number=ROUNDS // 10, repeat=5))
+        per_message = seconds / (ROUNDS // 10 * len(posts)) * 1e6
+        print(f'{name:>14}: {per_message:.2f} µs per message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+'''
+An in-memory copy of the fish catalogue.
+
+The Fish and Habitats tables only change when the database is rebuilt,
+so rather than asking the database for a random fish on every cast,
+each worker loads the catalogue once and keeps it as a tuple of fish per
+habitat. Picking a fish is then a single random index, and its size is
+already stored in pounds.
+'''
+
+import random
+import re
+import statistics as stats
+import threading
+import time
+from collections import namedtuple
+
+import database
+
+WEIGHT_CONVERSIONS = {'kg': 2.204623,
+                      'lb': 1,
+                      'pound': 1,
+                      'oz': 0.0625,
+                      'ounce': 0.0625}
+
+METRIC_REGEX = re.compile("|".join(WEIGHT_CONVERSIONS.keys()))
+NUMBER_REGEX = re.compile(r'[0-9.]+')
+
+# Sizes in units other than weights, e.g. inches, can't be parsed
+UNPARSEABLE_SIZE = re.compile('in|f|c|m|"')
+
+# How long a worker trusts its copy before loading it again
+MAX_AGE = 60 * 60
+
+# The smallest a fish is ever caught, in the unit of its size
+MIN_SIZE = 0.2
+
+
+class Fish(namedtuple('Fish', ['id', 'name', 'size', 'food_value',
+                               'game_quality', 'min_lb', 'max_lb',
+                               'mean_lb', 'sd_lb', 'floor_lb'])):
+    '''A row of the Fish table, including its size in pounds, and the
+    smallest one caught (MIN_SIZE of its unit) in pounds.
+    '''
+
+    __slots__ = ()
+
+    @property
+    def row(self):
+        '''The fish as it is described to players.'''
+
+        return tuple(self[:5])
+
+
+def unit_factor(size):
+    '''Return how many pounds there are in the unit of a fish's size.'''
+
+    return WEIGHT_CONVERSIONS[METRIC_REGEX.search(size)[0]]
+
+
+def parse_size(size):
+    '''Parse the text of a fish's size, e.g. '5-10 lb'.
+
+    Returns the minimum, maximum, mean and standard deviation of the size
+    in pounds. This is only needed when fish are added to the database;
+    the results are stored in the Fish table.
+    '''
+
+    # Only the first two values are a range; anything after is noise
+    size_list = [float(val) for val in NUMBER_REGEX.findall(size)][:2]
+    mean = stats.mean(size_list)
+    sd = (max(size_list) - min(size_list))/4 if len(size_list) > 1\
+        else size_list[0]/10
+    factor = unit_factor(size)
+    return (min(size_list) * factor, max(size_list) * factor,
+            mean * factor, sd * factor)
+
+
+def validate_fishfacts(fishfacts):
+    '''Check and parse the scraped fish facts before they're loaded.
+
+    Returns a list of Fish rows (without IDs), a list of (name, habitat)
+    pairs and the names of the fish which were skipped as invalid.
+    '''
+
+    fish = []
+    habitats = []
+    skipped = []
+    for name, facts in fishfacts.items():
+        try:
+            if len(facts) != 4 or UNPARSEABLE_SIZE.search(facts['Size']):
+                raise ValueError(facts)
+            row = (name, facts['Size'], facts['Food Value'],
+                   facts['Game Qualities'], *parse_size(facts['Size']))
+        except (KeyError, TypeError, ValueError):
+            skipped.append(name)
+            continue
+        fish.append(row)
+        # dict.fromkeys drops repeats but keeps the order
+        habitats.extend((name, habitat) for habitat in
+                        dict.fromkeys(facts['Habitats'].split(', ')))
+    return fish, habitats, skipped
+
+
+def import_fishfacts(c, fishfacts):
+    '''Load the scraped fish facts into the Fish and Habitats tables.
+
+    Everything is validated first and then inserted in a few batched
+    statements. Fish and habitats already in the tables are left alone,
+    so importing the same facts again changes nothing.
+
+    Returns a dictionary counting the rows loaded and skipped.
+    '''
+
+    fish, habitats, skipped = validate_fishfacts(fishfacts)
+
+    inserted = database.execute_values(c, '''
+      INSERT
+      INTO Fish (Name, Size, Food_Value, Game_Quality,
+                 min_lb, max_lb, mean_lb, sd_lb)
+      VALUES %s
+      ON CONFLICT (Name) DO NOTHING
+      RETURNING ID
+    ''', fish, fetch=True)
+
+    # Look up every fish's ID, including the ones which were already there
+    c.execute('''
+      SELECT Name, ID
+      FROM Fish
+    ''')
+    ids = dict(c.fetchall())
+
+    habitats_inserted = database.execute_values(c, '''
+      INSERT
+      INTO Habitats (Habitat, Fish_ID)
+      VALUES %s
+      ON CONFLICT DO NOTHING
+      RETURNING Fish_ID
+    ''', [(habitat, ids[name]) for name, habitat in habitats], fetch=True)
+
+    return {'fish_loaded': len(inserted),
+            'fish_existing': len(fish) - len(inserted),
+            'fish_skipped': len(skipped),
+            'habitats_loaded': len(habitats_inserted),
+            'habitats_existing': len(habitats) - len(habitats_inserted)}
+
+
+class Catalogue:
+    '''The fish available in each habitat.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._habitats = None
+        self._masks = None
+        self.loaded_at = 0
+        self.version = 0
+
+    def load(self):
+        '''Load the catalogue from the database, replacing any copy
+        already held.
+        '''
+
+        with database.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+              SELECT b.Habitat,
+                     a.ID,
+                     a.Name,
+                     a.Size,
+                     a.Food_Value,
+                     a.Game_Quality,
+                     a.min_lb,
+                     a.max_lb,
+                     a.mean_lb,
+                     a.sd_lb
+              FROM Fish a
+              INNER JOIN Habitats b
+                ON a.ID = b.Fish_ID
+              ORDER BY a.ID
+            ''')
+            rows = c.fetchall()
+
+        fish_by_id = {}
+        habitats = {}
+        for habitat, *fish in rows:
+            if fish[0] not in fish_by_id:
+                fish_by_id[fish[0]] = Fish(*fish,
+                                           MIN_SIZE * unit_factor(fish[2]))
+            habitats.setdefault(habitat, []).append(fish_by_id[fish[0]])
+
+        # Bit n of a habitat's mask is on if fish n lives there
+        masks = {habitat: sum(1 << fish.id for fish in set(fishes))
+                 for habitat, fishes in habitats.items()}
+
+        with self._lock:
+            self._habitats = {habitat: tuple(fish)
+                              for habitat, fish in habitats.items()}
+            self._masks = masks
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def reload(self):
+        '''Throw away the current copy and load the catalogue again.'''
+
+        self.load()
+
+    def ensure_loaded(self, margin=0):
+        '''Load the catalogue if it hasn't been, or if it will be stale
+        within `margin` seconds.
+
+        Loading borrows a connection, so anything which reads the
+        catalogue while holding one should call this first; otherwise
+        every connection could end up held by a caller waiting for
+        another.
+        '''
+
+        if self._habitats is None\
+           or time.time() - self.loaded_at > MAX_AGE - margin:
+            self.load()
+
+    def habitat(self, habitat):
+        '''Return a tuple of the fish which live in a habitat.'''
+
+        self.ensure_loaded()
+        return self._habitats.get(habitat, ())
+
+    def species_masks(self):
+        '''Return a dictionary of each habitat's species, as a bitset
+        like a player's in species.py.
+        '''
+
+        self.ensure_loaded()
+        return self._masks
+
+    def pick(self, habitat, rng=random):
+        '''Pick a random fish from a habitat.'''
+
+        return rng.choice(self.habitat(habitat))
+
+
+# The catalogue shared by everything in this worker
+catalogue = Catalogue()
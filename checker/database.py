@@ -0,0 +1,272 @@
+'''
+Pooled connections to the fishing game's PostgreSQL database.
+
+Opening a connection to Heroku's Postgres means a TLS handshake and a
+new backend process, which costs far more than the queries the bot
+actually runs. Every worker keeps a small pool of open connections
+instead and hands them out with `connection()`.
+
+If DATABASE_URL is a sqlite: URL, an embedded SQLite database is used
+instead (see sqlitedb.py). Both hand out connections the same way, so
+nothing else needs to know which one it is talking to.
+
+The database is opened the first time a connection is asked for, and
+psycopg2 is only imported then, so importing this module doesn't need
+DATABASE_URL to be set.
+'''
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from settings import settings
+from sqlitedb import SQLiteCursor, SQLiteDatabase
+
+# Connections idle for longer than this are checked before being reused
+HEALTH_CHECK_AFTER = 30
+
+
+def __getattr__(name):
+    # The errors either database can raise, as `database.Error`
+    if name == 'Error':
+        import psycopg2
+        return (psycopg2.Error, sqlite3.Error)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class ConnectionPool:
+    '''A thread-safe pool of connections which blocks when exhausted.
+
+    The underlying psycopg2 pool raises as soon as it runs out of
+    connections, so checkouts are gated by a semaphore instead. The pool
+    itself is only created once it is used in the current process, so it
+    is never shared across a fork.
+    '''
+
+    dialect = 'postgres'
+
+    def __init__(self, dsn, size, **kwargs):
+        self.dsn = dsn
+        self.size = size
+        self.kwargs = kwargs
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._slots = None
+        self._pool = None
+        self._pid = None
+        self._last_used = {}
+        self.metrics = {'checkouts': 0,
+                        'waits': 0,
+                        'wait_seconds': 0.0,
+                        'in_use': 0,
+                        'health_checks': 0,
+                        'reconnects': 0,
+                        'errors': 0}
+
+    def _get_pool(self):
+        '''Return this process's pool and the semaphore which gates it.
+
+        Both are replaced together after a fork, so a connection is
+        always checked back in through the semaphore it was checked out
+        with.
+        '''
+
+        from psycopg2 import pool
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = pool.ThreadedConnectionPool(0, self.size,
+                                                         self.dsn,
+                                                         **self.kwargs)
+                self._slots = threading.BoundedSemaphore(self.size)
+                self._last_used = {}
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    def _count(self, name, amount=1):
+        with self._metrics_lock:
+            self.metrics[name] += amount
+
+    def _is_healthy(self, conn):
+        '''Check whether a pooled connection can still be used.
+
+        One which hasn't been used yet has only just been opened, so it's
+        taken on trust.
+        '''
+
+        import psycopg2
+
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.time() - last_used < HEALTH_CHECK_AFTER:
+            return True
+        self._count('health_checks')
+        try:
+            with conn.cursor() as c:
+                c.execute('SELECT 1')
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _discard(self, pool, conn):
+        self._last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+
+    def _checkout(self):
+        '''Return a connection, and the pool and semaphore to check it
+        back in to.
+        '''
+
+        pool, slots = self._get_pool()
+        started = time.time()
+        if not slots.acquire(blocking=False):
+            self._count('waits')
+            slots.acquire()
+            self._count('wait_seconds', time.time() - started)
+
+        try:
+            conn = pool.getconn()
+            # Replace connections which died while sitting in the pool
+            while not self._is_healthy(conn):
+                self._count('reconnects')
+                self._discard(pool, conn)
+                conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
+
+        self._count('checkouts')
+        self._count('in_use')
+        return conn, pool, slots
+
+    def _checkin(self, conn, pool, slots, broken=False):
+        self._count('in_use', -1)
+        try:
+            if broken or conn.closed:
+                self._discard(pool, conn)
+            else:
+                self._last_used[id(conn)] = time.time()
+                pool.putconn(conn)
+        finally:
+            slots.release()
+
+    @contextmanager
+    def connection(self):
+        '''Borrow a connection for the duration of a with block.
+
+        The transaction is committed if the block succeeds and rolled back
+        if it raises. Connections which fail at the network level are
+        thrown away, so the next checkout opens a fresh one.
+        '''
+
+        import psycopg2
+
+        conn, pool, slots = self._checkout()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._count('errors')
+            broken = True
+            raise
+        except Exception:
+            self._count('errors')
+            conn.rollback()
+            raise
+        finally:
+            self._checkin(conn, pool, slots, broken)
+
+    def stats(self):
+        '''Return a snapshot of the pool's metrics.'''
+
+        with self._metrics_lock:
+            snapshot = dict(self.metrics)
+        snapshot['size'] = self.size
+        return snapshot
+
+
+def open_database(url):
+    '''Return the pool or embedded database for a database URL.'''
+
+    if url.startswith('sqlite:'):
+        # 'sqlite:///fishing.db' is a file relative to the working
+        # directory, 'sqlite:////tmp/fishing.db' an absolute path and
+        # 'sqlite://' a database held in memory
+        cursor_class = SQLiteCursor
+        if settings.metrics:
+            cursor_class = metrics.timed_cursor(cursor_class)
+        return SQLiteDatabase(url[len('sqlite:///'):] or ':memory:',
+                              cursor_class)
+
+    kwargs = {}
+    if settings.metrics:
+        from psycopg2 import extensions
+        kwargs['cursor_factory'] = metrics.timed_cursor(extensions.cursor)
+    return ConnectionPool(url, settings.pool_size, sslmode='require',
+                          **kwargs)
+
+
+def is_sqlite(c):
+    '''Check whether a cursor belongs to the embedded database.'''
+
+    return isinstance(c, SQLiteCursor)
+
+
+def execute_values(c, sql, rows, fetch=False):
+    '''Run an INSERT ... VALUES %s for all of `rows` in as few statements
+    as the database allows.
+    '''
+
+    if is_sqlite(c):
+        return c.execute_values(sql, rows, fetch)
+    from psycopg2 import extras
+    return extras.execute_values(c, sql, rows,
+                                 page_size=max(len(rows), 1), fetch=fetch)
+
+
+# The pool shared by everything in this worker, once it's been opened
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    '''Return the worker's pool, opening it if it hasn't been already.'''
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = open_database(settings.database_url)
+    return _pool
+
+
+def dialect():
+    '''Return 'postgres' or 'sqlite'.'''
+
+    return get_pool().dialect
+
+
+def connection():
+    '''Borrow a connection from the worker's pool.
+
+    With metrics on, its queries are timed under the name of the
+    function which borrowed it.
+    '''
+
+    if settings.metrics:
+        return metrics.borrowed(get_pool().connection(),
+                                sys._getframe(1).f_code.co_name)
+    return get_pool().connection()
+
+
+def stats():
+    '''Return the worker's pool metrics.'''
+
+    return get_pool().stats()
@@ -0,0 +1,199 @@
+'''
+Sends the bot's messages to the group.
+
+Every message goes through a single queue on the worker's event loop,
+which posts them one at a time under a token-bucket rate limit so bursts
+don't get the bot throttled. Posts which fail because of the network,
+rate limiting or a server error are retried with exponential backoff.
+Messages sent with the same key shortly after one another (e.g. the
+result of a trip and the level up it caused) are combined into one post;
+each key waits on a timer of its own, so only messages ready to be sent
+are ever in the queue and replies to commands go out straight away.
+'''
+
+import asyncio
+import logging
+import time
+
+from groupme import GroupMeClient, GroupMeError, RETRY_STATUSES
+from scheduler import trips
+
+logger = logging.getLogger(__name__)
+
+# Sustained posts per second, and how many can be sent at once after a lull
+RATE = 1
+BURST = 10
+
+# How many times to retry a post, and the delay before the first retry
+RETRIES = 4
+BACKOFF = 1
+
+# How long a keyed message waits for others to join it
+COALESCE_WINDOW = 2
+
+# GroupMe rejects messages longer than this
+MAX_LENGTH = 1000
+
+
+class TokenBucket:
+    '''Allows `rate` events per second on average, up to `burst` at once.'''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        '''Wait until a token is available and take it.'''
+
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._refill()
+        self._tokens -= 1
+
+
+def is_transient(error):
+    '''Check whether a failed post might succeed if it's tried again.
+
+    Only network errors, timeouts and the statuses GroupMe uses for
+    being busy qualify; anything else (e.g. a missing setting) would
+    only fail again.
+    '''
+
+    if isinstance(error, GroupMeError):
+        return error.status is None or error.status in RETRY_STATUSES
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    import aiohttp
+    return isinstance(error, aiohttp.ClientError)
+
+
+class Message:
+    '''A message waiting to be posted.'''
+
+    __slots__ = ('key', 'texts')
+
+    def __init__(self, key, text):
+        self.key = key
+        self.texts = [text]
+
+    @property
+    def text(self):
+        return '\n\n'.join(self.texts)
+
+
+class Dispatcher:
+    '''The queue of messages waiting to be posted.'''
+
+    def __init__(self, post=None, scheduler=trips, rate=RATE, burst=BURST,
+                 retries=RETRIES, backoff=BACKOFF,
+                 coalesce_window=COALESCE_WINDOW):
+        # The dispatcher does its own retrying, so its client doesn't
+        self._post = post or GroupMeClient(retries=0).post_message
+        self._scheduler = scheduler
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+        self._loop = None
+        self.counters = {'queued': 0,
+                         'coalesced': 0,
+                         'sent': 0,
+                         'retried': 0,
+                         'failed': 0}
+
+    def send(self, text, key=None):
+        '''Queue a message to be posted. Safe to call from any thread.
+
+        Messages with the same `key` which arrive within the coalescing
+        window are posted together.
+        '''
+
+        self._scheduler.loop.call_soon_threadsafe(self._enqueue, text, key)
+
+    def _start(self):
+        '''Set up the queue on the current loop.'''
+
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._waiting = {}
+        self._bucket = TokenBucket(self.rate, self.burst)
+        self._worker = self._loop.create_task(self._work())
+
+    def _enqueue(self, text, key):
+        # A forked worker gets a new loop, so it needs a new queue too
+        if self._loop is not asyncio.get_running_loop():
+            self._start()
+
+        self.counters['queued'] += 1
+        message = self._waiting.get(key) if key is not None else None
+        if message is not None\
+           and len(message.text) + len(text) + 2 <= MAX_LENGTH:
+            message.texts.append(text)
+            self.counters['coalesced'] += 1
+            return
+
+        message = Message(key, text)
+        if key is None:
+            self._queue.put_nowait(message)
+            return
+        # Give other messages with the same key a chance to join
+        self._waiting[key] = message
+        self._loop.call_later(self.coalesce_window, self._flush, message)
+
+    def _flush(self, message):
+        '''Queue a keyed message once its window has passed.'''
+
+        if self._waiting.get(message.key) is message:
+            del self._waiting[message.key]
+        self._queue.put_nowait(message)
+
+    async def _work(self):
+        while True:
+            message = await self._queue.get()
+            await self._bucket.acquire()
+            await self._deliver(message.text)
+
+    async def _deliver(self, text):
+        '''Post a message, retrying if it might succeed later.'''
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                await self._post(text)
+            except Exception as e:
+                if not is_transient(e) or attempt == self.retries:
+                    self.counters['failed'] += 1
+                    logger.error('Posting a message failed', exc_info=e)
+                    return False
+                self.counters['retried'] += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+            else:
+                self.counters['sent'] += 1
+                return True
+
+    def pending(self):
+        '''Return the number of posts waiting to be sent.'''
+
+        return self._queue.qsize() + len(self._waiting) if self._loop else 0
+
+    def stats(self):
+        '''Return a snapshot of the dispatcher's counters.'''
+
+        snapshot = dict(self.counters)
+        snapshot['pending'] = self.pending()
+        return snapshot
+
+
+# The dispatcher shared by everything in this worker
+dispatcher = Dispatcher()
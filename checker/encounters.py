@@ -0,0 +1,136 @@
+'''
+An index of who is out fishing where, for chance encounters.
+
+A fisher may run into someone else fishing at the same location. Rather
+than every trip asking the database who else is out there, each worker
+keeps the fishers at each location in memory: its own are added when
+they cast and removed when their trip ends or is reeled in. Everyone's
+are added as they cast (see events.py), and the ones still going are
+copied from CurrentFishers by the sweeper every FISHERS_COPY_INTERVAL to
+catch up on any missed.
+
+When a trip starts, the encounter (if it has one) is planned straight
+away from the fishers already at the location, and only costs a timer
+on the trip scheduler until it happens.
+'''
+
+import threading
+import time
+
+
+class FisherIndex:
+    '''The fishers at each location and when their trips resolve.
+
+    Safe to use from any thread.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Fishers whose trips this worker is running, by habitat
+        self._local = {}
+        self._local_habitats = {}
+        # Everyone in CurrentFishers when it was last read, by habitat
+        self._table = {}
+        # When each player's trip was last noted or removed, and where
+        # it is (None once removed), since the table was last read
+        self._changes = {}
+
+    def add(self, user_id, habitat, resolve_time):
+        '''Record a trip this worker is running.'''
+
+        with self._lock:
+            self._remove(user_id)
+            self._local.setdefault(habitat, {})[user_id] = resolve_time
+            self._local_habitats[user_id] = habitat
+
+    def note(self, user_id, habitat, resolve_time):
+        '''Record a trip which any worker is running, until the table is
+        next copied.
+        '''
+
+        with self._lock:
+            self._table.setdefault(habitat, {})[user_id] = resolve_time
+            self._changes[user_id] = (time.monotonic(), habitat, resolve_time)
+
+    def remove(self, user_id):
+        '''Forget a trip which has ended or been reeled in.'''
+
+        with self._lock:
+            self._remove(user_id)
+            for fishers in self._table.values():
+                fishers.pop(user_id, None)
+            self._changes[user_id] = (time.monotonic(), None, None)
+
+    def _remove(self, user_id):
+        habitat = self._local_habitats.pop(user_id, None)
+        if habitat is not None:
+            fishers = self._local[habitat]
+            del fishers[user_id]
+            if not fishers:
+                del self._local[habitat]
+
+    def replace_table(self, rows, read_at):
+        '''Replace the copy of CurrentFishers with `rows` of
+        (player ID, location, resolve time).
+
+        `read_at` is the time.monotonic() when the rows started being
+        read. Trips noted or removed since then are newer than the rows,
+        so they're kept as they are rather than undone.
+        '''
+
+        table = {}
+        habitats = {}
+        for user_id, habitat, resolve_time in rows:
+            table.setdefault(habitat, {})[user_id] = resolve_time
+            habitats[user_id] = habitat
+        with self._lock:
+            changes = {user_id: change
+                       for user_id, change in self._changes.items()
+                       if change[0] >= read_at}
+            for user_id, (_, habitat, resolve_time) in changes.items():
+                if user_id in habitats:
+                    del table[habitats[user_id]][user_id]
+                if habitat is not None:
+                    table.setdefault(habitat, {})[user_id] = resolve_time
+            self._table = table
+            self._changes = changes
+
+    def is_fishing(self, user_id):
+        '''Check whether this worker is running a trip for a player.'''
+
+        with self._lock:
+            return user_id in self._local_habitats
+
+    def at(self, habitat, now=None):
+        '''Return the (player ID, resolve time) of everyone still fishing
+        at a location.
+        '''
+
+        now = time.time() if now is None else now
+        with self._lock:
+            fishers = dict(self._table.get(habitat, ()))
+            fishers.update(self._local.get(habitat, ()))
+        return [(user_id, resolve_time)
+                for user_id, resolve_time in fishers.items()
+                if resolve_time > now]
+
+    def plan_encounter(self, user_id, habitat, delay, rng, now=None):
+        '''Pick someone for a fisher who has just cast to run into, and
+        how many seconds into the trip they meet.
+
+        Both trips must still be going when they meet. Returns None if
+        nobody else is fishing at the location.
+        '''
+
+        now = time.time() if now is None else now
+        others = [fisher for fisher in self.at(habitat, now)
+                  if fisher[0] != user_id]
+        if not others:
+            return None
+        other, resolve_time = rng.choice(others)
+        return other, rng.randint(0, max(int(min(resolve_time - now,
+                                                 delay)), 0))
+
+
+# The index shared by everything in this worker
+fishers = FisherIndex()
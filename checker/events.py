@@ -0,0 +1,229 @@
+'''
+Tells every worker about things which happen on any of them.
+
+A player's trip runs on whichever worker took their !gofish, but their
+!fish retry can land on any worker, and each worker keeps caches (the
+catalogue, the encounter index) of rows any of them may change. So
+anything the others need to hear about is published here as an event:
+
+- 'cast': a player has started a trip
+- 'cancel': a player has reeled in their line
+- 'catch': a player has landed a fish
+- 'reload': the fish in the catalogue have changed
+- 'topics': the encounter topics have changed
+
+Handlers subscribe to a kind of event and are called with its data as
+keyword arguments, on whichever thread the event arrives. They should
+be quick and safe to call from any thread.
+
+On Postgres, events are sent with NOTIFY and each worker LISTENs for
+them on a connection of its own, driven by the trip scheduler's loop.
+Events sent while a worker is reconnecting are missed, but the sweeper
+catches up on anything they would have told it about trips. The
+embedded database only serves a single process, so its events are just
+delivered to the handlers in this one.
+'''
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import threading
+import uuid
+
+import database
+from scheduler import in_thread
+from settings import settings
+
+# The channel the workers NOTIFY and LISTEN on
+CHANNEL = 'checkers_events'
+
+# Seconds to wait before listening again after the connection drops
+RECONNECT_DELAY = 5
+
+# The handlers for each kind of event, whichever bus is in use
+_handlers = collections.defaultdict(list)
+
+logger = logging.getLogger(__name__)
+
+counters = {'published': 0,
+            'received': 0,
+            'errors': 0}
+
+
+def subscribe(kind):
+    '''Call the decorated function whenever an event of `kind` happens
+    on any worker.
+    '''
+
+    def register(handler):
+        _handlers[kind].append(handler)
+        return handler
+
+    return register
+
+
+def deliver(kind, data):
+    '''Call the handlers for an event.
+
+    A failing handler doesn't stop the others from hearing about it.
+    '''
+
+    for handler in _handlers[kind]:
+        try:
+            handler(**data)
+        except Exception:
+            counters['errors'] += 1
+            logger.exception('Handling a %r event failed', kind)
+
+
+class LocalEventBus:
+    '''Delivers events to the handlers in this process.'''
+
+    def publish(self, kind, data):
+        counters['published'] += 1
+        deliver(kind, data)
+
+    async def listen(self):
+        '''Receive other workers' events until cancelled.'''
+
+        # There are no other workers, but the listener still counts as
+        # running, so it isn't started again on every request
+        await asyncio.get_running_loop().create_future()
+
+
+class PostgresEventBus(LocalEventBus):
+    '''Delivers events to the handlers in this process straight away,
+    and to every other worker through NOTIFY.
+    '''
+
+    def __init__(self, dsn, **kwargs):
+        self.dsn = dsn
+        self.kwargs = kwargs
+        self._origin = None
+        self._pid = None
+
+    @property
+    def origin(self):
+        '''Identifies this worker's events, so it can ignore their echo.'''
+
+        if self._pid != os.getpid():
+            self._origin = uuid.uuid4().hex
+            self._pid = os.getpid()
+        return self._origin
+
+    def publish(self, kind, data):
+        super().publish(kind, data)
+        payload = json.dumps({'origin': self.origin,
+                              'kind': kind,
+                              'data': data})
+        with database.connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT pg_notify(%s, %s)', (CHANNEL, payload))
+
+    def receive(self, payload):
+        '''Deliver an event sent by another worker.'''
+
+        event = json.loads(payload)
+        if event['origin'] == self.origin:
+            return
+        counters['received'] += 1
+        deliver(event['kind'], event['data'])
+
+    async def listen(self):
+        import psycopg2
+        from psycopg2 import extensions
+
+        loop = asyncio.get_running_loop()
+        # Nothing short of cancelling it stops the listener for good
+        while True:
+            try:
+                conn = await in_thread(psycopg2.connect, self.dsn,
+                                       **self.kwargs)
+            # Before 3.8, cancelling the listener raises an Exception
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Connecting to listen for events failed')
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            readable = asyncio.Event()
+            fileno = conn.fileno()
+            try:
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as c:
+                    c.execute(f'LISTEN {CHANNEL}')
+                loop.add_reader(fileno, readable.set)
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        # Handlers may query the database, so they're
+                        # kept off the loop
+                        try:
+                            await in_thread(self.receive, payload)
+                        except asyncio.CancelledError:
+                            raise
+                        except Exception:
+                            counters['errors'] += 1
+                            logger.exception('Skipping event %r', payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Listening for events failed')
+                await asyncio.sleep(RECONNECT_DELAY)
+            finally:
+                loop.remove_reader(fileno)
+                conn.close()
+
+
+def open_event_bus():
+    '''Return the event bus for the worker's database.'''
+
+    if database.dialect() == 'postgres':
+        return PostgresEventBus(settings.database_url, sslmode='require')
+    return LocalEventBus()
+
+
+# The bus shared by everything in this worker, once it's been opened
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    '''Return the worker's event bus, opening it if it hasn't been
+    already.
+    '''
+
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = open_event_bus()
+    return _bus
+
+
+def publish(kind, **data):
+    '''Tell every worker, this one included, about an event.
+
+    The data must be JSON serializable. This worker's handlers have run
+    by the time it returns.
+    '''
+
+    get_bus().publish(kind, data)
+
+
+async def listen():
+    '''Receive other workers' events, for as long as the worker runs.'''
+
+    await get_bus().listen()
+
+
+def stats():
+    '''Return a snapshot of the event counters.'''
+
+    return dict(counters)
@@ -2,22 +2,49 @@
 Module for the groupme fishing minigame.
 '''
 
-import pickle
-import psycopg2
-import re
-import statistics as stats
+import database
+import events
+import leaderboard
+import species
+from members import directory
+from encounters import fishers
+from topics import topics
+from dispatcher import dispatcher
+from scheduler import trips, in_thread, log_failure
+from rng import randomness, trip_stream, Stream
+from catalogue import catalogue, import_fishfacts
 import random
+import logging
 import math
 import time
-import requests
 import asyncio
 import os
+import json
+from collections import namedtuple
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
 
 #-------------------------------#
 #-- Defining module constants --#
 #-------------------------------#
 
-DATABASE_URL = os.environ['DATABASE_URL']
+# How long a trip can be overdue before another worker takes it over,
+# how often workers look for such trips, and how many they take at once
+SWEEP_GRACE = 120
+SWEEP_INTERVAL = 60
+SWEEP_BATCH = 20
+
+# Seconds between copies of CurrentFishers into the encounter index. Casts
+# are noted as they happen, so these only catch up on any events missed.
+FISHERS_COPY_INTERVAL = 600
+
+# How many of a player's largest catches are kept with their stats
+TOP_CATCHES = 5
+
+# castLine loads the catalogue again once it's this many seconds from
+# going stale, so it's never loaded in the middle of a cast
+CATALOGUE_MARGIN = 60
 
 LEVEL_CHECKS = {'rod':(
     (1, 5, "After catching 5 different kinds of fish, the regulars at {}'s local bass pro shop no longer view them with contempt. The employees agree to sell them a fiberglass fishing rod. They should have fewer problems when attempting to catch fish in the future."),
@@ -31,35 +58,40 @@ LEVEL_CHECKS = {'rod':(
                     (4, 1500, "Upon catching over 1,500lbs of fish, {} finds they have saved up enough money to purchase a skipper. Offshore fishing is finally possible. Big game fish are finally on the menu. Good luck!")
                 )}
 
-BOATS = (('kayak', 0,
+# A boat or rod: its name, how much it reduces the chance of a
+# problem when reeling in a fish, and how it's described to players
+Gear = namedtuple('Gear', ['name', 'bonus', 'description'])
+
+BOATS = (Gear('kayak', 0,
           'Not too stable. Good for rivers, flats, and backcountry fishing, but not for big bodies of water. Your starting boat.'),
-         ('dingy', 30,
+         Gear('dingy', 30,
           f'More stable than a kayak, but still pretty small. Allows for lake and nearshore fishing. Unlocked by catching over {LEVEL_CHECKS["boat"][0][1]}lbs of fish.'),
-         ('swamp boat', 60,
+         Gear('swamp boat', 60,
           f'Propelled by a fan. Good for backcountry and flats fishing. Unlocked by catching over {LEVEL_CHECKS["boat"][1][1]}lbs of fish.'),
-         ('bass boat', 80,
+         Gear('bass boat', 80,
          f'The end goal for most casual fishers. Comes with cupholders. Perfect for lake, inshore, reef, and river fishing. Unlocked by catching over {LEVEL_CHECKS["boat"][2][1]}lbs of fish.'),
-         ('skipper', 95,
+         Gear('skipper', 95,
          f'The "reel" fucking deal. The American dream incarnate. The only boat that allows for offshore fishing. Baby, you could catch a shark on this thing. Unlocked by catching over {LEVEL_CHECKS["boat"][3][1]}lbs of fish.'))
 
-BOAT_LEVELS ={'kayak': 1, 'dingy': 2, 'swamp boat': 3, 'bass boat': 4, 'skipper': 5}
+BOAT_LEVELS = MappingProxyType({boat.name: level for level, boat
+                                in enumerate(BOATS, 1)})
 
-RODS = (('driftwood and string', 0,
+RODS = (Gear('driftwood and string', 0,
          'It\'s a bit fragile, but it will get the job done. Your starting fishing rod.'),
-        ('fiberglass', 30,
+        Gear('fiberglass', 30,
         f'Stronger than driftwood, but a bit impersonal. Still not designed for large fish. Unlocked by catching {LEVEL_CHECKS["rod"][0][1]} different species of fish.'),
-        ('carbon fiber', 60,
+        Gear('carbon fiber', 60,
         f'Good for bigger fish. A standard among red-necks. Unlocked by catching {LEVEL_CHECKS["rod"][1][1]} different species of fish.'),
-        ('hand-crafted bamboo', 85,
+        Gear('hand-crafted bamboo', 85,
         f'A rod for people who appreciate the artwork of fishing. Slightly increases the likelihood of you catching a fish. Unlocked by catching {LEVEL_CHECKS["rod"][2][1]} different species of fish.'),
-        ('"the God Rod"', 98,
+        Gear('"the God Rod"', 98,
         f'Nobody knows what material comprises this rod. It seems to be glowing slightly. Increases the likelihood of you catching a fish. Unlocked by catching {LEVEL_CHECKS["rod"][3][1]} different species of fish.')
         )
 
-HABITATS_SET = {'Backcountry', 'Flats',
-                'Inshore', 'Lake',
-                'Nearshore', 'Offshore',
-                'Reef', 'River', 'Wreck'}
+HABITATS_SET = frozenset({'Backcountry', 'Flats',
+                          'Inshore', 'Lake',
+                          'Nearshore', 'Offshore',
+                          'Reef', 'River', 'Wreck'})
 
 TOPIC_ADJ = ("stupid", "nice", "silly",
              "fun", "dumb", "scintillating",
@@ -98,11 +130,28 @@ HABITATS_AVG_LB = {'Flats': {'size': 23.505147154761904,
                                 'description': "Only accessible on the skipper. You'll catch fish out here which you can't catch anywhere else. Who knows what you'll hook?"}
                   }
 
-WEIGHT_CONVERSIONS = {'kg': 2.204623,
-                      'lb': 1,
-                      'pound': 1,
-                      'oz': 0.0625,
-                      'ounce': 0.0625}
+# Nothing changes these, so they're read-only
+HABITATS_AVG_LB = MappingProxyType({name: MappingProxyType(info)
+                                    for name, info
+                                    in HABITATS_AVG_LB.items()})
+
+# The habitats each boat level can reach, for picking one at random
+HABITATS_BY_LEVEL = tuple(tuple(sorted(name for name, info
+                                       in HABITATS_AVG_LB.items()
+                                       if info['level'] <= level))
+                          for level in range(len(BOATS) + 1))
+
+# The replies to '!fish boats', '!fish rods' and '!fish locations'
+BOATS_INFO, RODS_INFO = ("\n\n".join(f"Tier {num}, {gear.name.title()}: "
+                                      f"{gear.description}"
+                                      for num, gear in enumerate(tiers, 1))
+                         for tiers in (BOATS, RODS))
+HABITATS_INFO = "\n".join(f"{name}: requires the "
+                           f"{BOATS[HABITATS_AVG_LB[name]['level'] - 1].name}"
+                           for name in sorted(HABITATS_SET,
+                                              key=lambda name:
+                                              (HABITATS_AVG_LB[name]['level'],
+                                               name)))
 
 ACTIVITIES = ('have a beer.',
               'resist the urge to check twitter.',
@@ -132,114 +181,39 @@ easter_eggs = ("While traveling back to shore, {0} thinks they hear singing over
 
 def rebuildDB(reinsert=None):
     '''
-    This rebuilds the entire fishing SQLite database.
+    This brings the fishing database's schema up to date.
+
+    With `reinsert`, the fish facts are loaded as well, and a count of
+    the rows loaded and skipped is returned.
     '''
 
     #------------------------------#
     #-- Create the fish database --#
     #------------------------------#
 
+    # Only needed here, so workers don't pay to import them
+    import migrations
+    import pickle
+
     # Load the fish data into memory as a dictionary
-    with open('fishfacts.pickle', mode='rb') as f:
+    with open(os.path.join(os.path.dirname(__file__), 'data',
+                           'fishfacts.pickle'), mode='rb') as f:
         fishfacts = pickle.load(f)
 
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-
-    c = conn.cursor()
-
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS Fish (
-       ID INT UNIQUE GENERATED ALWAYS AS IDENTITY,
-       Name TEXT NOT NULL UNIQUE,
-       Size TEXT NOT NULL,
-       Food_Value TEXT NOT NULL,
-       Game_Quality TEXT NOT NULL
-       )
-    ''')
-
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS Habitats (
-       Habitat TEXT NOT NULL,
-       Fish_ID INTEGER NOT NULL,
-       FOREIGN KEY (Fish_ID)
-          REFERENCES Fish (ID),
-       UNIQUE (Habitat, Fish_ID)
-       )
-    ''')
-
-    c.execute('''
-      CREATE TABLE IF NOT EXISTS Players (
-        ID INT UNIQUE,
-        Rod_level INT NOT NULL,
-        Boat_level INT NOT NULL
-    );
-    ''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS Catches (
-      Catch_ID INT UNIQUE GENERATED ALWAYS AS IDENTITY,
-      Player_ID INTEGER NOT NULL,
-      Fish_ID INTEGER NOT NULL,
-      Size INTEGER NOT NULL,
-      FOREIGN KEY (Player_ID)
-        REFERENCES Players (ID),
-      FOREIGN KEY (Fish_ID)
-        REFERENCES Fish (ID)
-    )
-    ''')
+    with database.connection() as conn:
+        c = conn.cursor()
 
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS CurrentFishers (
-      Player_ID INT UNIQUE,
-      Resolve_time INT NOT NULL,
-      Location TEXT NOT NULL,
-      FOREIGN KEY (Player_ID)
-        REFERENCES Players (ID)
-      )
-    ''')
+        # Bring the schema up to date
+        migrations.migrate(c)
 
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS Topics (
-      topic TEXT UNIQUE,
-      Christopher INT,
-      Danny INT,
-      Evan INT,
-      Dylan INT,
-      Lars INT,
-      Cole INT,
-      Diego INT,
-      Taco INT,
-      Marcus INT,
-      Everyone INT
-      )
-    ''')
+        if reinsert:
+            # Insert the fish data into the tables
+            report = import_fishfacts(c, fishfacts)
 
+    # Pick up the new fish in every worker
     if reinsert:
-        # Insert the fish data into the tables
-        for fishname, fishatts in fishfacts.items():
-            # Ignore invalid data
-            if len(fishatts) != 4 : continue
-            if re.search('in|f|c|m|"', fishatts['Size']): continue
-
-            # Insert the data
-            c.execute('''INSERT INTO Fish (Name,
-                         Size,
-                         Food_Value,
-                         Game_Quality) VALUES (%s, %s, %s, %s)''',
-                      (fishname, fishatts['Size'],
-                       fishatts['Food Value'],
-                       fishatts['Game Qualities']))
-            c.execute('''SELECT ID FROM Fish WHERE Name = %s''', (fishname,))
-            id = c.fetchone()[0]
-            habitats = fishatts['Habitats'].split(', ')
-            for habitat in habitats:
-                c.execute('''INSERT INTO Habitats
-                                (Habitat, Fish_ID)
-                            VALUES (%s, %s)''', (habitat, id))
-
-    # Close the SQLite connection
-    conn.commit()
-    conn.close()
-
+        events.publish('reload')
+        return report
 
 def calc_avg_habitat(habitat):
     '''
@@ -247,37 +221,16 @@ def calc_avg_habitat(habitat):
     Used to generate the HABITATS_AVG_LB constant.
     '''
 
-    # Get the sizes
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-    c = conn.cursor()
-    c.execute('''SELECT Size
-                 FROM Fish
-                 WHERE ID IN (
-                   SELECT Fish_ID
-                   FROM Habitats
-                   WHERE Habitat = %s)''', (habitat,)
-              )
-    size_raw = [size[0] for size in c.fetchall()]
-    # Extract the numbers
-    size_list = [re.findall(r'[0-9.]+', entry)
-                 for entry in size_raw]
-    # Find the metric
-    metric_regex = "|".join(WEIGHT_CONVERSIONS.keys())
-    metrics = [re.search(metric_regex, string)[0]
-               for string in size_raw]
-
-    def compute_avg(nums, metric):
-        if len(nums) > 2: nums = nums[:2]
-        nums = [float(num) for num in nums]
-        avg = stats.mean(nums)
-        avg_normalized = avg * WEIGHT_CONVERSIONS[metric]
-        return avg_normalized
-
-    avgs = [compute_avg(entry, met)
-            for entry, met in zip(size_list, metrics)]
-    conn.commit()
-    conn.close()
-    return stats.mean(avgs)
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT avg(a.mean_lb)
+                     FROM Fish a
+                     INNER JOIN Habitats b
+                       ON a.ID = b.Fish_ID
+                     WHERE b.Habitat = %s''', (habitat,)
+                  )
+        avg = c.fetchone()[0]
+    return avg
 
 
 def calc_habitat_catch_rate_modifier(habitat):
@@ -300,13 +253,19 @@ def calc_fish_difficulty(size):
     return (100/(1 + math.exp(0.12*(50-size))))
 
 
-def goFishing(habitat, boat, boat_level, rod_level):
+def goFishing(habitat, boat, boat_level, rod_level, rng=None):
     '''
     Return a fish if one is caught, or nothing if one is not caught.
     Also check if something else goes wrong; if it does, return
     a string.
+
+    Everything random is drawn from `rng`, the trip's Stream, or a fresh
+    one if it isn't given.
     '''
 
+    if rng is None:
+        rng = Stream()
+
     # Check if they have access to their requested boat
     if BOAT_LEVELS[boat] > boat_level: return "You can't use this boat yet."
     # Check if their boat level is high enough for the habitat
@@ -320,50 +279,27 @@ def goFishing(habitat, boat, boat_level, rod_level):
     # Calculate how likely a catch is based on the habitat
     catchrate = calc_habitat_catch_rate_modifier(habitat)
 
+    # Roll the dice for the catch and for problems with the rod and the
+    # boat all at once
+    catch_roll, rod_roll, boat_roll = rng.randints(3, 0, 100)
+
     # Use the catchrate to randomly decide if a fish is caught.
     # If not, return nothing.
-    if random.randint(0, 100) > catchrate: return None
+    if catch_roll > catchrate: return None
 
 
     #----------------------------#
     #-- Generate a random fish --#
     #----------------------------#
 
-    # A fish is caught; select a fish from the DB and
+    # A fish is caught; pick a fish from the catalogue and
     # generate an appropriate size.
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-        c = conn.cursor()
-        c.execute('''
-          SELECT *
-          FROM Fish
-          WHERE ID IN
-            (SELECT Fish_ID
-            FROM Habitats
-            WHERE Habitat = %s)
-          ORDER BY random()
-          LIMIT 1''',
-                  (habitat,))
-        fish = c.fetchone()
-
-    # Generate the size ----------------------------------------------------
-    # Extract the average size range
-    size_list = [float(vals) for vals in
-                 re.findall(r'[0-9.]+', fish[2])]
-    # Truncate the list to only the first two values (if there are more than 1)
-    if len(size_list) > 2: size_list = size_list[:2]
-    # Find the average size
-    avg_size = stats.mean(size_list)
-    # Find the standard deviation
-    sd = (max(size_list) - min(size_list))/4 if len(size_list) > 1 else size_list[0]/10
-    # Generate a size from the normal distribution
-    fish_size = max(random.gauss(avg_size, sd), 0.2)
-
-    # Normalize the weight --------------------------------------------------
-    # Find the metric
-    metric_regex = "|".join(WEIGHT_CONVERSIONS.keys())
-    metric = re.search(metric_regex, fish[2])[0]
-    # Normalize the weight
-    fish_size_normalized = round(fish_size * WEIGHT_CONVERSIONS[metric],
+    fish = catalogue.pick(habitat, rng)
+
+    # Generate a size in pounds from the normal distribution, no smaller
+    # than the fish's floor
+    fish_size_normalized = round(max(rng.gauss(fish.mean_lb, fish.sd_lb),
+                                     fish.floor_lb),
                                  2)
 
 
@@ -373,466 +309,586 @@ def goFishing(habitat, boat, boat_level, rod_level):
 
     difficulty = calc_fish_difficulty(fish_size_normalized)
     # Check if there was a problem with the rod
-    if random.randint(0, 100) < difficulty - RODS[rod_level - 1][1]:
-        return problem('rod')
+    if rod_roll < difficulty - RODS[rod_level - 1][1]:
+        return problem('rod', rng)
     # Check if there was a problem with the boat
-    elif random.randint(0, 100) < difficulty - BOATS[boat_level - 1][1]:
-        return problem('boat')
+    elif boat_roll < difficulty - BOATS[boat_level - 1][1]:
+        return problem('boat', rng)
     # If not, return a tuple containing info about the fish
     else:
-        return (tuple(fish), fish_size_normalized)
+        return (fish.row, fish_size_normalized)
 
 
-def problem(prob_type):
+def problem(prob_type, rng=random):
     rod = ["{} hooked a fish but it was too strong for their fishing rod. They had to cut the line to keep it from snapping.",
            "{} caught something, but whatever it was, it was too strong; after a long fight, their line snapped and the fish escaped.",
            "{} hooked something, but it proved too strong for their fishing line. Their line snapped."]
     boat = ["{} was caught off guard by a large catch and was pulled overboard. How humbling.",
             "{} caught something big but their boat wasn't steady enough to reel it in. They cut the line to avoid capsizing."]
     if prob_type == "rod":
-        return random.choice(rod)
+        return rng.choice(rod)
     elif prob_type == "boat":
-        return random.choice(boat)
+        return rng.choice(boat)
 
 
-def getInfo(topic="user", user_id=None):
+def getInfo(topic="user", user_id=None, board=None):
     '''Return various strings when the user
     requests info.
-    '''
-
-    def stringify_info(obj):
-        '''Format the string for rods and boat info.
-        '''
-
-        return "\n\n".join([": ".join(["Tier "
-                                       + str(num + 1)
-                                       + ", "
-                                       + entry[0].title(), entry[2]])
-                            for num, entry in enumerate(obj)])
 
-    def format_habs():
-        '''Format the sting for habitat info.
-        '''
-
-        sorted_locations = sorted(HABITATS_SET,
-                                  key=lambda x: HABITATS_AVG_LB[x]['level'])
-        return "\n".join(["{}: requires the {}"\
-                          .format(name,
-                                  BOATS[HABITATS_AVG_LB[name]['level'] - 1][0])
-                          for name in sorted_locations])
+    For the leaderboard, `board` may be a habitat or 'week' to show
+    that board instead of the overall ones.
+    '''
 
-    async def inner_wrapper(topic="leaderboard", user_id=user_id):
+    async def inner_wrapper(board=board):
         '''This lets us call the groupme api and get the sql
-        calls concurrently.
+        calls concurrently. The queries run on the loop's thread pool
+        while the member directory is awaited.
         '''
 
-        # Schedule getting the users
-        get_users_task = asyncio.create_task(get_users_from_api())
-
-        # Get the leaderboard data
-        with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-            c = conn.cursor()
-
-            # Biggest Fish
-            c.execute('''
-            SELECT Player_ID,
-                   c.Name,
-                   Catches.size
-            FROM Catches
-            INNER JOIN Fish c
-              ON Catches.Fish_ID = c.ID
-            ORDER BY Catches.size DESC
-            LIMIT 5
-            ''')
-            biggest_fish = c.fetchall()
-
-            # Most pounds of fish
-            c.execute('''
-            SELECT Player_ID,
-                   sum(size) AS pounds
-            FROM Catches
-            GROUP BY Player_ID
-            ORDER BY pounds DESC
-            LIMIT 5
-            ''')
-            most_pounds = c.fetchall()
-
-            # Most different kinds of fish
-            c.execute('''
-            SELECT Player_ID,
-                   count(Fish_ID) AS Species
-            FROM (
-              SELECT DISTINCT Player_ID,
-                              Fish_Id
-              FROM Catches
-            ) AS distinct_catches
-            GROUP BY Player_ID
-            ORDER BY Species DESC
-            LIMIT 5
-            ''')
-            different_fish = c.fetchall()
-
-        await get_users_task
-
-        # Get the user nicknames
-        users = get_users_task.result()
-        gm_users = {entry['user_id']: entry['nickname']
-                    for entry in users}
-
-        # Join the data
-        biggest_fish_joined = [(gm_users[str(entry[0])], entry[1], entry[2])
-                               for entry in biggest_fish if str(entry[0])
-                               in gm_users.keys()]
-        most_pounds_joined = [(gm_users[str(entry[0])], entry[1])
-                               for entry in most_pounds if str(entry[0])
-                               in gm_users.keys()]
-        different_fish_joined = [(gm_users[str(entry[0])], entry[1])
-                                 for entry in different_fish if str(entry[0])
-                                 in gm_users.keys()]
+        # Get the leaderboard data. Each board is kept up to date as
+        # fish are caught, so this only reads a few rows.
+        catch_line = "{}. {}, {}, {}lbs"
+        pounds_line = "{}. {}, {} total lbs"
+        species_line = "{}. {}, {} total species"
+        if board is None:
+            boards = ((leaderboard.BIGGEST, "Biggest fish caught", catch_line),
+                      (leaderboard.POUNDS, "Most lbs of fish", pounds_line),
+                      (leaderboard.SPECIES, "Most species of fish caught",
+                       species_line))
+        elif board == 'week':
+            boards = ((leaderboard.weekBoard(), "Most lbs of fish this week",
+                       pounds_line),)
+        else:
+            boards = ((leaderboard.habitatBoard(board),
+                       f"Biggest fish caught in the {board}", catch_line),)
+        # Get the user nicknames alongside the entries
+        gm_users, *entries = await asyncio.gather(
+            directory.nicknames(),
+            *[in_thread(leaderboard.topEntries, name)
+              for name, _, _ in boards])
 
         # Make the data into readable strings
-        bf_string = "Biggest fish caught\n----------------------\n"\
-                    + "\n".join(["{}. {}, {}, {}lbs"\
-                                   .format(num + 1, entry[0],
-                                           entry[1], entry[2])
-                                   for num, entry
-                                   in enumerate(biggest_fish_joined)])
-
-        mp_string = "Most lbs of fish\n-------------------------\n"\
-                    + "\n".join(["{}. {}, {} total lbs"\
-                                   .format(num + 1, entry[0], entry[1])
-                                   for num, entry
-                                   in enumerate(most_pounds_joined)])
-
-        df_string = "Most species of fish caught\n-------------------------\n"\
-                    + "\n".join(["{}. {}, {} total species"\
-                                   .format(num + 1, entry[0], entry[1])
-                                   for num, entry
-                                   in enumerate(different_fish_joined)])
-        return "\n\n".join([bf_string, mp_string, df_string])
+        strings = []
+        for (_, title, line), board_entries in zip(boards, entries):
+            # Join the data. Only catch boards have a label (the fish).
+            joined = [(gm_users[str(entry[0])],)
+                      + ((entry[1],) if entry[1] is not None else ())
+                      + (entry[2],)
+                      for entry in board_entries
+                      if str(entry[0]) in gm_users.keys()]
+            strings.append(title + "\n-------------------------\n"
+                           + "\n".join([line.format(num + 1, *entry)
+                                        for num, entry
+                                        in enumerate(joined)]))
+        return "\n\n".join(strings)
 
     if topic =="user":
         # Return user stats
         data = getUser(user_id)
-        user_catches = getUserCatches(user_id)
+        total_lbs, catch_count, species_count, top_catches = getPlayerStats(user_id)
         return "Boat level: {}\nRod level: {}\n".format(data[2], data[1])\
                + "Total number of fish caught: {}\nNumber of species caught: {}/169\nTotal lbs of fish caught: {}\n\n"\
-                   .format(len(user_catches), countUniqueCatches(user_id), sumTotalPoundsCaught(user_id))\
+                   .format(catch_count, species_count, total_lbs)\
                + "Largest fish caught:\n"\
                + "\n".join(["{}. {}, {}lbs".format(num + 1, entry[0], entry[1])
                             for num, entry
-                            in enumerate(user_catches[:min(
-                                5,
-                                len(user_catches)
-                            )])])\
+                            in enumerate(top_catches)])
 
     elif topic == 'lstats':
         return "Catches by habitat:\n"\
                + countCatchesByHabitat(user_id)
     # Display leaderboard data
     elif topic == "leaderboard":
-        return asyncio.run(inner_wrapper())
+        return trips.run(inner_wrapper())
     # Display boat data
     elif topic.lower() == "boats":
-        return stringify_info(BOATS)
+        return BOATS_INFO
     # Display rod data
     elif topic.lower() == "rods":
-        return stringify_info(RODS)
+        return RODS_INFO
     # Display aggregate habitat info
     elif topic.lower() == "habs":
-        return format_habs()
+        return HABITATS_INFO
     # Display habitat information
     elif topic.title() in HABITATS_AVG_LB.keys():
         return HABITATS_AVG_LB[topic.title()]['description']
 
 
-async def get_users_from_api():
-    '''This fetches users from the groupme API.
-
-    It is an async function, so we can schedule a task in our wrapper
-    function and await the results while doing other, non I/O bound
-    things.
-    '''
-
-    r = requests.get('https://api.groupme.com/v3/groups/16489941',
-                     params = {'token': os.environ['token']})\
-                .json()['response']['members']
-
-    return r
-
-
 def getUser(user_id):
     '''Get a user's values from the database.
     '''
 
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
+    with database.connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT ID FROM Players")
-        users = [id[0] for id in c.fetchall()]
-        if user_id not in users:
-            c.execute("INSERT INTO Players VALUES (%s, 1, 1) ON CONFLICT DO NOTHING", (user_id,))
-            conn.commit()
-        c.execute("SELECT * FROM Players WHERE ID = %s", (user_id,))
+        # Add the player if they're new
+        c.execute('''
+          INSERT
+          INTO Players
+          VALUES (%s, 1, 1)
+          ON CONFLICT (ID) DO UPDATE SET ID = EXCLUDED.ID
+          RETURNING *
+        ''', (user_id,))
         player_data = c.fetchone()
+        conn.commit()
     return tuple(player_data)
 
 
-def pickViableHabitat(level):
+def pickViableHabitat(level, rng=random):
     '''Pick a viable habitat when supplied with a user's
     boat level.
     '''
 
-    options = [entry[0] for entry in HABITATS_AVG_LB.items()
-               if entry[1]['level'] <= level]
-    return random.choice(options)
+    return rng.choice(HABITATS_BY_LEVEL[level])
 
 
-def fetchCurrentFishers():
-    '''Get a list of the player ID for people who are
-    currently fishing. Returns a list.
+def tripDelay(rod_level, rng=random):
+    '''Pick how many seconds a trip lasts. Better rods
+    make for shorter trips.
     '''
 
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-        c = conn.cursor()
-        c.execute('''
-          SELECT Player_ID
-          FROM CurrentFishers
-        ''')
-        fishers = [entry[0] for entry in c.fetchall()]
-    return fishers
+    return max(0, int(rng.gauss(60 - (3 * rod_level),
+                                20)) * 60)
+
+
+def castLine(user_id, habitat=None, boat=None, seed=None):
+    '''Start a fishing trip.
 
+    Everything happens in one transaction: the player is added if
+    they're new, their trip is decided, and they're added to the table of
+    current fishers along with the outcome of their trip and the time it
+    resolves, so any worker can finish the trip if the one which started
+    it goes away. If no habitat or boat is given, a random habitat they
+    can visit and their best boat are picked.
+
+    The trip is decided by a Stream seeded with `seed`, or with the
+    player's next seed from the RandomService, and the seed is stored
+    with the trip so the rest of it can be drawn from the same seed.
+
+    Returns the player's (ID, rod level, boat level), the habitat, the
+    trip's delay in seconds and its seed. Returns None if they're
+    already fishing, or a string if they can't fish where or how they
+    asked to.
+    '''
 
-def addCurrentFisher(user, location, rod_level):
-    delay = max(0, int(random.gauss(60 - (3 * rod_level),
-                                    20)) * 60)
-    end_time = time.time() + delay
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
+    if seed is None:
+        seed = randomness.trip_seed(user_id)
+    rng = Stream(seed)
+
+    # The fish are picked while a connection is held, so the catalogue
+    # mustn't need loading then
+    catalogue.ensure_loaded(margin=CATALOGUE_MARGIN)
+
+    with database.connection() as conn:
         c = conn.cursor()
 
+        # Add the player if they're new, and find out whether they're
+        # already fishing
+        c.execute('''
+          INSERT
+          INTO Players
+          VALUES (%s, 1, 1)
+          ON CONFLICT (ID) DO UPDATE SET ID = EXCLUDED.ID
+          RETURNING ID,
+                    Rod_level,
+                    Boat_level,
+                    EXISTS (SELECT 1
+                            FROM CurrentFishers
+                            WHERE Player_ID = %s)
+        ''', (user_id, user_id))
+        *player, fishing = c.fetchone()
+        if fishing:
+            return None
+        player_id, rod_level, boat_level = player
+
+        habitat = habitat or pickViableHabitat(boat_level, rng)
+        boat = boat or BOATS[boat_level - 1][0]
+        fish_catch = goFishing(habitat, boat, boat_level, rod_level, rng)
+
+        # Check for improper input (this is an ugly way of doing this)
+        if fish_catch in { "You can't use this boat yet.",
+                           "Your boat isn't well suited to fishing in this location."}:
+            return fish_catch
+
+        delay = tripDelay(rod_level, rng)
+        resolve_time = time.time() + delay
         c.execute('''
           INSERT
           INTO CurrentFishers
-          VALUES (%s, %s, %s)
+            (Player_ID, Resolve_time, Location,
+             Outcome, Boat_level, Rod_level, Seed)
+          VALUES (%s, %s, %s, %s, %s, %s, %s)
           ON CONFLICT DO NOTHING
-        ''', (user,
-              end_time,
-              location))
+          RETURNING Player_ID
+        ''', (player_id,
+              resolve_time,
+              habitat,
+              encodeOutcome(fish_catch),
+              boat_level,
+              rod_level,
+              seed))
+        # Nothing comes back if a cast racing this one got there first
+        if c.fetchone() is None:
+            return None
 
         conn.commit()
 
-    return abs(delay)
+    # Let every worker know they're out there, for encounters
+    events.publish('cast', user_id=player_id, habitat=habitat,
+                   resolve_time=resolve_time)
+
+    return tuple(player), habitat, delay, seed
 
 
-def resolveFisher(fish_catch, user_id, habitat, delay, boat_level, rod_level):
+def encodeOutcome(fish_catch):
+    '''Serialize the result of goFishing() for the CurrentFishers table.
     '''
-    The process which runs when someone starts fishing.
-    This runs on its own process, so Flask can return a value
-    and end the connection while still sending a reply much later.
-    Hopefully, this will avoid timeouts.
+
+    return json.dumps(fish_catch)
+
+
+def decodeOutcome(outcome):
+    '''Turn a stored outcome back into what goFishing() returned.
     '''
 
-    async def inner_wrapper(fish_catch=fish_catch,
-                            user_id=user_id,
-                            habitat=habitat,
-                            delay=delay):
-        '''This lets us await get_users_from_api while still running
-        resolveFisher as an independent process. In practice,
-        this contains almost all of the code which is run
-        when resolveFisher is called.
-        '''
+    if outcome is None:
+        return None
+    fish_catch = json.loads(outcome)
+    # Caught fish are stored as a list of [fish row, size]
+    if type(fish_catch) == list:
+        return (tuple(fish_catch[0]), fish_catch[1])
+    return fish_catch
+
+
+def settleTrip(c, trip):
+    '''Store the fish caught on a trip being claimed with the cursor `c`,
+    if one was.
+
+    Returns the player's updated stats as registerCatch() does, and
+    their species set, or (None, None) if they didn't catch anything.
+    '''
+
+    user_id, habitat, outcome = trip[:3]
+    fish_catch = decodeOutcome(outcome)
+    if type(fish_catch) != tuple:
+        return None, None
+    return storeCatch(c, user_id, fish_catch, habitat)
+
+
+def claimTrip(user_id):
+    '''Remove a fisher from the table of current fishers and return
+    their trip, and their updated stats if they caught a fish.
 
-        #------------------------------------------#
-        #-- Fetch nicknames from the Groupme API --#
-        #------------------------------------------#
-
-        # Start an asyncio task to get the users from the API
-        groupme_users = asyncio.create_task(get_users_from_api())
-        user_nickname = False
-
-        #--------------------------------#
-        #-- Random Encounters Behavior --#
-        #--------------------------------#
-
-        # There's a 1 in 3 chance of meeting another fisher
-        if random.randint(1, 3) == 1:
-            # Get the other fishers who are in the same location
-            with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-                c = conn.cursor()
-                c.execute('''
-                  SELECT Player_ID, Resolve_time
-                  FROM CurrentFishers
-                  WHERE Location =%s
-                ''', (habitat,))
-                # Exclude the current fisher from the list
-                results = [result
-                           for result in c.fetchall()
-                           if result[0] != user_id]
-
-            # If there are other fishers:
-            if results:
-                # Pick a random one
-                fisher = random.choice(results)
-                # Pick a random amount of time to delay. Make sure
-                # it's an integer, less than the amount of time
-                # before either fisher resolves, and more than
-                # zero.
-                interact_delay = random\
-                    .randint(0, max(int(min(fisher[1] - time.time(),
-                                            delay)),
-                                    0))
-
-                # Wait the specified amount of time
-                await asyncio.sleep(interact_delay)
-
-                # Get the group members
-                await groupme_users
-                # Extract the result from the asyncio.Task object
-                groupme_users_result = groupme_users.result()
-                fisher_fname = [user for user in groupme_users_result
-                                 if user['user_id'] ==\
-                                 str(user_id)][0]['name'].split()[0]
-                # Find the user's nickname
-                user_nickname = [user for user in groupme_users_result
-                                 if user['user_id'] ==\
-                                 str(user_id)][0]['nickname']
-                # Find the selected other fisher's nickname
-                other_nickname = [user for user in groupme_users_result
-                                  if user['user_id'] ==\
-                                  str(fisher[0])][0]['nickname']
-
-                # Get the fisher's first name to index their topics
-                with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-                    c = conn.cursor()
-                    try:
-                        c.execute(f'''
-                          SELECT topic
-                          FROM Topics
-                          WHERE {fisher_fname} = 1
-                        ''')
-                    except:
-                        c.execute('''
-                          SELECT topic
-                          FROM Topics
-                          WHERE Everyone = 1
-                        ''')
-                    topic = random.choice([entry[0] for
-                                           entry in c.fetchall()])
-
-                # Select a random adjective
-                adj = random.choice(TOPIC_ADJ)
-
-                # Send a message about the conversation they have
-                message = f"{user_nickname} encounters {other_nickname} out on the waters. They have a {adj} conversation about {topic}."
-
-                # Specify what message to send
-                data = {'bot_id': os.environ['bot_id'],
-                        'text': message}
-
-                # Send the post request to the group
-                if checkStillFishing(user_id):
-                    r = requests.post('https://api.groupme.com/v3/bots/post',
-                                      data=data)
-
-                # Update the waiting time
-                delay -= interact_delay
-
-        #------------------------------------------#
-        #-- Respond to the fishing request after --#
-        #-- some time has passed ------------------#
-        #------------------------------------------#
+    Whoever gets the row back is the one who resolves the trip, so it is
+    only ever resolved once. Their catch is stored in the same
+    transaction, so if storing it fails the trip stays in the table for
+    the sweeper to try again. Returns None if the trip was already
+    resolved or reset with !fish retry.
+    '''
+
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+          DELETE
+          FROM CurrentFishers
+          WHERE Player_ID = %s
+          RETURNING Player_ID, Location, Outcome, Boat_level, Rod_level, Seed
+        ''', (int(user_id),))
+        trip = c.fetchone()
+        if trip is None:
+            return None
+        trip = tuple(trip)
+        player_stats, caught = settleTrip(c, trip)
+        conn.commit()
+
+    if caught is not None:
+        species.players.remember(trip[0], caught)
+    return trip, player_stats
+
+
+# Takes the trips due before a time, up to a limit, out of CurrentFishers
+CLAIM_DUE_TRIPS = '''
+  DELETE
+  FROM CurrentFishers
+  WHERE Player_ID IN (
+    SELECT Player_ID
+    FROM CurrentFishers
+    WHERE Resolve_time <= %s
+    ORDER BY Resolve_time
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED)
+  RETURNING Player_ID, Location, Outcome, Boat_level, Rod_level, Seed
+'''
+
+
+def claimDueTrips(grace=SWEEP_GRACE, limit=SWEEP_BATCH):
+    '''Claim trips which should have resolved at least `grace` seconds ago.
+
+    These are trips whose worker died before it could finish them. Rows
+    locked by another sweeper are skipped, so several workers can sweep
+    at once without resolving the same trip twice. Returns a list of
+    (trip, stats) as claimTrip() does.
+    '''
+
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute(CLAIM_DUE_TRIPS, (time.time() - grace, limit))
+        due = [tuple(trip) for trip in c.fetchall()]
+        settled = [settleTrip(c, trip) for trip in due]
+        conn.commit()
+
+    for trip, (_, caught) in zip(due, settled):
+        if caught is not None:
+            species.players.remember(trip[0], caught)
+    return [(trip, player_stats)
+            for trip, (player_stats, _) in zip(due, settled)]
+
+
+async def sweepTrips(interval=SWEEP_INTERVAL):
+    '''Periodically resolve trips left behind by dead workers.
+
+    Runs on the trip scheduler from the moment a worker starts, so
+    trips pending when a dyno is cycled are finished by whichever
+    worker comes up first. Every FISHERS_COPY_INTERVAL it also copies
+    CurrentFishers into the encounter index, so fishers can meet those
+    sent out by other workers even if their casts were missed.
+    '''
 
+    copied_at = None
+    # Whatever goes wrong with one sweep, the next one tries again
+    while True:
+        try:
+            due = await in_thread(claimDueTrips)
+        # Before 3.8, cancelling the sweeper raises an Exception
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Sweeping for overdue trips failed')
+            due = []
+        started = time.monotonic()
+        if copied_at is None or started - copied_at >= FISHERS_COPY_INTERVAL:
+            try:
+                fishers.replace_table(await in_thread(getAllFishers), started)
+                copied_at = started
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Copying CurrentFishers failed')
+        for trip, player_stats in due:
+            asyncio.create_task(finishTrip(trip, player_stats))\
+                   .add_done_callback(log_failure)
+        # Keep going straight away if there might be more waiting
+        if len(due) < SWEEP_BATCH:
+            await asyncio.sleep(interval)
+
+
+@events.subscribe('cast')
+def noteTrip(user_id, habitat, resolve_time):
+    '''Add a trip started on any worker to the encounter index.'''
+
+    fishers.note(user_id, habitat, resolve_time)
+
+
+@events.subscribe('cancel')
+def cancelTrip(user_id):
+    '''Stop a trip if this worker is running it, once its player has
+    reeled in.
+    '''
+
+    trips.cancel(user_id)
+    fishers.remove(user_id)
+
+
+# Pick up changes to the fish, whichever worker made them
+events.subscribe('reload')(catalogue.reload)
+
+
+def getAllFishers():
+    '''Get the player ID, location and resolve time of
+    everyone whose trip is still going.
+    '''
+
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+          SELECT Player_ID, Location, Resolve_time
+          FROM CurrentFishers
+          WHERE Resolve_time > %s
+        ''', (time.time(),))
+        fishers = c.fetchall()
+
+    return fishers
+
+
+async def resolveFisher(user_id, habitat, delay, seed=None):
+    '''
+    The coroutine which runs when someone starts fishing.
+    It is scheduled on the worker's trip scheduler, so Flask can return
+    a value and end the connection while still sending a reply much later.
+
+    `seed` is the trip's seed, as returned by castLine().
+    '''
+
+    rng = trip_stream(seed, 'encounter')
+    fishers.add(user_id, habitat, time.time() + delay)
+
+    #--------------------------------#
+    #-- Random Encounters Behavior --#
+    #--------------------------------#
+
+    # There's a 1 in 3 chance of meeting another fisher. Who they meet
+    # and when is decided now, from the fishers already out there.
+    meeting = None
+    if rng.randint(1, 3) == 1:
+        encounter = fishers.plan_encounter(user_id, habitat, delay, rng)
+        if encounter:
+            other_id, interact_delay = encounter
+            # The coroutine is only made once they meet, so a meeting
+            # which is cancelled leaves nothing behind
+            meeting = asyncio.get_running_loop().call_later(
+                interact_delay,
+                lambda: asyncio.ensure_future(meetFisher(user_id, other_id,
+                                                         rng))
+                               .add_done_callback(log_failure))
+
+    #------------------------------------------#
+    #-- Respond to the fishing request after --#
+    #-- some time has passed ------------------#
+    #------------------------------------------#
+
+    try:
         # Wait a specified amount of time
         await asyncio.sleep(max(delay, 0))
-        # Wait until the request completes, then get a list of the users
-        await groupme_users
-        # Extract the fisher's nickname
-        if not user_nickname:
-            groupme_users_result = groupme_users.result()
-            user_nickname = [user for user in groupme_users_result
-                             if user['user_id'] ==\
-                             str(user_id)][0]['nickname']
-
-        # Check to make sure resetFishingStatus
-        # hasn't been called manually.
-        if checkStillFishing(user_id):
-
-            # Remove the user from the table of current fishers
-            resetFishingStatus(user_id)
-
-            # Send a message if they failed to catch a fish ------------
-            if not fish_catch:
-                no_catch_messages = ['{} thought they caught a fish, but when they reeled in their line all they found was seaweed.',
-                                     '{} reeled in their line, but instead of a fish, they found they\'d only hooked an old tire.',
-                                     '{} reeled in their line to find that something had stolen their bait.',
-                                     'Due to worries about an approaching storm, {} reeled in their line and returned to shore.']
-                text_value = random.choice(no_catch_messages)\
-                                .format(user_nickname)
-
-            # If fish_catch is a string, the fisher had a problem
-            # with their boat or rod. Format and relay that message.
-            elif type(fish_catch) == str:
-                text_value = fish_catch.format(user_nickname)
-
-            # Otherwise, they caught a fish!
-            elif type(fish_catch) == tuple:
-                # Save the fish in the catches database table
-                registerCatch(user_id=user_id,
-                              fish=fish_catch)
-
-                # Construct a catch message
-                size_picker = min(int(fish_catch[1]/30), 4)
-                text_value = random.choice(CATCH_RESPONSES[size_picker])\
-                                   .format(user_nickname, fish_catch[1], fish_catch[0][1])\
-                             + f"\nFood Value: {fish_catch[0][3]}\nGame Quality: {fish_catch[0][4]}"
-
-
-            # Send the post request to the group
-            data = {'bot_id': os.environ['bot_id'],
-                    'text': text_value}
-            r = requests.post('https://api.groupme.com/v3/bots/post', data=data)
-            await asyncio.sleep(2)
-
-
-
-            # Easter eggs
-            if habitat.lower() in ("offshore", "inshore", "reef") and random.randint(0, 1000) == 500:
-                e_egg = random.choice(easter_eggs)
-                data = {'bot_id': os.environ['bot_id'],
-                        'text': e_egg.format(user_nickname)}
-                r = requests.post('https://api.groupme.com/v3/bots/post', data=data)
-                await asyncio.sleep(2)
-
-
-
-            # Check for level ups and add messages
-            if boat_level < 5 and sumTotalPoundsCaught(user_id) > LEVEL_CHECKS['boat'][boat_level-1][1]:
-                incrementLevel(user_id, "Boat_level")
-                # Send the message notifying the levelup
-                data = {'bot_id': os.environ['bot_id'],
-                        'text': LEVEL_CHECKS['boat'][boat_level - 1][2]\
-                            .format(user_nickname)}
-                r = requests.post('https://api.groupme.com/v3/bots/post', data=data)
-
-            if rod_level < 5 and countUniqueCatches(user_id) >= LEVEL_CHECKS['rod'][rod_level-1][1]:
-                incrementLevel(user_id, "Rod_level")
-                # Send the message notifying the levelup
-                data = {'bot_id': os.environ['bot_id'],
-                        'text': LEVEL_CHECKS['rod'][rod_level - 1][2]\
-                            .format(user_nickname)}
-                r = requests.post('https://api.groupme.com/v3/bots/post', data=data)
 
+        # Once the claim starts the catch may be stored at any moment,
+        # so it's seen through even if a new cast cancels this trip
+        landing = asyncio.ensure_future(landTrip(user_id))
+        try:
+            await asyncio.shield(landing)
+        except asyncio.CancelledError:
+            landing.add_done_callback(log_failure)
+            raise
+    finally:
+        # Reeling in cancels the trip, and the meeting with it
+        fishers.remove(user_id)
+        if meeting is not None:
+            meeting.cancel()
+
+
+async def landTrip(user_id):
+    '''Claim someone's trip and announce how it went.'''
+
+    # If it's gone, resetFishingStatus was called manually or another
+    # worker already resolved it
+    claimed = await in_thread(claimTrip, user_id)
+    if claimed:
+        await finishTrip(*claimed)
+
+
+async def meetFisher(user_id, other_id, rng):
+    '''Announce a fisher running into another out on the waters.
+
+    Scheduled by resolveFisher for when they meet, which is while both
+    of their trips are still going.
+    '''
+
+    # Look up both fishers in the member directory
+    fisher_fname = await directory.first_name(user_id)
+    user_nickname = await directory.nickname(user_id)
+    other_nickname = await directory.nickname(other_id)
+
+    # Pick one of the fisher's topics
+    if topics.stale:
+        await in_thread(topics.load)
+    topic = topics.pick(user_id, fisher_fname, rng)
+
+    # Select a random adjective
+    adj = rng.choice(TOPIC_ADJ)
+
+    # Send a message about the conversation they have, unless they've
+    # reeled in their line since (or there's nothing to talk about)
+    if topic is not None and fishers.is_fishing(user_id):
+        dispatcher.send(f"{user_nickname} encounters {other_nickname} out on the waters. They have a {adj} conversation about {topic}.")
+
+
+async def finishTrip(trip, player_stats=None):
+    '''Announce the result of a claimed trip and check for level ups.
+
+    `trip` and `player_stats` are as returned by claimTrip() or
+    claimDueTrips(), which have already stored any fish caught.
+    '''
+
+    user_id, habitat, outcome, boat_level, rod_level, seed = trip
+    fish_catch = decodeOutcome(outcome)
+    rng = trip_stream(seed, 'finish')
+
+    # Trips cast before outcomes were stored don't know the levels
+    if boat_level is None or rod_level is None:
+        _, rod_level, boat_level = await in_thread(getUser, user_id)
+
+    user_nickname = await directory.nickname(user_id)
+
+    # Send a message if they failed to catch a fish ------------
+    if not fish_catch:
+        no_catch_messages = ['{} thought they caught a fish, but when they reeled in their line all they found was seaweed.',
+                             '{} reeled in their line, but instead of a fish, they found they\'d only hooked an old tire.',
+                             '{} reeled in their line to find that something had stolen their bait.',
+                             'Due to worries about an approaching storm, {} reeled in their line and returned to shore.']
+        text_value = rng.choice(no_catch_messages)\
+                        .format(user_nickname)
+
+    # If fish_catch is a string, the fisher had a problem
+    # with their boat or rod. Format and relay that message.
+    elif type(fish_catch) == str:
+        text_value = fish_catch.format(user_nickname)
+
+    # Otherwise, they caught a fish!
+    elif type(fish_catch) == tuple:
+        await in_thread(events.publish, 'catch', user_id=user_id,
+                        habitat=habitat, fish_id=fish_catch[0][0],
+                        fish=fish_catch[0][1], lbs=fish_catch[1])
+
+        # Construct a catch message
+        size_picker = min(int(fish_catch[1]/30), 4)
+        text_value = rng.choice(CATCH_RESPONSES[size_picker])\
+                           .format(user_nickname, fish_catch[1], fish_catch[0][1])\
+                     + f"\nFood Value: {fish_catch[0][3]}\nGame Quality: {fish_catch[0][4]}"
 
-    #----------------------------#
-    #-- Run the inner function --#
-    #----------------------------#
 
-    # Run the inner function as an asyncio coroutine
-    # (this is necessary to make the requests asynchronous)
-    asyncio.run(inner_wrapper())
+    # Send the post request to the group. Everything else said about
+    # the trip is keyed the same, so it's posted along with this.
+    dispatcher.send(text_value, key=user_id)
+
+
+
+    # Easter eggs
+    if habitat.lower() in ("offshore", "inshore", "reef") and rng.randint(0, 1000) == 500:
+        e_egg = rng.choice(easter_eggs)
+        dispatcher.send(e_egg.format(user_nickname), key=user_id)
+
+
+
+    # Check for level ups and add messages
+    if player_stats is None:
+        player_stats = await in_thread(getPlayerStats, user_id)
+    total_lbs, _, species_count, _ = player_stats
+
+    if boat_level < 5 and total_lbs > LEVEL_CHECKS['boat'][boat_level-1][1]:
+        await in_thread(incrementLevel, user_id, "Boat_level")
+        # Send the message notifying the levelup
+        dispatcher.send(LEVEL_CHECKS['boat'][boat_level - 1][2]\
+                            .format(user_nickname),
+                        key=user_id)
+
+    if rod_level < 5 and species_count >= LEVEL_CHECKS['rod'][rod_level-1][1]:
+        await in_thread(incrementLevel, user_id, "Rod_level")
+        # Send the message notifying the levelup
+        dispatcher.send(LEVEL_CHECKS['rod'][rod_level - 1][2]\
+                            .format(user_nickname),
+                        key=user_id)
 
 
 def incrementLevel(user_id, level_type):
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
+    with database.connection() as conn:
         sqlquery = f'''
           UPDATE Players
           SET {level_type} = {level_type}  + 1
@@ -850,7 +906,7 @@ def resetFishingStatus(user_id):
     fishers.
     '''
 
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
+    with database.connection() as conn:
         c = conn.cursor()
         c.execute('''
           DELETE
@@ -860,129 +916,150 @@ def resetFishingStatus(user_id):
         conn.commit()
 
 
-def checkStillFishing(user_id):
-    '''
-    Check whether the fishing was interrupted.
-
-    Returns a bool
-    '''
+# Looks up one player's running totals
+PLAYER_STATS = '''
+  SELECT Total_lbs,
+         Catch_count,
+         Species_count,
+         Top_catches
+  FROM PlayerStats
+  WHERE Player_ID = %s
+'''
 
-    user_id = int(user_id)
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-        c = conn.cursor()
-        c.execute('''
-          SELECT Player_ID
-          FROM CurrentFishers
-          WHERE Player_ID = %s
-        ''', (user_id,))
-        fishers = c.fetchall()
 
-    response = (user_id,) in fishers
-    return response
+def getPlayerStats(user_id):
+    '''Get a player's running totals from the PlayerStats table.
 
+    Returns a tuple of (total lbs caught, number of fish caught,
+    number of species caught, largest catches) where the largest
+    catches are (name, size) tuples, biggest first.
+    '''
 
-def getUserCatches(user_id):
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
+    with database.connection() as conn:
         c = conn.cursor()
-        c.execute('''
-          SELECT b.Name,
-                 a.size
-          FROM (
-            SELECT size, Fish_ID
-            FROM Catches
-            WHERE Player_ID =%s
-          ) a
-          LEFT JOIN Fish b
-            ON a.Fish_ID=b.ID
-          ORDER BY a.size DESC
-        ''', (user_id,))
-        catches = c.fetchall()
+        c.execute(PLAYER_STATS, (user_id,))
+        player_stats = c.fetchone()
 
-    return catches
+    if player_stats is None:
+        return (0, 0, 0, [])
+    return player_stats[:3] + ([tuple(entry) for entry
+                                in json.loads(player_stats[3])],)
 
 
 def countUniqueCatches(user_id):
-    catches = getUserCatches(user_id)
-    set_catches = {catch[0]
-                   for catch in catches}
+    return species.popcount(species.players.get(user_id))
 
-    return len(set_catches)
 
+def mergeTopCatches(top_catches, name, size):
+    '''Add a catch to a list of a player's largest catches, keeping
+    only the biggest TOP_CATCHES.
+    '''
 
-def sumTotalPoundsCaught(user_id):
-    catches = getUserCatches(user_id)
-    return sum([catch[1] for catch
-                in catches])
+    top_catches = top_catches + [[name, size]]
+    top_catches.sort(key=lambda entry: entry[1], reverse=True)
+    return top_catches[:TOP_CATCHES]
 
 
-def registerCatch(user_id, fish):
+def registerCatch(user_id, fish, habitat=None):
     '''
-    Log a caught fish in the SQLite Catches
-    table.
+    Log a caught fish in the Catches table and update
+    the player's running totals and the leaderboards in
+    the same transaction.
 
     The `fish` argument should be a fish
-    generated by goFishing().
+    generated by goFishing(). Returns the player's
+    updated stats in the same form as getPlayerStats().
     '''
 
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-        c = conn.cursor()
-        c.execute('''
-          INSERT
-          INTO Catches
-          (Player_ID, Fish_ID, Size)
-          VALUES (%s, %s, %s)
-        ''', (user_id,
-              fish[0][0],
-              fish[1]))
-
+    with database.connection() as conn:
+        player_stats, caught = storeCatch(conn.cursor(), user_id, fish,
+                                          habitat)
         conn.commit()
 
+    species.players.remember(user_id, caught)
+    return player_stats
 
-def countCatchesByHabitat(user_id):
-    '''Returns a descriptive string.
+
+def storeCatch(c, user_id, fish, habitat=None):
+    '''Do what registerCatch() does with the cursor `c`, as part of a
+    larger transaction.
+
+    Returns the player's updated stats and their species set, which
+    should be cached once the transaction commits.
     '''
 
-    # Get the counts from the database
-    with psycopg2.connect(DATABASE_URL, sslmode='require') as conn:
-        c = conn.cursor()
-        c.execute('''
-          SELECT a.Habitat,
-                 b.counts,
-                 a.hab_counts
-          FROM (
-            SELECT Habitat,
-                   count(Fish_Id) AS hab_counts
-            FROM Habitats
-            GROUP BY Habitat
-          ) a
-          LEFT JOIN (
-            SELECT Habitat,
-                   count(Habitat) AS counts
-            FROM Habitats
-            WHERE Fish_ID IN (
-              SELECT DISTINCT Fish_ID
-              FROM Catches
-              WHERE Player_ID = %s)
-            GROUP BY Habitat) b ON a.Habitat = b.Habitat
-        ''', (user_id,))
-        counts = c.fetchall()
+    c.execute('''
+      INSERT
+      INTO Catches
+      (Player_ID, Fish_ID, Size, Habitat, Catch_time)
+      VALUES (%s, %s, %s, %s, %s)
+      RETURNING Size
+    ''', (user_id,
+          fish[0][0],
+          # Postgres rounds to the INT column itself; SQLite wouldn't
+          round(fish[1]),
+          habitat,
+          time.time()))
+    # Use the size as stored, so the totals match the Catches table
+    size = c.fetchone()[0]
+
+    # Lock the player's stats while the largest catches and the
+    # species they've caught are updated
+    c.execute('''
+      INSERT
+      INTO PlayerStats (Player_ID)
+      VALUES (%s)
+      ON CONFLICT DO NOTHING
+    ''', (user_id,))
+    c.execute('''
+      SELECT Top_catches,
+             Species
+      FROM PlayerStats
+      WHERE Player_ID = %s
+      FOR UPDATE
+    ''', (user_id,))
+    top_catches, caught = c.fetchone()
+    top_catches = mergeTopCatches(json.loads(top_catches),
+                                  fish[0][1], size)
+    caught = species.from_bytes(caught)
+    new_species = 0 if caught >> fish[0][0] & 1 else 1
+    caught |= 1 << fish[0][0]
+
+    c.execute('''
+      UPDATE PlayerStats
+      SET Total_lbs = Total_lbs + %s,
+          Catch_count = Catch_count + 1,
+          Species_count = Species_count + %s,
+          Top_catches = %s,
+          Species = %s
+      WHERE Player_ID = %s
+      RETURNING Total_lbs, Catch_count, Species_count
+    ''', (size, new_species, json.dumps(top_catches),
+          species.to_bytes(caught), user_id))
+    player_stats = tuple(c.fetchone()) + ([tuple(entry) for entry
+                                           in top_catches],)
+
+    leaderboard.recordCatch(c, user_id, fish[0][1], size, habitat,
+                            player_stats)
 
-    # Create a dictionary
-    counts_dict = {entry[0]: {'caught': entry[1],
-                              'total': entry[2]}
-                   for entry in counts}
+    return player_stats, caught
+
+
+def countCatchesByHabitat(user_id):
+    '''Returns a descriptive string.
+    '''
 
-    # Replace elements which are 'None' with 0
-    for element in counts_dict:
-	    if counts_dict[element]['caught'] is None:
-		    counts_dict[element]['caught'] = 0
+    # Count the species they've caught in each habitat from the bits
+    # they share with the habitat's mask
+    caught = species.players.get(user_id)
+    masks = catalogue.species_masks()
 
-    # Format a text string with the dictionary
+    # Format a text string with the counts
     count_text = "\n".join(["{}: {} out of {} species caught."\
-                              .format(entry,
-                                      counts_dict[entry]['caught'],
-                                      counts_dict[entry]['total'])
-                              for entry in counts_dict])
+                              .format(habitat,
+                                      species.popcount(caught & mask),
+                                      species.popcount(mask))
+                              for habitat, mask in sorted(masks.items())])
     # Return the string
     return count_text
 
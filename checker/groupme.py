@@ -0,0 +1,144 @@
+'''
+A non-blocking client for the GroupMe API.
+
+All requests go through one aiohttp session per event loop, so the
+connection to GroupMe is kept alive between calls instead of being set
+up again every time. Requests which fail because of the network, rate
+limiting or a server error are retried with exponential backoff.
+
+aiohttp takes longer to import than the rest of the bot put together,
+so it's only imported once the first request is made.
+'''
+
+import asyncio
+import time
+
+import metrics
+from settings import settings
+
+# Paths under the API's URL, which is the GROUPME_API_URL setting
+GROUP_PATH = '/groups/16489941'
+BOTS_PATH = '/bots/post'
+
+# Seconds to wait for a whole request, including reading the response
+TIMEOUT = 10
+
+# How many times to retry a request, and the delay before the first retry
+RETRIES = 3
+BACKOFF = 0.5
+
+# Statuses which mean trying again later might work
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GroupMeError(Exception):
+    '''Raised when a request to GroupMe fails for good.'''
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class GroupMeClient:
+    '''Makes requests to the GroupMe API from an event loop.'''
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._sessions = {}
+
+    def _session(self):
+        '''Return the session for the running event loop.
+
+        aiohttp sessions belong to the loop they were created on, so each
+        loop gets its own.
+        '''
+
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        '''Close the session for the running event loop.'''
+
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def request(self, method, url, **kwargs):
+        '''Make a request, retrying if it might succeed later.
+
+        Returns a tuple of the response's status and its parsed JSON (or
+        None if the body isn't JSON).
+        '''
+
+        import aiohttp
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            started = time.perf_counter()
+            status = None
+            try:
+                async with self._session().request(method, url,
+                                                   **kwargs) as r:
+                    status = r.status
+                    if settings.metrics:
+                        metrics.groupme_response(
+                            method, status, time.perf_counter() - started)
+                    if r.status in RETRY_STATUSES and not last_attempt:
+                        # Honour GroupMe's request to slow down
+                        retry_after = r.headers.get('Retry-After')
+                        await asyncio.sleep(float(retry_after)
+                                            if retry_after
+                                            and retry_after.isdigit()
+                                            else delay)
+                        delay *= 2
+                        continue
+                    if r.status >= 400:
+                        raise GroupMeError(f'{method} {url} returned {r.status}',
+                                           r.status)
+                    try:
+                        body = await r.json(content_type=None)
+                    except ValueError:
+                        body = None
+                    return r.status, body
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if status is None and settings.metrics:
+                    metrics.groupme_response(method, None,
+                                             time.perf_counter() - started)
+                if last_attempt:
+                    raise GroupMeError(f'{method} {url} failed: {e!r}')
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def get_members(self):
+        '''Fetch the group's members.'''
+
+        _, body = await self.request('GET',
+                                     settings.groupme_api_url + GROUP_PATH,
+                                     params={'token': settings.groupme_token})
+        return body['response']['members']
+
+    async def post_message(self, text):
+        '''Post a message to the group as the bot.
+
+        Returns the response's status.
+        '''
+
+        status, _ = await self.request('POST',
+                                       settings.groupme_api_url + BOTS_PATH,
+                                       data={'bot_id': settings.bot_id,
+                                             'text': text})
+        return status
+
+
+# The client shared by everything in this worker
+client = GroupMeClient()
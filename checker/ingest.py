@@ -0,0 +1,114 @@
+'''
+Runs commands off the request thread.
+
+GroupMe waits for the bot to answer its callback, and a gunicorn sync
+worker can't take another request until it does. Rather than running a
+command before answering, the route hands the post to a CommandQueue and
+returns straight away; a small pool of threads works through the queue,
+running each command and queueing its reply. If the queue ever fills,
+the route runs the command itself, since GroupMe won't send it again.
+'''
+
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+from settings import settings
+
+# How many recent latencies are kept for percentiles
+LATENCY_SAMPLES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class CommandQueue:
+    '''A bounded queue of posts and the threads which handle them.
+
+    `handler` is called with each post on one of the pool's threads. The
+    number of threads and the size of the queue default to the
+    INGEST_WORKERS and INGEST_QUEUE_SIZE settings.
+    '''
+
+    def __init__(self, handler, workers=None, size=None):
+        self.handler = handler
+        self.workers = workers or settings.ingest_workers
+        self.size = size or settings.ingest_queue_size
+        self._lock = threading.Lock()
+        # Held while the counters and latencies are changed or read
+        self._stats_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.counters = {'accepted': 0,
+                         'overflowed': 0,
+                         'handled': 0,
+                         'errors': 0}
+
+    def _ensure_running(self):
+        '''Start the pool in this process if it hasn't been already.'''
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.size)
+            self._pid = os.getpid()
+            for number in range(self.workers):
+                threading.Thread(target=self._work,
+                                 name=f'command-{number}',
+                                 daemon=True).start()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.counters[name] += 1
+
+    def submit(self, post):
+        '''Queue a post to be handled.
+
+        Returns False if the queue is full and the post wasn't queued.
+        '''
+
+        self._ensure_running()
+        try:
+            self._queue.put_nowait((time.monotonic(), post))
+        except queue.Full:
+            self._count('overflowed')
+            return False
+        self._count('accepted')
+        return True
+
+    def _work(self):
+        while True:
+            received, post = self._queue.get()
+            try:
+                self.handler(post)
+            except Exception:
+                self._count('errors')
+                logger.exception('Command failed: %r', post.get('text'))
+            finally:
+                with self._stats_lock:
+                    self.counters['handled'] += 1
+                    self._latencies.append(time.monotonic() - received)
+                self._queue.task_done()
+
+    def depth(self):
+        '''Return the number of posts waiting to be handled.'''
+
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self):
+        '''Return the queue's counters, its depth and the 50th and 99th
+        percentile time from a post being received to it being handled.
+        '''
+
+        with self._stats_lock:
+            snapshot = dict(self.counters)
+            latencies = sorted(self._latencies)
+        snapshot['depth'] = self.depth()
+        for percentile in (50, 99):
+            snapshot[f'p{percentile}_seconds'] = latencies[
+                min(len(latencies) - 1, len(latencies) * percentile // 100)
+            ] if latencies else 0
+        return snapshot
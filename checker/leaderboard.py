@@ -0,0 +1,249 @@
+'''
+Leaderboards for the fishing minigame.
+
+Rather than aggregating the whole Catches table whenever someone asks
+for the leaderboard, every board is kept in the Leaderboards table and
+updated in the same transaction as the catch which changes it. Reading a
+board is then a short, indexed scan of a handful of rows.
+
+There are two kinds of board:
+ - catch boards, which hold the biggest individual catches and are
+   trimmed to BOARD_SIZE entries, and
+ - player boards, which hold one running score per player.
+
+Weekly boards are deleted once the week after them starts.
+'''
+
+import time
+
+import database
+
+# How many entries a board shows
+BOARD_SIZE = 5
+
+BIGGEST = 'biggest'
+POUNDS = 'pounds'
+SPECIES = 'species'
+
+
+def habitatBoard(habitat):
+    '''The board for the biggest catches in a habitat.'''
+
+    return f'{BIGGEST}:{habitat}'
+
+
+def weekBoard(when=None):
+    '''The board for the most lbs caught in the week containing `when`.'''
+
+    return time.strftime(f'{POUNDS}:%G-W%V',
+                         time.gmtime(time.time() if when is None else when))
+
+
+def lockBoard(c, board):
+    '''Hold off other transactions changing a board until this one ends.
+
+    Otherwise two catches made at once could each see room on the board
+    for themselves. The embedded database only lets one transaction
+    write at a time anyway.
+    '''
+
+    if not database.is_sqlite(c):
+        c.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', (board,))
+
+
+def addToCatchBoard(c, board, user_id, fish_name, size):
+    '''Add a catch to a catch board if it is big enough to be on it.'''
+
+    lockBoard(c, board)
+    c.execute('''
+      SELECT count(*), min(Score)
+      FROM Leaderboards
+      WHERE Board = %s
+    ''', (board,))
+    entries, smallest = c.fetchone()
+    if entries >= BOARD_SIZE and size <= smallest:
+        return
+
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Label, Score)
+      VALUES (%s, %s, %s, %s)
+    ''', (board, user_id, fish_name, size))
+
+    # Knock the smallest catches off the board
+    if entries >= BOARD_SIZE:
+        c.execute('''
+          DELETE
+          FROM Leaderboards
+          WHERE Board = %s
+            AND Entry_ID NOT IN (
+              SELECT Entry_ID
+              FROM Leaderboards
+              WHERE Board = %s
+              ORDER BY Score DESC, Entry_ID ASC
+              LIMIT %s)
+        ''', (board, board, BOARD_SIZE))
+
+
+def setPlayerScore(c, board, user_id, score):
+    '''Set a player's score on a player board.'''
+
+    c.execute('''
+      UPDATE Leaderboards
+      SET Score = %s
+      WHERE Board = %s AND Player_ID = %s
+    ''', (score, board, user_id))
+    if c.rowcount == 0:
+        c.execute('''
+          INSERT
+          INTO Leaderboards (Board, Player_ID, Score)
+          VALUES (%s, %s, %s)
+        ''', (board, user_id, score))
+
+
+# Adds to a player's entry on a board, which every catch does
+ADD_TO_SCORE = '''
+  UPDATE Leaderboards
+  SET Score = Score + %s
+  WHERE Board = %s AND Player_ID = %s
+'''
+
+
+def addToPlayerScore(c, board, user_id, amount):
+    '''Add to a player's score on a player board.
+
+    Returns True if the player wasn't on the board yet.
+    '''
+
+    c.execute(ADD_TO_SCORE, (amount, board, user_id))
+    if c.rowcount == 0:
+        c.execute('''
+          INSERT
+          INTO Leaderboards (Board, Player_ID, Score)
+          VALUES (%s, %s, %s)
+        ''', (board, user_id, amount))
+        return True
+    return False
+
+
+def pruneWeekBoards(c, current):
+    '''Delete every weekly board but the `current` one.'''
+
+    c.execute('''
+      DELETE
+      FROM Leaderboards
+      WHERE Board LIKE %s
+        AND Board <> %s
+    ''', (f'{POUNDS}:%', current))
+
+
+def recordCatch(c, user_id, fish_name, size, habitat, player_stats,
+                when=None):
+    '''Update every board affected by a catch.
+
+    `c` is the cursor registering the catch, so the boards are updated
+    in the same transaction. `player_stats` are the player's totals
+    after the catch, as returned by fishing.registerCatch().
+    '''
+
+    addToCatchBoard(c, BIGGEST, user_id, fish_name, size)
+    if habitat:
+        addToCatchBoard(c, habitatBoard(habitat), user_id, fish_name, size)
+    setPlayerScore(c, POUNDS, user_id, player_stats[0])
+    setPlayerScore(c, SPECIES, user_id, player_stats[2])
+    week = weekBoard(when)
+    # A player's first catch of the week is the first chance to notice
+    # that last week is over
+    if addToPlayerScore(c, week, user_id, size):
+        pruneWeekBoards(c, week)
+
+
+# Reads the top of a board, as every leaderboard command does
+TOP_ENTRIES = '''
+  SELECT Player_ID, Label, Score
+  FROM Leaderboards
+  WHERE Board = %s
+  ORDER BY Score DESC
+  LIMIT %s
+'''
+
+
+def topEntries(board, limit=BOARD_SIZE):
+    '''Return the top entries of a board as (player ID, label, score)
+    tuples, highest first.
+    '''
+
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute(TOP_ENTRIES, (board, limit))
+        entries = c.fetchall()
+
+    return entries
+
+
+def rebuildLeaderboards(c):
+    '''Rebuild every board from the Catches and PlayerStats tables.
+
+    This is only needed when the Leaderboards table is first created or
+    if it is ever found to be out of sync.
+    '''
+
+    c.execute('DELETE FROM Leaderboards')
+
+    # Biggest catches overall
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Label, Score)
+      SELECT %s, a.Player_ID, b.Name, a.Size
+      FROM Catches a
+      INNER JOIN Fish b
+        ON a.Fish_ID = b.ID
+      ORDER BY a.Size DESC
+      LIMIT %s
+    ''', (BIGGEST, BOARD_SIZE))
+
+    # Biggest catches per habitat, for catches which know where they were made
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Label, Score)
+      SELECT %s || ':' || Habitat, Player_ID, Name, Size
+      FROM (
+        SELECT a.Habitat,
+               a.Player_ID,
+               b.Name,
+               a.Size,
+               row_number() OVER (PARTITION BY a.Habitat
+                                  ORDER BY a.Size DESC) AS place
+        FROM Catches a
+        INNER JOIN Fish b
+          ON a.Fish_ID = b.ID
+        WHERE a.Habitat IS NOT NULL
+      ) ranked
+      WHERE place <= %s
+    ''', (BIGGEST, BOARD_SIZE))
+
+    # Running totals
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Score)
+      SELECT %s, Player_ID, Total_lbs
+      FROM PlayerStats
+    ''', (POUNDS,))
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Score)
+      SELECT %s, Player_ID, Species_count
+      FROM PlayerStats
+    ''', (SPECIES,))
+
+    # This week's totals, for catches which know when they were made
+    now = time.time()
+    week_start = now - now % 86400 - time.gmtime(now).tm_wday * 86400
+    c.execute('''
+      INSERT
+      INTO Leaderboards (Board, Player_ID, Score)
+      SELECT %s, Player_ID, sum(Size)
+      FROM Catches
+      WHERE Catch_time >= %s
+      GROUP BY Player_ID
+    ''', (weekBoard(), week_start))
@@ -0,0 +1,135 @@
+'''
+A cache of the GroupMe group's members.
+
+Nicknames are needed for almost every message the bot sends, but they
+rarely change. Each worker keeps the member list in a dictionary keyed
+by user ID and only asks the GroupMe API for it again once it is
+TTL seconds old. Until it is MAX_STALE seconds old, the old copy is
+still used while a fresh one is fetched in the background.
+
+Lookups are coroutines and should be awaited on the worker's event loop
+(see scheduler.py), which is where the GroupMe client's session lives.
+'''
+
+import asyncio
+import time
+
+from groupme import client, GroupMeError
+
+# How long the member list is fresh, and how long a stale one may be used
+TTL = 5 * 60
+MAX_STALE = 60 * 60
+
+# The least time between refreshes forced by an unknown user ID
+UNKNOWN_REFRESH_AFTER = 30
+
+
+class MemberDirectory:
+    '''The group's members, keyed by user ID.'''
+
+    def __init__(self, fetch=client.get_members, ttl=TTL,
+                 max_stale=MAX_STALE):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._members = None
+        self._fetched_at = 0
+        self._refreshing = None
+        self.refreshes = 0
+
+    async def refresh(self):
+        '''Fetch the member list now.
+
+        Concurrent callers share a single request.
+        '''
+
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        refreshing = self._refreshing
+        try:
+            await asyncio.shield(refreshing)
+        finally:
+            if self._refreshing is refreshing and refreshing.done():
+                self._refreshing = None
+
+    async def _refresh(self):
+        members = await self._fetch()
+        self._members = {member['user_id']: member
+                         for member in members}
+        self._fetched_at = time.time()
+        self.refreshes += 1
+
+    def _refresh_in_background(self):
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+            # Keep using the stale copy if it fails; the next lookup
+            # tries again
+            self._refreshing.add_done_callback(self._background_done)
+
+    def _background_done(self, refreshing):
+        if not refreshing.cancelled():
+            refreshing.exception()
+        if self._refreshing is refreshing:
+            self._refreshing = None
+
+    async def _current(self):
+        '''Return the member dictionary, refreshing it if needed.'''
+
+        age = time.time() - self._fetched_at
+        if self._members is None or age > self.max_stale:
+            await self.refresh()
+        elif age > self.ttl:
+            self._refresh_in_background()
+        return self._members
+
+    def invalidate(self):
+        '''Make the next lookup fetch the member list again.'''
+
+        self._fetched_at = 0
+
+    async def get(self, user_id):
+        '''Return the member with a user ID, or None if there isn't one.
+
+        An unknown ID might belong to someone who has just joined, so it
+        triggers a refresh unless one happened very recently.
+        '''
+
+        user_id = str(user_id)
+        member = (await self._current()).get(user_id)
+        if member is None\
+           and time.time() - self._fetched_at > UNKNOWN_REFRESH_AFTER:
+            await self.refresh()
+            member = self._members.get(user_id)
+        return member
+
+    async def nickname(self, user_id, default='Someone'):
+        '''Return a member's nickname, or `default` if they aren't known
+        or the member list can't be fetched.
+        '''
+
+        try:
+            member = await self.get(user_id)
+        except GroupMeError:
+            return default
+        return member['nickname'] if member else default
+
+    async def first_name(self, user_id):
+        '''Return a member's first name, or None if they aren't known
+        or the member list can't be fetched.
+        '''
+
+        try:
+            member = await self.get(user_id)
+        except GroupMeError:
+            return None
+        return member['name'].split()[0] if member else None
+
+    async def nicknames(self):
+        '''Return a dictionary of every member's nickname by user ID.'''
+
+        return {user_id: member['nickname']
+                for user_id, member in (await self._current()).items()}
+
+
+# The directory shared by everything in this worker
+directory = MemberDirectory()
@@ -0,0 +1,238 @@
+'''
+Counters and timers for the bot's hot paths, served at /metrics.
+
+Each worker keeps its own metrics and renders them in Prometheus's text
+format, so they can be scraped or just read with curl. They cover:
+
+- how long each command takes to run, and how many of them fail
+- how many queries each function runs, and how long they take
+- how long GroupMe API calls take, and what they return
+- gauges such as the number of trips pending, read when rendered
+
+Metrics are only collected when the METRICS setting is on. When it's
+off, the hot paths check a cached setting and carry on, and the database
+hands out its plain cursors.
+'''
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from settings import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histograms' buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+# Every metric, in the order they're rendered
+REGISTRY = []
+
+
+def enabled():
+    '''Check whether metrics are being collected.'''
+
+    return settings.metrics
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric:
+    '''A metric with a value for each combination of its labels.'''
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        '''Yield (name, labels, value) for each of the metric's series.'''
+
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name}{labels} {_format_value(value)}'
+                     for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    '''A count which only goes up.'''
+
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram(Metric):
+    '''Observations, e.g. durations, counted into BUCKETS.'''
+
+    kind = 'histogram'
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # A count per bucket (and one for +Inf), and the sum
+                series = self._values[labels] = [[0] * (len(BUCKETS) + 1), 0]
+            series[0][bisect.bisect_left(BUCKETS, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        '''Observe how long a with block takes.'''
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total)
+                            in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labels, labels,
+                                      [('le', _format_value(bound))]),
+                       cumulative)
+            yield (f'{self.name}_sum',
+                   _format_labels(self.labels, labels), total)
+            yield (f'{self.name}_count',
+                   _format_labels(self.labels, labels), cumulative)
+
+
+class Gauge(Metric):
+    '''A value read from `function` whenever the metrics are rendered.'''
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self):
+        yield self.name, '', self.function()
+
+
+def render():
+    '''Return every metric in Prometheus's text format.'''
+
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def reset():
+    '''Forget everything recorded so far.'''
+
+    for metric in REGISTRY:
+        metric.reset()
+
+
+COMMAND_SECONDS = Histogram('checkers_command_seconds',
+                            'Time taken to run a command.', ['command'])
+COMMAND_ERRORS = Counter('checkers_command_errors_total',
+                         'Commands which raised.', ['command'])
+QUERY_SECONDS = Histogram('checkers_db_query_seconds',
+                          'Time taken by a query, by the function which '
+                          'borrowed the connection.', ['function'])
+GROUPME_SECONDS = Histogram('checkers_groupme_request_seconds',
+                            'Time taken by a GroupMe API call.', ['method'])
+GROUPME_RESPONSES = Counter('checkers_groupme_responses_total',
+                            'GroupMe API responses by status, or "error" '
+                            'if there was none.', ['method', 'status'])
+
+
+@contextmanager
+def command(name):
+    '''Time a command, counting it as an error if it raises.'''
+
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        COMMAND_ERRORS.inc(name)
+        raise
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - started, name)
+
+
+# The function which borrowed the connection queries are being run on
+borrower = contextvars.ContextVar('borrower', default='unknown')
+
+
+@contextmanager
+def borrowed(connection, function):
+    '''Enter a connection's with block, attributing its queries to
+    `function`.
+    '''
+
+    token = borrower.set(function)
+    try:
+        with connection as conn:
+            yield conn
+    finally:
+        borrower.reset(token)
+
+
+def timed_cursor(cursor_class):
+    '''Return a subclass of a cursor class which times every statement.'''
+
+    class TimedCursor(cursor_class):
+        def execute(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().execute(*args, **kwargs)
+            finally:
+                QUERY_SECONDS.observe(time.perf_counter() - started,
+                                      borrower.get())
+
+    TimedCursor.__name__ = TimedCursor.__qualname__ = \
+        'Timed' + cursor_class.__name__
+    return TimedCursor
+
+
+def groupme_response(method, status, seconds):
+    '''Record a GroupMe API call and its status, or None if it failed
+    without one.
+    '''
+
+    GROUPME_SECONDS.observe(seconds, method)
+    GROUPME_RESPONSES.inc(method, 'error' if status is None else str(status))
@@ -0,0 +1,540 @@
+'''
+Versioned changes to the fishing game's schema.
+
+Each migration is a function which takes a cursor and is applied once,
+in order, inside the transaction which records it in SchemaVersion.
+`migrate` takes a lock on SchemaVersion first, so workers starting at
+the same time don't apply the same migration twice.
+
+Migrations are never edited once they've shipped; a change to the schema
+is a new migration at the end of the list. The early ones create the
+tables as they were when migrations were introduced, so databases made
+before then (which already have those tables) take them as no-ops.
+
+Those early migrations only run on Postgres. An SQLite database is
+always new, so it starts from createSQLiteSchema, which builds the
+schema as of migration 6, and takes the migrations after that like any
+other.
+'''
+
+import json
+import time
+
+import database
+import species
+from catalogue import parse_size
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    '''Register the decorated function as migration `version`.'''
+
+    def register(apply):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version,\
+            'migrations must be registered in order'
+        MIGRATIONS.append((version, description, apply))
+        return apply
+
+    return register
+
+
+def currentVersion(c):
+    '''Return the newest migration applied to the database, or 0.'''
+
+    c.execute('''SELECT coalesce(max(Version), 0) FROM SchemaVersion''')
+    return c.fetchone()[0]
+
+
+def migrate(c):
+    '''Apply any migrations the database hasn't had yet.
+
+    Returns the versions which were applied. Runs in the cursor's
+    transaction, so nothing is applied unless everything is.
+    '''
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS SchemaVersion (
+      Version INT PRIMARY KEY,
+      Description TEXT NOT NULL,
+      Applied_at INT NOT NULL
+      )
+    ''')
+    if database.is_sqlite(c):
+        # The connection already holds the whole database
+        migrations = [(SQLITE_BASELINE_VERSION,
+                       'Create the schema for SQLite',
+                       createSQLiteSchema)]\
+            + [entry for entry in MIGRATIONS
+               if entry[0] > SQLITE_BASELINE_VERSION]
+    else:
+        c.execute('''LOCK TABLE SchemaVersion IN EXCLUSIVE MODE''')
+        migrations = MIGRATIONS
+
+    current = currentVersion(c)
+    applied = []
+    for version, description, apply in migrations:
+        if version <= current:
+            continue
+        apply(c)
+        c.execute('''
+          INSERT
+          INTO SchemaVersion (Version, Description, Applied_at)
+          VALUES (%s, %s, %s)
+        ''', (version, description, int(time.time())))
+        applied.append(version)
+    return applied
+
+
+@migration(1, 'Create the original tables')
+def createTables(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Fish (
+       ID INT UNIQUE GENERATED ALWAYS AS IDENTITY,
+       Name TEXT NOT NULL UNIQUE,
+       Size TEXT NOT NULL,
+       Food_Value TEXT NOT NULL,
+       Game_Quality TEXT NOT NULL
+       )
+    ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Habitats (
+       Habitat TEXT NOT NULL,
+       Fish_ID INTEGER NOT NULL,
+       FOREIGN KEY (Fish_ID)
+          REFERENCES Fish (ID),
+       UNIQUE (Habitat, Fish_ID)
+       )
+    ''')
+
+    c.execute('''
+      CREATE TABLE IF NOT EXISTS Players (
+        ID INT UNIQUE,
+        Rod_level INT NOT NULL,
+        Boat_level INT NOT NULL
+    );
+    ''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS Catches (
+      Catch_ID INT UNIQUE GENERATED ALWAYS AS IDENTITY,
+      Player_ID INTEGER NOT NULL,
+      Fish_ID INTEGER NOT NULL,
+      Size INTEGER NOT NULL,
+      FOREIGN KEY (Player_ID)
+        REFERENCES Players (ID),
+      FOREIGN KEY (Fish_ID)
+        REFERENCES Fish (ID)
+    )
+    ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS CurrentFishers (
+      Player_ID INT UNIQUE,
+      Resolve_time INT NOT NULL,
+      Location TEXT NOT NULL,
+      FOREIGN KEY (Player_ID)
+        REFERENCES Players (ID)
+      )
+    ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Topics (
+      topic TEXT UNIQUE,
+      Christopher INT,
+      Danny INT,
+      Evan INT,
+      Dylan INT,
+      Lars INT,
+      Cole INT,
+      Diego INT,
+      Taco INT,
+      Marcus INT,
+      Everyone INT
+      )
+    ''')
+
+
+@migration(2, 'Store the outcome of a trip when the line is cast')
+def addTripOutcomes(c):
+    for column in ('Outcome TEXT', 'Boat_level INT', 'Rod_level INT'):
+        c.execute(f'''
+        ALTER TABLE CurrentFishers
+        ADD COLUMN IF NOT EXISTS {column}
+        ''')
+
+
+@migration(3, 'Parse the sizes of fish into pounds')
+def addFishSizes(c):
+    for column in ('min_lb', 'max_lb', 'mean_lb', 'sd_lb'):
+        c.execute(f'''
+        ALTER TABLE Fish
+        ADD COLUMN IF NOT EXISTS {column} REAL
+        ''')
+
+    c.execute('''SELECT ID, Size FROM Fish WHERE mean_lb IS NULL''')
+    for id, size in c.fetchall():
+        c.execute('''UPDATE Fish
+                     SET min_lb = %s,
+                         max_lb = %s,
+                         mean_lb = %s,
+                         sd_lb = %s
+                     WHERE ID = %s''', (*parse_size(size), id))
+
+
+@migration(4, 'Keep running totals for each player')
+def addPlayerStats(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS PlayerStats (
+      Player_ID INT UNIQUE,
+      Total_lbs INT NOT NULL DEFAULT 0,
+      Catch_count INT NOT NULL DEFAULT 0,
+      Species_count INT NOT NULL DEFAULT 0,
+      Top_catches TEXT NOT NULL DEFAULT '[]',
+      FOREIGN KEY (Player_ID)
+        REFERENCES Players (ID)
+      )
+    ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS PlayerSpecies (
+      Player_ID INT NOT NULL,
+      Fish_ID INT NOT NULL,
+      FOREIGN KEY (Player_ID)
+        REFERENCES Players (ID),
+      FOREIGN KEY (Fish_ID)
+        REFERENCES Fish (ID),
+      UNIQUE (Player_ID, Fish_ID)
+      )
+    ''')
+
+    # Build the running totals for catches made before they existed
+    c.execute('''
+    INSERT INTO PlayerSpecies
+    SELECT DISTINCT Player_ID, Fish_ID
+    FROM Catches
+    ON CONFLICT DO NOTHING
+    ''')
+    c.execute('''
+    INSERT INTO PlayerStats
+      (Player_ID, Total_lbs, Catch_count, Species_count)
+    SELECT Player_ID,
+           sum(Size),
+           count(*),
+           count(DISTINCT Fish_ID)
+    FROM Catches
+    GROUP BY Player_ID
+    ON CONFLICT DO NOTHING
+    ''')
+    c.execute('''
+    SELECT Player_ID
+    FROM PlayerStats
+    WHERE Top_catches = '[]' AND Catch_count > 0
+    ''')
+    for (player_id,) in c.fetchall():
+        c.execute('''
+        SELECT b.Name, a.Size
+        FROM Catches a
+        INNER JOIN Fish b
+          ON a.Fish_ID = b.ID
+        WHERE a.Player_ID = %s
+        ORDER BY a.Size DESC
+        LIMIT 5
+        ''', (player_id,))
+        c.execute('''
+        UPDATE PlayerStats
+        SET Top_catches = %s
+        WHERE Player_ID = %s
+        ''', (json.dumps(c.fetchall()), player_id))
+
+
+@migration(5, 'Keep leaderboards up to date as fish are caught')
+def addLeaderboards(c):
+    # Catches made before these were recorded leave them empty
+    for column in ('Habitat TEXT', 'Catch_time INT'):
+        c.execute(f'''
+        ALTER TABLE Catches
+        ADD COLUMN IF NOT EXISTS {column}
+        ''')
+
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Leaderboards (
+      Entry_ID INT UNIQUE GENERATED ALWAYS AS IDENTITY,
+      Board TEXT NOT NULL,
+      Player_ID INT NOT NULL,
+      Label TEXT,
+      Score INT NOT NULL,
+      FOREIGN KEY (Player_ID)
+        REFERENCES Players (ID)
+      )
+    ''')
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS Leaderboards_board_score
+    ON Leaderboards (Board, Score DESC)
+    ''')
+
+    # Fill the boards from the catches made so far, five entries to each
+    # of the biggest catches boards
+    c.execute('DELETE FROM Leaderboards')
+    c.execute('''
+    INSERT
+    INTO Leaderboards (Board, Player_ID, Label, Score)
+    SELECT 'biggest', a.Player_ID, b.Name, a.Size
+    FROM Catches a
+    INNER JOIN Fish b
+      ON a.Fish_ID = b.ID
+    ORDER BY a.Size DESC
+    LIMIT 5
+    ''')
+    c.execute('''
+    INSERT
+    INTO Leaderboards (Board, Player_ID, Label, Score)
+    SELECT 'biggest:' || Habitat, Player_ID, Name, Size
+    FROM (
+      SELECT a.Habitat,
+             a.Player_ID,
+             b.Name,
+             a.Size,
+             row_number() OVER (PARTITION BY a.Habitat
+                                ORDER BY a.Size DESC) AS place
+      FROM Catches a
+      INNER JOIN Fish b
+        ON a.Fish_ID = b.ID
+      WHERE a.Habitat IS NOT NULL
+    ) ranked
+    WHERE place <= 5
+    ''')
+    c.execute('''
+    INSERT
+    INTO Leaderboards (Board, Player_ID, Score)
+    SELECT 'pounds', Player_ID, Total_lbs
+    FROM PlayerStats
+    ''')
+    c.execute('''
+    INSERT
+    INTO Leaderboards (Board, Player_ID, Score)
+    SELECT 'species', Player_ID, Species_count
+    FROM PlayerStats
+    ''')
+    now = time.time()
+    week_start = now - now % 86400 - time.gmtime(now).tm_wday * 86400
+    c.execute('''
+    INSERT
+    INTO Leaderboards (Board, Player_ID, Score)
+    SELECT %s, Player_ID, sum(Size)
+    FROM Catches
+    WHERE Catch_time >= %s
+    GROUP BY Player_ID
+    ''', (time.strftime('pounds:%G-W%V', time.gmtime(now)), week_start))
+
+
+@migration(6, 'Add primary keys and indexes for the hot queries')
+def addKeysAndIndexes(c):
+    # Fish and Players keep their unique constraints as well, since the
+    # foreign keys which point at them depend on those
+    for table, key in (('Fish', 'ID'),
+                       ('Players', 'ID')):
+        c.execute(f'''ALTER TABLE {table} ADD PRIMARY KEY ({key})''')
+
+    # Elsewhere the primary key replaces the unique constraint
+    for table, key, unique in (
+            ('Habitats', 'Habitat, Fish_ID', 'habitats_habitat_fish_id_key'),
+            ('Catches', 'Catch_ID', 'catches_catch_id_key'),
+            ('CurrentFishers', 'Player_ID', 'currentfishers_player_id_key'),
+            ('PlayerStats', 'Player_ID', 'playerstats_player_id_key'),
+            ('PlayerSpecies', 'Player_ID, Fish_ID',
+             'playerspecies_player_id_fish_id_key'),
+            ('Leaderboards', 'Entry_ID', 'leaderboards_entry_id_key')):
+        c.execute(f'''ALTER TABLE {table} ADD PRIMARY KEY ({key})''')
+        c.execute(f'''ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {unique}''')
+
+    for name, table, columns in (
+            # A player's biggest catches, and their catches by species
+            ('Catches_player_size', 'Catches', 'Player_ID, Size DESC'),
+            ('Catches_player_fish', 'Catches', 'Player_ID, Fish_ID'),
+            # The biggest catches overall and in each habitat
+            ('Catches_habitat_size', 'Catches', 'Habitat, Size DESC'),
+            # Who else is fishing at a location, and which trips are due
+            ('CurrentFishers_location', 'CurrentFishers', 'Location'),
+            ('CurrentFishers_resolve_time', 'CurrentFishers', 'Resolve_time'),
+            # The habitats a fish lives in
+            ('Habitats_fish', 'Habitats', 'Fish_ID'),
+            # A player's entry on a board
+            ('Leaderboards_board_player', 'Leaderboards', 'Board, Player_ID')):
+        c.execute(f'''
+        CREATE INDEX IF NOT EXISTS {name}
+        ON {table} ({columns})
+        ''')
+
+
+@migration(7, 'Store the seed each trip is drawn from')
+def addTripSeeds(c):
+    c.execute('''ALTER TABLE CurrentFishers ADD COLUMN Seed BIGINT''')
+
+
+# The members who had a column of their own in Topics
+TOPIC_COLUMNS = ('Christopher', 'Danny', 'Evan', 'Dylan', 'Lars', 'Cole',
+                 'Diego', 'Taco', 'Marcus')
+
+
+@migration(8, 'Give each member their topics in rows, not a column each')
+def addTopicMembers(c):
+    # A topic belongs to a member by their GroupMe user ID or, for the
+    # topics which had a column each, by their first name
+    c.execute('''
+    CREATE TABLE TopicMembers (
+      Topic TEXT NOT NULL
+        REFERENCES Topics (topic),
+      User_ID TEXT,
+      Member_name TEXT,
+      CHECK ((User_ID IS NULL) <> (Member_name IS NULL))
+      )
+    ''')
+    c.execute('''
+    CREATE UNIQUE INDEX TopicMembers_user
+    ON TopicMembers (User_ID, Topic)
+    ''')
+    c.execute('''
+    CREATE UNIQUE INDEX TopicMembers_name
+    ON TopicMembers (Member_name, Topic)
+    ''')
+
+    for name in TOPIC_COLUMNS:
+        c.execute(f'''
+        INSERT
+        INTO TopicMembers (Topic, Member_name)
+        SELECT topic, %s
+        FROM Topics
+        WHERE {name} = 1
+        ''', (name,))
+        c.execute(f'''ALTER TABLE Topics DROP COLUMN {name}''')
+
+
+@migration(9, "Keep each player's species as a bitset with their stats")
+def addSpeciesSets(c):
+    c.execute(f'''
+    ALTER TABLE PlayerStats
+    ADD COLUMN Species {'BLOB' if database.is_sqlite(c) else 'BYTEA'}
+    ''')
+
+    c.execute('''SELECT Player_ID, Fish_ID FROM PlayerSpecies''')
+    sets = {}
+    for player_id, fish_id in c.fetchall():
+        sets[player_id] = sets.get(player_id, 0) | 1 << fish_id
+    for player_id, bits in sets.items():
+        c.execute('''
+        UPDATE PlayerStats
+        SET Species = %s
+        WHERE Player_ID = %s
+        ''', (species.to_bytes(bits), player_id))
+
+    # The sets replace it
+    c.execute('''DROP TABLE PlayerSpecies''')
+
+
+# The version of the schema built by createSQLiteSchema
+SQLITE_BASELINE_VERSION = 6
+
+
+def createSQLiteSchema(c):
+    '''Create the schema as of migration 6 in an SQLite database.'''
+
+    for statement in ('''
+    CREATE TABLE Fish (
+      ID INTEGER PRIMARY KEY AUTOINCREMENT,
+      Name TEXT NOT NULL UNIQUE,
+      Size TEXT NOT NULL,
+      Food_Value TEXT NOT NULL,
+      Game_Quality TEXT NOT NULL,
+      min_lb REAL,
+      max_lb REAL,
+      mean_lb REAL,
+      sd_lb REAL
+      )
+    ''', '''
+    CREATE TABLE Habitats (
+      Habitat TEXT NOT NULL,
+      Fish_ID INTEGER NOT NULL
+        REFERENCES Fish (ID),
+      PRIMARY KEY (Habitat, Fish_ID)
+      )
+    ''', '''
+    CREATE TABLE Players (
+      ID INTEGER PRIMARY KEY,
+      Rod_level INT NOT NULL,
+      Boat_level INT NOT NULL
+      )
+    ''', '''
+    CREATE TABLE Catches (
+      Catch_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+      Player_ID INTEGER NOT NULL
+        REFERENCES Players (ID),
+      Fish_ID INTEGER NOT NULL
+        REFERENCES Fish (ID),
+      Size INTEGER NOT NULL,
+      Habitat TEXT,
+      Catch_time INT
+      )
+    ''', '''
+    CREATE TABLE CurrentFishers (
+      Player_ID INT PRIMARY KEY
+        REFERENCES Players (ID),
+      Resolve_time INT NOT NULL,
+      Location TEXT NOT NULL,
+      Outcome TEXT,
+      Boat_level INT,
+      Rod_level INT
+      )
+    ''', '''
+    CREATE TABLE Topics (
+      topic TEXT UNIQUE,
+      Christopher INT,
+      Danny INT,
+      Evan INT,
+      Dylan INT,
+      Lars INT,
+      Cole INT,
+      Diego INT,
+      Taco INT,
+      Marcus INT,
+      Everyone INT
+      )
+    ''', '''
+    CREATE TABLE PlayerStats (
+      Player_ID INT PRIMARY KEY
+        REFERENCES Players (ID),
+      Total_lbs INT NOT NULL DEFAULT 0,
+      Catch_count INT NOT NULL DEFAULT 0,
+      Species_count INT NOT NULL DEFAULT 0,
+      Top_catches TEXT NOT NULL DEFAULT '[]'
+      )
+    ''', '''
+    CREATE TABLE PlayerSpecies (
+      Player_ID INT NOT NULL
+        REFERENCES Players (ID),
+      Fish_ID INT NOT NULL
+        REFERENCES Fish (ID),
+      PRIMARY KEY (Player_ID, Fish_ID)
+      )
+    ''', '''
+    CREATE TABLE Leaderboards (
+      Entry_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+      Board TEXT NOT NULL,
+      Player_ID INT NOT NULL
+        REFERENCES Players (ID),
+      Label TEXT,
+      Score INT NOT NULL
+      )
+    '''):
+        c.execute(statement)
+
+    for name, table, columns in (
+            ('Leaderboards_board_score', 'Leaderboards', 'Board, Score DESC'),
+            ('Catches_player_size', 'Catches', 'Player_ID, Size DESC'),
+            ('Catches_player_fish', 'Catches', 'Player_ID, Fish_ID'),
+            ('Catches_habitat_size', 'Catches', 'Habitat, Size DESC'),
+            ('CurrentFishers_location', 'CurrentFishers', 'Location'),
+            ('CurrentFishers_resolve_time', 'CurrentFishers', 'Resolve_time'),
+            ('Habitats_fish', 'Habitats', 'Fish_ID'),
+            ('Leaderboards_board_player', 'Leaderboards', 'Board, Player_ID')):
+        c.execute(f'''CREATE INDEX {name} ON {table} ({columns})''')
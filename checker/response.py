@@ -7,156 +7,256 @@ when certain behaviors are followed.
 '''
 
 from flask import Flask, request
-import os
-import requests
-import re
+import threading
+import database
+import events
 import fishing
+import metrics
 import random
-import time
-from multiprocessing import Process, active_children
+from settings import settings
+from scheduler import trips
+from dispatcher import dispatcher
+from ingest import CommandQueue
+from router import Router, Matcher, parse
 
 # Instantiate a Flask object
 app = Flask(__name__)
 
+# Held while the background tasks are started
+_background_lock = threading.Lock()
+
+
+def start_background_tasks():
+    '''Start this process's background tasks if they aren't running.
+
+    These are the sweeper, which resolves trips left behind by workers
+    which have since gone away, and the listener for other workers'
+    casts, cancellations and reloads. They're started by the first
+    request rather than on import, so importing the app needs no
+    settings; and since they're checked on every request, one which
+    died (e.g. for want of a setting) is started again.
+    '''
+
+    if trips.is_pending('sweeper') and trips.is_pending('events'):
+        return
+    with _background_lock:
+        if not trips.is_pending('sweeper'):
+            trips.schedule('sweeper', fishing.sweepTrips())
+        if not trips.is_pending('events'):
+            trips.schedule('events', events.listen())
+
+
 # Define the only route for the server
 @app.route('/', methods=['POST'])
 def checkit():
     '''The only route for the app. Respond to post requests sent to the endpoint.'''
+    start_background_tasks()
     #---------------------#
     #-- Handle the ping --#
     #---------------------#
     # Parse the message JSON
-    post = request.get_json()
+    post = request.get_json(silent=True)
+    # Ignore anything which isn't a message
+    if not isinstance(post, dict)\
+       or not all(isinstance(post.get(field), str)
+                  for field in ('name', 'text', 'user_id')):
+        return 'Huh?', 400
     # Ignore posts by the bot
     if post['name'] == 'checkers' or post['name'] == 'testBot':
         return 'The End.'
 
-    # Default response does not exist
-    response = None
+    # GroupMe never sends a callback twice, so when the queue is full
+    # the command runs before answering rather than being dropped
+    if settings.ingest_mode == 'inline' or not commands.submit(post):
+        reply(post)
+    # Return a placeholder string to appease Flask
+    return 'Nice!'
 
 
-    #----------#
-    #-- Help --#
-    #----------#
-    if post['text'].lower() == '!help':
-        response = 'Hey! I\'m checkers, the bot that hopes you check yourself before your wreck yourself. The following commands are available:\n!help: See this message\n!insult <name>: Generate an insult\n!loaves: Get bread facts\n!gofish [<location>][<boat>]: Go fishing in an optionally specified location and boat (if unspecified, a random boat and location are chosen for you based on your skill)\n!fish: Learn more about the fishing minigame'
+def reply(post):
+    '''Run the command in a post and queue the bot's response.'''
 
-    #---------------------#
-    #-- Loaves behavior --#
-    #---------------------#
-    # Get a bread fact and return it
-    elif post['text'].lower() == '!loaves':
-        from loaves import breadfacts
-        response = breadfacts()
-
-
-    #-------------#
-    #-- Fishing --#
-    #-------------#
-
-    # Commands for going fishing ---------------------------------------
-    elif re.search('^!gofish', post['text'].lower()):
-        if int(post['user_id']) in fishing.fetchCurrentFishers():
-            # If already fishing, don't fish and tell them they're fishing
-            response = "You're already fishing. Kick back and {}"\
-                .format(random.choice(fishing.ACTIVITIES))
-        else:
-            #-------------------------------#
-            #-- Otherwise, invoke fishing --#
-            #-------------------------------#
-            # Get the player's data
-            user_data = fishing.getUser(post['user_id'])
-
-            # Check if they specified a location
-            hab = re.search("|".join(fishing.HABITATS_SET).lower(),
-                            post['text'].lower())
-            # If no location was specified, pick a random one which they can
-            # visit when considering their available boats
-            hab = hab[0].title() if hab else fishing\
-                .pickViableHabitat(user_data[2])
-
-            # Check if they specified a boat
-            boat = re.search("|".join([boat[0] for boat in fishing.BOATS]),
-                             post['text'].lower())
-            # If they did not, pick their best boat.
-            boat = boat[0] if boat else fishing.BOATS[user_data[2] - 1][0]
-
-            # Add them to the table of current fishers
-            delay = fishing.addCurrentFisher(post['user_id'], hab, user_data[1])
-            fish = fishing.goFishing(hab, boat, user_data[2], user_data[1])
-
-            # Check for improper input (this is an ugly way of doing this)
-            if fish in { "You can't use this boat yet.",
-                         "Your boat isn't well suited to fishing in this location."}:
-                response = fish
-                fishing.resetFishingStatus(post['user_id'])
-            else:
-            # Start the process to resolve the fishing trip
-                Process(target=fishing.resolveFisher,
-                        args=(fish, user_data[0], hab, delay, user_data[2], user_data[1]),
-                        name=f"Process-{user_data[0]}")\
-                    .start()
-
-            # Send a response to acknowledge that your request was handled.
-                response = "You cast out your line. Kick back and {}"\
-                    .format(random.choice(fishing.ACTIVITIES))
-
-    # Commands for fishing data -----------------------------------------
-    elif re.search('^!fish', post['text'].lower()):
-
-        # Command for reseting fishing status
-        if re.search('retry', post['text'].lower()):
-            temp_id = post['user_id']
-            try:
-                process_to_kill = [p for p in active_children()
-                               if p.name == f"Process-{temp_id}"][0]
-                process_to_kill.terminate()
-            except:
-                pass
-
-            fishing.resetFishingStatus(post['user_id'])
-            response = "You reel in your line to try again."
-
-        elif re.search("locations", post['text'].lower()):
-            response = fishing.getInfo('habs')
-
-        # Commands for info about boats and rods
-        elif re.search('boats|rods', post['text'].lower()):
-            response = fishing.getInfo(re.search('boats|rods',
-                                                 post['text'].lower())[0])
-
-        # Commands for info about locations
-        elif re.search("|".join(fishing.HABITATS_SET),
-                       post['text'].title()):
-            response = fishing.getInfo(re.search("|".join(fishing.HABITATS_SET),
-                                                 post['text'].title())[0])
-
-        # Commands for leaderboard stats
-        elif re.search("leaderboard", post['text'].lower()):
-            response = fishing.getInfo("leaderboard")
-
-        # Commands for user data
-        elif re.search("lstats", post['text'].lower()):
-            response = fishing.getInfo('lstats', post['user_id'])
-
-        elif re.search("stats", post['text'].lower()):
-            response = fishing.getInfo(user_id=post['user_id'])
-
-        else:
-            response = "Welcome to the fishing minigame! The following commands are available:\n\nReset:\n--------------\n!fish retry: Reel in your line to try again\n\nInfo:\n--------------\n!fish locations: See the available locations for fishing\n!fish boats: Learn more about the different boats available\n!fish rods: Learn more about the different kinds of rods available\n!fish <location>: Learn more about the specified locations\n\nScores\n--------------\n!fish leaderboard: View the leaderboards\n!fish stats: see your individual stats\n!fish lstats: see your individual stats by location"
-
-
-    #--------------------------#
-    #-- Sending the response --#
-    #--------------------------#
+    response = handle(post)
     if response:
-        # Put the parameters together
-        data = {'bot_id': os.environ['bot_id'],
-                'text': response}
         # Send the post request to the group
-        r = requests.post('https://api.groupme.com/v3/bots/post', data=data)
-    # Return a placeholder string to appease Flask
-    return 'Nice!'
+        dispatcher.send(response)
+
+
+@app.route('/metrics', methods=['GET'])
+def show_metrics():
+    '''This worker's metrics, for Prometheus to scrape.'''
+
+    if not settings.metrics:
+        return 'Metrics are off.', 404
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
+def handle(post):
+    '''Run the command in a post and return the bot's response,
+    or None if it doesn't have one.
+    '''
+
+    if not settings.metrics:
+        return router.route(post)
+
+    message = parse(post['text'])
+    name = command_name(message)
+    if name is None:
+        return None
+    with metrics.command(name):
+        return router.route(post, message)
+
+
+def command_name(message):
+    '''Name the command in a message for its metrics, e.g. '!gofish' or
+    '!fish stats', or return None if it isn't a command.
+    '''
+
+    handler = router.handler(message.command)
+    if handler is None:
+        return None
+    if handler is fish:
+        return f'!fish {fish_router.arg_handler(message).__name__}'
+    return message.command
+
+
+# Commands are looked up by the first word of the message
+router = Router()
+
+# Fishing subcommands are looked up by the words after '!fish'
+fish_router = Router()
+
+# Names which can appear anywhere in a command
+HABITATS = Matcher(fishing.HABITATS_SET)
+BOATS = Matcher([boat[0] for boat in fishing.BOATS])
+
+FISH_HELP = "Welcome to the fishing minigame! The following commands are available:\n\nReset:\n--------------\n!fish retry: Reel in your line to try again\n\nInfo:\n--------------\n!fish locations: See the available locations for fishing\n!fish boats: Learn more about the different boats available\n!fish rods: Learn more about the different kinds of rods available\n!fish <location>: Learn more about the specified locations\n\nScores\n--------------\n!fish leaderboard [<location>|week]: View the leaderboards\n!fish stats: see your individual stats\n!fish lstats: see your individual stats by location"
+
+
+#----------#
+#-- Help --#
+#----------#
+@router.command('!help')
+def show_help(post, message):
+    return 'Hey! I\'m checkers, the bot that hopes you check yourself before your wreck yourself. The following commands are available:\n!help: See this message\n!insult <name>: Generate an insult\n!loaves: Get bread facts\n!gofish [<location>][<boat>]: Go fishing in an optionally specified location and boat (if unspecified, a random boat and location are chosen for you based on your skill)\n!fish: Learn more about the fishing minigame'
+
+
+#---------------------#
+#-- Loaves behavior --#
+#---------------------#
+@router.command('!loaves')
+def loaves(post, message):
+    # Get a bread fact and return it
+    from loaves import breadfacts
+    return breadfacts()
+
+
+#-------------#
+#-- Fishing --#
+#-------------#
+
+# Commands for going fishing ---------------------------------------
+@router.command('!gofish')
+def gofish(post, message):
+    # Check if they specified a location or a boat; if not, castLine
+    # picks for them
+    cast = fishing.castLine(post['user_id'],
+                            HABITATS.find(message.lower),
+                            BOATS.find(message.lower))
+
+    if cast is None:
+        # If already fishing, don't fish and tell them they're fishing
+        return "You're already fishing. Kick back and {}"\
+            .format(random.choice(fishing.ACTIVITIES))
+    # Otherwise, a string means they can't fish there with that boat
+    elif type(cast) == str:
+        return cast
+
+    # Schedule the coroutine which resolves the fishing trip
+    user_data, hab, delay, seed = cast
+    trips.schedule(user_data[0],
+                   fishing.resolveFisher(user_data[0], hab, delay, seed))
+
+    # Send a response to acknowledge that your request was handled.
+    return "You cast out your line. Kick back and {}"\
+        .format(random.choice(fishing.ACTIVITIES))
+
+
+# Commands for fishing data -----------------------------------------
+@router.command('!fish')
+def fish(post, message):
+    return fish_router.route_args(post, message)
+
+
+@fish_router.command('retry')
+def retry(post, message):
+    # Command for reseting fishing status
+    # Cancel the pending trip, on whichever worker is holding it
+    events.publish('cancel', user_id=int(post['user_id']))
+
+    fishing.resetFishingStatus(post['user_id'])
+    return "You reel in your line to try again."
+
+
+@fish_router.command('locations')
+def locations(post, message):
+    return fishing.getInfo('habs')
+
+
+@fish_router.command('boats', 'rods')
+def boats_and_rods(post, message):
+    # Commands for info about boats and rods
+    return fishing.getInfo('boats' if 'boats' in message.args else 'rods')
+
+
+@fish_router.command('leaderboard')
+def leaderboard(post, message):
+    # Commands for leaderboard stats, optionally for a single
+    # location or this week
+    board = HABITATS.find(message.lower) or\
+        ('week' if 'week' in message.args else None)
+    return fishing.getInfo("leaderboard", board=board)
+
+
+@fish_router.command(*HABITATS.names)
+def location(post, message):
+    # Commands for info about locations
+    return fishing.getInfo(HABITATS.find(message.lower))
+
+
+@fish_router.command('lstats')
+def lstats(post, message):
+    # Commands for user data
+    return fishing.getInfo('lstats', post['user_id'])
+
+
+@fish_router.command('stats')
+def stats(post, message):
+    return fishing.getInfo(user_id=post['user_id'])
+
+
+def usage(post, message):
+    return FISH_HELP
+
+
+fish_router.default = usage
+
+
+# The pool which runs commands in 'queue' mode
+commands = CommandQueue(reply)
+
+# What's waiting on this worker, read whenever the metrics are scraped
+metrics.Gauge('checkers_trips_pending',
+              'Trips pending on this worker, plus its sweeper and '
+              'event listener.',
+              trips.pending)
+metrics.Gauge('checkers_command_queue_depth',
+              'Commands waiting for a thread.', commands.depth)
+metrics.Gauge('checkers_posts_pending',
+              'Messages waiting to be posted.', dispatcher.pending)
+metrics.Gauge('checkers_db_connections_in_use',
+              'Database connections checked out.',
+              lambda: database.stats()['in_use'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+'''
+Seeded randomness for fishing trips.
+
+Every trip gets its own seed when the line is cast, and everything
+random about it (the fish, its size, how long the trip takes, who the
+fisher meets and what the bot says) is drawn from generators seeded from
+it. The seed is stored with the trip, so a trip resolved by another
+worker turns out the same, and with RANDOM_SEED set the seeds themselves
+are derived from it, so a day of traffic can be replayed exactly.
+
+Each trip draws from its own generator rather than the `random` module's
+shared one, so threads and simulations running side by side don't
+contend for it or disturb each other's sequences. Where several numbers
+are needed at once, a Stream can draw them with one call.
+'''
+
+import hashlib
+import os
+import random
+import threading
+
+from settings import settings
+
+# Seeds are stored in a BIGINT column, so they must fit in 63 bits
+SEED_BITS = 63
+
+
+def derive_seed(*key):
+    '''Turn a key, e.g. (parent seed, 'finish'), into a seed.'''
+
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> (64 - SEED_BITS)
+
+
+def fresh_seed():
+    '''Return an unpredictable seed.'''
+
+    return int.from_bytes(os.urandom(8), 'big') >> (64 - SEED_BITS)
+
+
+class Stream(random.Random):
+    '''A generator for one trip, or one part of one.
+
+    It has all of random.Random's methods, and can stand in for the
+    `random` module wherever the engine takes an `rng`.
+    '''
+
+    def __init__(self, seed=None):
+        self.initial_seed = fresh_seed() if seed is None else seed
+        super().__init__(self.initial_seed)
+
+    def randint(self, a, b):
+        '''Pick an integer from a to b inclusive.
+
+        random.Random.randint goes through randrange, which costs several
+        times as much as drawing the float itself.
+        '''
+
+        return a + int(self.random() * (b - a + 1))
+
+    def random_block(self, n):
+        '''Draw `n` floats from [0, 1) at once.
+
+        The same numbers n calls to random() would give. They're still
+        drawn one at a time; this only saves looking up the method on
+        every call, which is worth it for long runs of draws but little
+        else.
+        '''
+
+        draw = self.random
+        return [draw() for _ in range(n)]
+
+    def randints(self, n, a, b):
+        '''Pick `n` integers from a to b inclusive, as n calls to randint
+        would, with the same small saving as random_block.
+        '''
+
+        span = b - a + 1
+        draw = self.random
+        return [a + int(draw() * span) for _ in range(n)]
+
+    def spawn(self, part):
+        '''Return a generator for one part of the trip, e.g. 'finish'.
+
+        The parts are independent, so however many numbers one draws,
+        the others turn out the same.
+        '''
+
+        return Stream(derive_seed(self.initial_seed, part))
+
+
+class RandomService:
+    '''Hands out the seeds for new trips.
+
+    With a seed of its own (by default, the RANDOM_SEED setting) the
+    seed for each player's nth trip is derived from it, so the same
+    casts produce the same trips however they're interleaved. Otherwise
+    every trip gets a fresh seed.
+    '''
+
+    def __init__(self, seed=None):
+        self._seed = seed
+        self._lock = threading.Lock()
+        self._casts = {}
+
+    @property
+    def seed(self):
+        return settings.random_seed if self._seed is None else self._seed
+
+    def trip_seed(self, user_id):
+        '''Return the seed for a player's next trip.'''
+
+        if self.seed is None:
+            return fresh_seed()
+        with self._lock:
+            number = self._casts.get(str(user_id), 0)
+            self._casts[str(user_id)] = number + 1
+        return derive_seed(self.seed, str(user_id), number)
+
+    def trip(self, user_id):
+        '''Return a generator for a player's next trip.'''
+
+        return Stream(self.trip_seed(user_id))
+
+
+def trip_stream(seed, part):
+    '''Return the generator for one part of a stored trip.
+
+    Trips cast before seeds were stored don't have one, so they get an
+    unseeded generator.
+    '''
+
+    return Stream(seed).spawn(part) if seed is not None else Stream()
+
+
+# The service shared by everything in this worker
+randomness = RandomService()
@@ -0,0 +1,103 @@
+'''
+Parses messages and routes them to the handler for their command.
+
+A message is split into words once, and its first word (e.g. '!gofish')
+picks the handler out of a dictionary. Commands with subcommands, like
+'!fish', use a second Router keyed on the word after the command.
+'''
+
+import re
+from collections import namedtuple
+
+
+class Message(namedtuple('Message', ['command', 'args', 'text', 'lower'])):
+    '''A parsed message.
+
+    `command` is the message's first word in lower case, `args` the
+    rest of its words in lower case and `lower` the whole message in
+    lower case.
+    '''
+
+    __slots__ = ()
+
+
+def parse(text):
+    '''Split a message into its command and arguments.'''
+
+    lower = text.lower()
+    words = lower.split()
+    if not words:
+        return Message('', (), text, lower)
+    return Message(words[0], tuple(words[1:]), text, lower)
+
+
+class Matcher:
+    '''Finds any of a fixed set of names in a message, e.g. habitats.
+
+    The pattern is compiled once, when the Matcher is created, and
+    matching ignores case but returns the name as it was given.
+    '''
+
+    def __init__(self, names):
+        self.names = {name.lower(): name for name in names}
+        # Try longer names first, so 'swamp boat' wins over 'boat'
+        self.pattern = re.compile(r'\b(?:{})\b'.format(
+            '|'.join(re.escape(name) for name in
+                     sorted(self.names, key=len, reverse=True))))
+
+    def find(self, lower):
+        '''Return the first name in the lower-cased text, or None.'''
+
+        match = self.pattern.search(lower)
+        return self.names[match[0]] if match else None
+
+
+class Router:
+    '''A table of handlers keyed by command.
+
+    Handlers are called with the post and its parsed Message and return
+    the bot's response, or None if it has nothing to say.
+    '''
+
+    def __init__(self, default=None):
+        self._routes = {}
+        self.default = default
+
+    def command(self, *names):
+        '''Register the decorated function as the handler for `names`.'''
+
+        def register(handler):
+            for name in names:
+                self._routes[name] = handler
+            return handler
+
+        return register
+
+    def handler(self, name):
+        return self._routes.get(name, self.default)
+
+    def route(self, post, message=None):
+        '''Call the handler for a post's command.'''
+
+        message = message or parse(post['text'])
+        handler = self.handler(message.command)
+        return handler(post, message) if handler else None
+
+    def arg_handler(self, message):
+        '''Return the handler for the first of a message's arguments
+        which has one, e.g. 'leaderboard' in '!fish the leaderboard'.
+        '''
+
+        for arg in message.args:
+            handler = self._routes.get(arg)
+            if handler:
+                return handler
+        return self.default
+
+    def route_args(self, post, message):
+        '''Call the handler for the first of a message's arguments which
+        has one.
+        '''
+
+        handler = self.arg_handler(message)
+        return handler(post, message) if handler else None
@@ -0,0 +1,141 @@
+'''
+Schedules fishing trips for the bot.
+
+Rather than forking a process for every trip, each worker runs a single
+asyncio event loop on a background thread. Pending trips are coroutines
+sleeping on that loop, so they only cost a small task object each; the
+loop keeps its timers in a heap ordered by when they are due.
+'''
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def log_failure(task):
+    '''Log the exception a finished task raised, if it raised one.
+
+    Nothing awaits a trip, so this is added to each one to keep its
+    failures from going unnoticed.
+    '''
+
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Task failed', exc_info=task.exception())
+
+
+class TripScheduler:
+    '''Owns the worker's event loop and the trips pending on it.
+
+    Trips are keyed by player ID, so a player can only have one trip
+    pending at a time and it can be cancelled by ID.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._trips = {}
+
+    def _ensure_running(self):
+        '''Start the event loop thread if it isn't running in this process.
+
+        Gunicorn forks its workers, and threads don't survive a fork, so
+        the loop is started lazily in whichever process first needs it.
+        '''
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._trips = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run,
+                                            name='trip-scheduler',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def loop(self):
+        '''The worker's event loop.'''
+
+        self._ensure_running()
+        return self._loop
+
+    def schedule(self, key, coro):
+        '''Run the coroutine `coro` on the loop as the trip for `key`.
+
+        Any trip already pending for `key` is cancelled first.
+        '''
+
+        self._ensure_running()
+        self.cancel(key)
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        with self._lock:
+            self._trips[key] = future
+
+        def forget(done, key=key):
+            with self._lock:
+                if self._trips.get(key) is done:
+                    del self._trips[key]
+
+        future.add_done_callback(forget)
+        future.add_done_callback(log_failure)
+        return future
+
+    def cancel(self, key):
+        '''Cancel the trip pending for `key`.
+
+        Returns True if a trip was pending.
+        '''
+
+        with self._lock:
+            future = self._trips.pop(key, None)
+        if future is None:
+            return False
+        future.cancel()
+        return True
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._trips
+
+    def pending(self):
+        '''Return the number of trips currently pending.'''
+
+        with self._lock:
+            return len(self._trips)
+
+    def run(self, coro, timeout=None):
+        '''Run a coroutine on the loop and block until it returns.'''
+
+        self._ensure_running()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)\
+                      .result(timeout)
+
+
+async def in_thread(fn, *args, **kwargs):
+    '''Run a blocking function (e.g. a database query) on the loop's
+    thread pool, so the trips sharing the loop aren't held up by it.
+
+    Like asyncio.to_thread, the function sees the caller's context
+    variables, as coroutines run on the loop do.
+    '''
+
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop()\
+        .run_in_executor(None, functools.partial(context.run, fn,
+                                                 *args, **kwargs))
+
+
+# The scheduler shared by everything in this worker
+trips = TripScheduler()
@@ -0,0 +1,94 @@
+'''
+The bot's configuration, read from the environment when it's first used.
+
+Nothing is read at import, so every module can be imported (by a test,
+a benchmark or a gunicorn worker) without the environment being set up.
+A setting which is needed but missing raises a ConfigurationError naming
+the variable at the point it's first used.
+'''
+
+import os
+
+
+class ConfigurationError(KeyError):
+    '''Raised when a required environment variable isn't set.'''
+
+
+# Marks a setting which has no default
+REQUIRED = object()
+
+
+class Setting:
+    '''An environment variable, converted with `cast` and cached on the
+    Settings instance the first time it's read.
+    '''
+
+    def __init__(self, variable, default=REQUIRED, cast=str):
+        self.variable = variable
+        self.default = default
+        self.cast = cast
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, settings, owner=None):
+        if settings is None:
+            return self
+        value = settings.environ.get(self.variable)
+        if value is None:
+            if self.default is REQUIRED:
+                raise ConfigurationError(f'{self.variable} is not set')
+            value = self.default
+        else:
+            value = self.cast(value)
+        settings.__dict__[self.name] = value
+        return value
+
+
+def flag(value):
+    '''Read an on/off setting, e.g. '1', 'true' or 'on'.'''
+
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Settings:
+    '''Every setting the bot reads from its environment.'''
+
+    # Where the game is stored; see database.open_database
+    database_url = Setting('DATABASE_URL')
+    # The most connections a single worker will hold open
+    pool_size = Setting('DB_POOL_SIZE', 4, int)
+
+    # How many commands run at once, and how many may wait for a thread
+    # before the rest are run on the request thread
+    ingest_workers = Setting('INGEST_WORKERS', 4, int)
+    ingest_queue_size = Setting('INGEST_QUEUE_SIZE', 1000, int)
+    # Either 'queue' to answer GroupMe straight away and run commands on
+    # a pool of threads, or 'inline' to run them before answering
+    ingest_mode = Setting('INGEST_MODE', 'queue')
+
+    # Replays trips exactly when set; see rng.py
+    random_seed = Setting('RANDOM_SEED', None, int)
+
+    # Whether to time commands, queries and API calls; see metrics.py
+    metrics = Setting('METRICS', False, flag)
+
+    # Where the GroupMe API is, and the credentials for reading the
+    # group and posting as the bot
+    groupme_api_url = Setting('GROUPME_API_URL', 'https://api.groupme.com/v3')
+    groupme_token = Setting('token')
+    bot_id = Setting('bot_id')
+
+    def __init__(self, environ=os.environ):
+        self.environ = environ
+
+    def reset(self):
+        '''Forget every cached value, so they're read again.'''
+
+        environ = self.environ
+        self.__dict__.clear()
+        self.environ = environ
+
+
+# The settings shared by everything in this worker
+settings = Settings()
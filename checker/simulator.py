@@ -0,0 +1,277 @@
+'''
+A Monte Carlo simulator for balancing the fishing game.
+
+Plays the same game as goFishing, tripDelay and finishTrip, but draws
+whole batches of casts at once with NumPy instead of one at a time with
+`random`, against a catalogue built straight from fishfacts.pickle. It
+never touches the database or sends a message, so it can answer
+questions like "how many casts does it take to reach the skipper?" in
+seconds rather than by playing.
+
+NumPy isn't needed by the bot itself, so it isn't in requirements.txt;
+install it to use the simulator:
+    pip install numpy
+
+Run from the repository root:
+    python checker/simulator.py [--casts N] [--players N] [--seed N]
+'''
+
+import argparse
+import os
+import pickle
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    raise ImportError('the simulator needs NumPy: pip install numpy')
+
+import fishing
+from catalogue import MIN_SIZE, unit_factor, validate_fishfacts
+
+FISHFACTS = os.path.join(os.path.dirname(__file__), 'data', 'fishfacts.pickle')
+
+# What can happen on a cast
+NOTHING, CATCH, ROD_PROBLEM, BOAT_PROBLEM = range(4)
+
+LEVELS = range(1, len(fishing.BOATS) + 1)
+
+BOAT_BONUS = np.array([boat.bonus for boat in fishing.BOATS])
+ROD_BONUS = np.array([rod.bonus for rod in fishing.RODS])
+BOAT_THRESHOLDS = np.array([check[1] for check in fishing.LEVEL_CHECKS['boat']])
+ROD_THRESHOLDS = np.array([check[1] for check in fishing.LEVEL_CHECKS['rod']])
+
+
+class SimulatedCatalogue:
+    '''The fish in each habitat as arrays, indexed by habitat name.
+
+    Every fish has an index into `names`, so species can be counted with
+    an array of flags per player.
+    '''
+
+    def __init__(self, fish, habitats):
+        self.names = tuple(row[0] for row in fish)
+        index = {name: number for number, name in enumerate(self.names)}
+        mean_lb = np.array([row[6] for row in fish])
+        sd_lb = np.array([row[7] for row in fish])
+        floor_lb = np.array([MIN_SIZE * unit_factor(row[1]) for row in fish])
+
+        self.fish = {}
+        for name, habitat in habitats:
+            self.fish.setdefault(habitat, []).append(index[name])
+        self.fish = {habitat: np.array(numbers)
+                     for habitat, numbers in self.fish.items()}
+        self.mean_lb = {habitat: mean_lb[numbers]
+                        for habitat, numbers in self.fish.items()}
+        self.sd_lb = {habitat: sd_lb[numbers]
+                      for habitat, numbers in self.fish.items()}
+        self.floor_lb = {habitat: floor_lb[numbers]
+                         for habitat, numbers in self.fish.items()}
+
+    @classmethod
+    def load(cls, path=FISHFACTS):
+        '''Build the catalogue from the scraped fish facts.'''
+
+        with open(path, mode='rb') as f:
+            fish, habitats, _ = validate_fishfacts(pickle.load(f))
+        return cls(fish, habitats)
+
+
+def fish_difficulty(sizes):
+    '''calc_fish_difficulty for an array of sizes.'''
+
+    return 100 / (1 + np.exp(0.12 * (50 - sizes)))
+
+
+class Simulator:
+    '''Draws batches of casts and trips from a seeded generator.'''
+
+    def __init__(self, catalogue=None, seed=None):
+        self.catalogue = catalogue or SimulatedCatalogue.load()
+        self.rng = np.random.default_rng(seed)
+        self.catch_rates = {habitat:
+                            fishing.calc_habitat_catch_rate_modifier(habitat)
+                            for habitat in self.catalogue.fish}
+
+    def cast(self, habitat, boat_level, rod_level, n):
+        '''Simulate `n` casts like goFishing.
+
+        Returns arrays of each cast's outcome, the index of the fish
+        hooked (or -1) and its size in lbs (or 0).
+        '''
+
+        rng = self.rng
+        # The same dice goFishing rolls
+        caught = rng.integers(0, 101, n) <= self.catch_rates[habitat]
+        picks = rng.integers(0, len(self.catalogue.fish[habitat]), n)
+        sizes = np.round(np.maximum(
+            rng.normal(self.catalogue.mean_lb[habitat][picks],
+                       self.catalogue.sd_lb[habitat][picks]),
+            self.catalogue.floor_lb[habitat][picks]), 2)
+        difficulty = fish_difficulty(sizes)
+        rod_problem = rng.integers(0, 101, n)\
+            < difficulty - ROD_BONUS[rod_level - 1]
+        boat_problem = rng.integers(0, 101, n)\
+            < difficulty - BOAT_BONUS[boat_level - 1]
+
+        outcomes = np.select([~caught, rod_problem, boat_problem],
+                             [NOTHING, ROD_PROBLEM, BOAT_PROBLEM], CATCH)
+        landed = outcomes == CATCH
+        return (outcomes,
+                np.where(landed, self.catalogue.fish[habitat][picks], -1),
+                np.where(landed, sizes, 0))
+
+    def trip_delays(self, rod_level, n):
+        '''tripDelay for `n` trips, in seconds.'''
+
+        return np.maximum(0, np.trunc(self.rng.normal(60 - 3 * rod_level,
+                                                      20, n)) * 60)
+
+    def rates(self, casts=100000):
+        '''Tabulate every habitat, boat level and rod level a player can
+        fish with.
+
+        Returns a list of dictionaries, one per combination, with the
+        share of casts ending each way, the lbs landed per cast and per
+        hour of trips, and the average trip length in minutes.
+        '''
+
+        table = []
+        for habitat in sorted(self.catalogue.fish):
+            for boat_level in LEVELS:
+                if boat_level < fishing.HABITATS_AVG_LB[habitat]['level']:
+                    continue
+                for rod_level in LEVELS:
+                    outcomes, _, sizes = self.cast(habitat, boat_level,
+                                                   rod_level, casts)
+                    minutes = self.trip_delays(rod_level, casts).mean() / 60
+                    shares = np.bincount(outcomes, minlength=4) / casts
+                    lbs = np.round(sizes).mean()
+                    table.append({'habitat': habitat,
+                                  'boat_level': boat_level,
+                                  'rod_level': rod_level,
+                                  'nothing': shares[NOTHING],
+                                  'catch': shares[CATCH],
+                                  'rod_problem': shares[ROD_PROBLEM],
+                                  'boat_problem': shares[BOAT_PROBLEM],
+                                  'lbs_per_cast': lbs,
+                                  'minutes_per_trip': minutes,
+                                  'lbs_per_hour': lbs / minutes * 60
+                                  if minutes else float('inf')})
+        return table
+
+    def progression(self, players=10000, casts=2000):
+        '''Play `casts` trips for each of `players` new players, each
+        fishing a random habitat their boat can reach, as !gofish does
+        when no habitat is given.
+
+        Returns arrays of each player's boat and rod levels after every
+        cast, shaped (casts, players), and the hours each player has
+        spent fishing by then.
+        '''
+
+        rng = self.rng
+        boat_levels = np.ones(players, dtype=int)
+        rod_levels = np.ones(players, dtype=int)
+        total_lbs = np.zeros(players)
+        species = np.zeros((players, len(self.catalogue.names)), dtype=bool)
+        hours = np.zeros(players)
+        boat_history = np.empty((casts, players), dtype=np.int8)
+        rod_history = np.empty((casts, players), dtype=np.int8)
+        hours_history = np.empty((casts, players))
+
+        habitats_by_level = [[habitat for habitat in options
+                              if habitat in self.catalogue.fish]
+                             for options in fishing.HABITATS_BY_LEVEL]
+        for cast in range(casts):
+            for boat_level in LEVELS:
+                for rod_level in LEVELS:
+                    group = np.flatnonzero((boat_levels == boat_level)
+                                           & (rod_levels == rod_level))
+                    if not len(group):
+                        continue
+                    options = habitats_by_level[boat_level]
+                    choices = rng.integers(0, len(options), len(group))
+                    for number, habitat in enumerate(options):
+                        fishers = group[choices == number]
+                        if not len(fishers):
+                            continue
+                        _, fish, sizes = self.cast(habitat, boat_level,
+                                                   rod_level, len(fishers))
+                        landed = fish >= 0
+                        # registerCatch stores sizes rounded to the lb
+                        total_lbs[fishers] += np.round(sizes)
+                        species[fishers[landed], fish[landed]] = True
+                    hours[group] += self.trip_delays(rod_level,
+                                                     len(group)) / 3600
+
+            # finishTrip raises each level by at most one per trip
+            species_counts = species.sum(axis=1)
+            boat_levels += (boat_levels < len(BOAT_BONUS))\
+                & (total_lbs > BOAT_THRESHOLDS[np.minimum(boat_levels,
+                                                          len(BOAT_THRESHOLDS))
+                                               - 1])
+            rod_levels += (rod_levels < len(ROD_BONUS))\
+                & (species_counts >= ROD_THRESHOLDS[np.minimum(rod_levels,
+                                                               len(ROD_THRESHOLDS))
+                                                    - 1])
+            boat_history[cast] = boat_levels
+            rod_history[cast] = rod_levels
+            hours_history[cast] = hours
+
+        return boat_history, rod_history, hours_history
+
+
+def casts_to_reach(history, level, percentile=50):
+    '''How many casts it took the given percentile of players to reach a
+    level, or None if too few of them did.
+    '''
+
+    reached = (history >= level).argmax(axis=0) + 1.0
+    reached[~(history[-1] >= level)] = np.inf
+    casts = np.percentile(reached, percentile)
+    return None if np.isinf(casts) else int(casts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--casts', type=int, default=100000,
+                        help='casts per combination in the rates table')
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--trips', type=int, default=2000,
+                        help='trips per player in the progression')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    simulator = Simulator(seed=args.seed)
+
+    started = time.perf_counter()
+    table = simulator.rates(args.casts)
+    seconds = time.perf_counter() - started
+    print(f'{"habitat":<12}boat rod  catch  rod! boat!  lbs/cast  '
+          f'min/trip  lbs/hour')
+    for row in table:
+        print(f'{row["habitat"]:<12}{row["boat_level"]:>4}{row["rod_level"]:>4}'
+              f'{row["catch"]:>7.1%}{row["rod_problem"]:>6.1%}'
+              f'{row["boat_problem"]:>6.1%}{row["lbs_per_cast"]:>10.1f}'
+              f'{row["minutes_per_trip"]:>10.1f}{row["lbs_per_hour"]:>10.1f}')
+    print(f'{len(table) * args.casts / seconds:,.0f} casts a second\n')
+
+    started = time.perf_counter()
+    boats, rods, hours = simulator.progression(args.players, args.trips)
+    seconds = time.perf_counter() - started
+    print('Casts (and hours) for half / 90% of players to reach each level')
+    for name, history, gear in (('boat', boats, fishing.BOATS),
+                                ('rod', rods, fishing.RODS)):
+        for level in LEVELS[1:]:
+            line = f'{name} {level} ({gear[level - 1].name}):'
+            for percentile in (50, 90):
+                casts = casts_to_reach(history, level, percentile)
+                line += ' never' if casts is None else\
+                    f' {casts} ({np.median(hours[casts - 1]):.0f}h)'
+            print(line)
+    print(f'{args.players * args.trips / seconds:,.0f} trips a second')
+
+
+if __name__ == '__main__':
+    main()
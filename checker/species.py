@@ -0,0 +1,96 @@
+'''
+The species each player has caught, as a bitset.
+
+Bit n of a player's set is on once they've caught the fish with ID n.
+With under two hundred species that's a couple of dozen bytes, stored
+with their totals in PlayerStats and cached by each worker. Counting
+the species a player has caught in a habitat is then an AND with the
+habitat's mask (see Catalogue.species_masks) and a count of the bits
+left, with no scan of their catches.
+'''
+
+import threading
+import time
+
+import database
+import events
+
+# How long a worker trusts its copy of a player's set before loading it
+# again, in case a catch on another worker was missed
+MAX_AGE = 60 * 60
+
+
+def to_bytes(bits):
+    '''Turn a set into the bytes stored in PlayerStats.'''
+
+    return bits.to_bytes(max(1, (bits.bit_length() + 7) // 8), 'little')
+
+
+def from_bytes(value):
+    '''Turn the bytes stored in PlayerStats, or NULL, into a set.'''
+
+    return int.from_bytes(bytes(value), 'little') if value else 0
+
+
+def popcount(bits):
+    '''Count the species in a set.'''
+
+    # int.bit_count only arrived in Python 3.10
+    return bin(bits).count('1')
+
+
+class SpeciesSets:
+    '''Each player's set, loaded from PlayerStats when first needed.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sets = {}
+
+    def get(self, user_id):
+        '''Return a player's set.'''
+
+        user_id = int(user_id)
+        with self._lock:
+            cached = self._sets.get(user_id)
+        if cached is not None and time.time() - cached[1] < MAX_AGE:
+            return cached[0]
+
+        with database.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+              SELECT Species
+              FROM PlayerStats
+              WHERE Player_ID = %s
+            ''', (user_id,))
+            row = c.fetchone()
+        bits = from_bytes(row[0]) if row else 0
+        self.remember(user_id, bits)
+        return bits
+
+    def remember(self, user_id, bits):
+        '''Cache a player's set, as just read or written.'''
+
+        with self._lock:
+            self._sets[int(user_id)] = (bits, time.time())
+
+    def caught(self, user_id, fish_id):
+        '''Add a species to a player's set, if it's cached.'''
+
+        with self._lock:
+            cached = self._sets.get(int(user_id))
+            if cached is not None:
+                self._sets[int(user_id)] = (cached[0] | 1 << fish_id,
+                                            cached[1])
+
+
+# Every player's set, shared by everything in this worker
+players = SpeciesSets()
+
+
+@events.subscribe('catch')
+def caught_species(user_id, fish_id, **catch):
+    '''Keep the cached set up to date when a player catches a fish on
+    any worker.
+    '''
+
+    players.caught(user_id, fish_id)
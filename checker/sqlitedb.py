@@ -0,0 +1,192 @@
+'''
+An embedded SQLite database which stands in for PostgreSQL.
+
+Used when DATABASE_URL is a sqlite: URL, e.g. 'sqlite:///fishing.db' for
+a file or 'sqlite://' for a database held in memory, so the game can be
+played, tested and benchmarked without a Postgres server.
+
+The rest of the bot writes its queries for Postgres. The cursors here
+translate the little which differs: placeholders are written '%s' rather
+than '?', and row locks are dropped, since every checkout already holds
+the whole database. The schema is created by migrations.migrate, which
+knows how to build it for SQLite. RETURNING and ON CONFLICT need SQLite
+3.35 or newer.
+'''
+
+import functools
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# SQLite before 3.32 allows no more than this many parameters a statement
+MAX_VARIABLES = 999
+
+ROW_LOCK_REGEX = re.compile(r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?',
+                            re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def translate(sql):
+    '''Rewrite a query written for Postgres so SQLite can run it.'''
+
+    return ROW_LOCK_REGEX.sub('', sql).replace('%s', '?')
+
+
+class SQLiteCursor:
+    '''A cursor which accepts the bot's Postgres queries.'''
+
+    def __init__(self, conn):
+        self.connection = conn
+        self._cursor = conn._conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, args=()):
+        self.connection._begin()
+        self._cursor.execute(translate(sql), args)
+
+    def execute_values(self, sql, rows, fetch=False):
+        '''Run an INSERT ... VALUES %s for many rows at once, like
+        psycopg2.extras.execute_values.
+        '''
+
+        results = []
+        if not rows:
+            return results
+        width = len(rows[0])
+        page_size = max(1, MAX_VARIABLES // width)
+        row_placeholders = '({})'.format(', '.join(['%s'] * width))
+        for start in range(0, len(rows), page_size):
+            page = rows[start:start + page_size]
+            self.execute(sql.replace('%s', ', '.join([row_placeholders]
+                                                     * len(page))),
+                         [value for row in page for value in row])
+            if fetch:
+                results.extend(self.fetchall())
+        return results
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    '''A connection which starts transactions the way psycopg2 does:
+    before the first statement after a commit or rollback.
+    '''
+
+    def __init__(self, path, cursor_class=SQLiteCursor):
+        # Transactions are managed here rather than by the sqlite3 module
+        self._conn = sqlite3.connect(path, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self.cursor_class = cursor_class
+        self.closed = False
+
+    def _begin(self):
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN')
+
+    def cursor(self):
+        return self.cursor_class(self)
+
+    def commit(self):
+        if self._conn.in_transaction:
+            self._conn.execute('COMMIT')
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute('ROLLBACK')
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+
+class SQLiteDatabase:
+    '''A single connection to an SQLite database, shared by every thread.
+
+    Checkouts take turns, so each holds the whole database until it is
+    returned. A thread which checks out a connection while it already
+    holds it (e.g. to load the catalogue in the middle of a cast) shares
+    the outer checkout's transaction.
+    '''
+
+    dialect = 'sqlite'
+
+    def __init__(self, path, cursor_class=SQLiteCursor):
+        self.path = path
+        self.cursor_class = cursor_class
+        self.size = 1
+        self._lock = threading.RLock()
+        self._conn = None
+        self._depth = 0
+        self.metrics = {'checkouts': 0,
+                        'waits': 0,
+                        'wait_seconds': 0.0,
+                        'in_use': 0,
+                        'errors': 0}
+
+    def _checkout(self):
+        started = time.time()
+        if not self._lock.acquire(blocking=False):
+            self.metrics['waits'] += 1
+            self._lock.acquire()
+            self.metrics['wait_seconds'] += time.time() - started
+        if self._conn is None:
+            self._conn = SQLiteConnection(self.path, self.cursor_class)
+        self._depth += 1
+        self.metrics['checkouts'] += 1
+        self.metrics['in_use'] = 1
+        return self._conn
+
+    def _checkin(self):
+        self._depth -= 1
+        if not self._depth:
+            self.metrics['in_use'] = 0
+        self._lock.release()
+
+    @contextmanager
+    def connection(self):
+        '''Borrow the connection for the duration of a with block.
+
+        The transaction is committed if the outermost block succeeds and
+        rolled back if any block raises.
+        '''
+
+        conn = self._checkout()
+        try:
+            yield conn
+            if self._depth == 1:
+                conn.commit()
+        except Exception:
+            self.metrics['errors'] += 1
+            conn.rollback()
+            raise
+        finally:
+            self._checkin()
+
+    def stats(self):
+        '''Return a snapshot of the database's metrics.'''
+
+        snapshot = dict(self.metrics)
+        snapshot['size'] = self.size
+        return snapshot
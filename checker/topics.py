@@ -0,0 +1,131 @@
+'''
+An in-memory copy of what fishers talk about when they meet.
+
+Each member can have topics of their own, kept in TopicMembers by their
+GroupMe user ID (or, for the topics carried over from when every member
+had a column in Topics, by their first name). Members without any talk
+about the topics marked for everyone.
+
+Topics rarely change, so each worker loads them all the first time
+there's an encounter and picks from tuples in memory after that. Adding
+a topic with add_topic tells every worker to load them again.
+'''
+
+import random
+import threading
+import time
+
+import database
+import events
+
+# How long a copy is used before it's loaded again, in case a change
+# was missed
+MAX_AGE = 60 * 60
+
+
+class TopicIndex:
+    '''The topics for each member, and for everyone else.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._by_name = {}
+        self._everyone = ()
+        self.loaded_at = 0
+
+    @property
+    def stale(self):
+        return time.time() - self.loaded_at > MAX_AGE
+
+    def load(self):
+        '''Load the topics from the database, replacing any copy
+        already held.
+        '''
+
+        with database.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+              SELECT topic
+              FROM Topics
+              WHERE Everyone = 1
+            ''')
+            everyone = tuple(row[0] for row in c.fetchall())
+            c.execute('''
+              SELECT Topic, User_ID, Member_name
+              FROM TopicMembers
+              ORDER BY Topic
+            ''')
+            rows = c.fetchall()
+
+        by_user = {}
+        by_name = {}
+        for topic, user_id, name in rows:
+            if user_id is not None:
+                by_user.setdefault(user_id, []).append(topic)
+            else:
+                by_name.setdefault(name.lower(), []).append(topic)
+
+        with self._lock:
+            self._by_user = {user_id: tuple(topics)
+                             for user_id, topics in by_user.items()}
+            self._by_name = {name: tuple(topics)
+                             for name, topics in by_name.items()}
+            self._everyone = everyone
+            self.loaded_at = time.time()
+
+    def reload(self):
+        '''Throw away the current copy and load the topics again.'''
+
+        self.load()
+
+    def for_member(self, user_id, first_name=None):
+        '''Return a tuple of a member's topics.
+
+        Only reads the copy in memory; load it first if it's stale.
+        '''
+
+        with self._lock:
+            return self._by_user.get(str(user_id))\
+                or (first_name and self._by_name.get(first_name.lower()))\
+                or self._everyone
+
+    def pick(self, user_id, first_name=None, rng=random):
+        '''Pick one of a member's topics, or None if there are none.'''
+
+        topics = self.for_member(user_id, first_name)
+        return rng.choice(topics) if topics else None
+
+
+def add_topic(topic, user_id=None, member_name=None):
+    '''Add a topic for a member, by user ID or first name, or for
+    everyone if neither is given, and have every worker pick it up.
+    '''
+
+    everyone = user_id is None and member_name is None
+    with database.connection() as conn:
+        c = conn.cursor()
+        c.execute(f'''
+          INSERT
+          INTO Topics (topic, Everyone)
+          VALUES (%s, %s)
+          ON CONFLICT (topic) DO {'UPDATE SET Everyone = 1'
+                                  if everyone else 'NOTHING'}
+        ''', (topic, int(everyone)))
+        if not everyone:
+            c.execute('''
+              INSERT
+              INTO TopicMembers (Topic, User_ID, Member_name)
+              VALUES (%s, %s, %s)
+              ON CONFLICT DO NOTHING
+            ''', (topic,
+                  None if user_id is None else str(user_id),
+                  None if user_id is not None else member_name))
+
+    events.publish('topics')
+
+
+# The topics shared by everything in this worker
+topics = TopicIndex()
+
+# Pick up new topics, whichever worker added them
+events.subscribe('topics')(topics.reload)
@@ -0,0 +1,5 @@
+import os
+
+# Tests run against an embedded database held in memory, unless told
+# otherwise
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
@@ -0,0 +1,31 @@
+import pytest
+from catalogue import parse_size, unit_factor, validate_fishfacts
+
+
+def test_parse_size():
+    assert parse_size('5-10 lb') == (5, 10, 7.5, 1.25)
+    min_lb, max_lb, mean_lb, sd_lb = parse_size('2 kg')
+    assert min_lb == max_lb == mean_lb == pytest.approx(4.409246)
+    assert sd_lb == pytest.approx(0.4409246)
+
+
+def test_unit_factor():
+    assert unit_factor('5-10 lb') == 1
+    assert unit_factor('4 to 12oz') == 0.0625
+    assert unit_factor('1 to 2.5kg') == pytest.approx(2.204623)
+
+
+def test_validate_fishfacts():
+    fish, habitats, skipped = validate_fishfacts({
+        'Bass': {'Size': '2 to 4 lbs', 'Food Value': 'Good',
+                 'Game Qualities': 'Good', 'Habitats': 'Lake, River, Lake'},
+        'Garfish': {'Size': '20-70" ', 'Food Value': 'Average',
+                    'Game Qualities': 'Good', 'Habitats': 'Inshore'},
+        'Mystery': {'Size': 'big', 'Food Value': 'Poor',
+                    'Game Qualities': 'Poor', 'Habitats': 'Lake'},
+        'Partial': {'Size': '1 lb'},
+    })
+    assert [row[:4] for row in fish] == [('Bass', '2 to 4 lbs', 'Good', 'Good')]
+    assert fish[0][4:] == (2, 4, 3, 0.5)
+    assert habitats == [('Bass', 'Lake'), ('Bass', 'River')]
+    assert skipped == ['Garfish', 'Mystery', 'Partial']
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from psycopg2 import pool
+
+import database
+from database import ConnectionPool
+
+
+class FakeCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params=None):
+        pass
+
+
+class FakeConnection:
+    closed = False
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    '''Stands in for psycopg2's ThreadedConnectionPool.'''
+
+    def __init__(self, minconn, maxconn, dsn, **kwargs):
+        self.idle = []
+        self.opened = 0
+
+    def getconn(self):
+        if self.idle:
+            return self.idle.pop()
+        self.opened += 1
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        if not close:
+            self.idle.append(conn)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(pool, 'ThreadedConnectionPool', FakePool)
+    return ConnectionPool('postgres://test', 2)
+
+
+def test_first_connection_is_checked_back_in(db):
+    with db.connection() as conn:
+        pass
+    with db.connection() as again:
+        pass
+
+    assert again is conn
+    assert conn.commits == 2
+    assert db.stats()['in_use'] == 0
+    assert db.stats()['checkouts'] == 2
+
+
+def test_failed_block_rolls_back(db):
+    with pytest.raises(ValueError):
+        with db.connection() as conn:
+            raise ValueError
+
+    assert conn.rollbacks == 1
+    assert db.stats()['errors'] == 1
+    assert db.stats()['in_use'] == 0
+
+
+def test_checkouts_wait_for_a_free_connection(db):
+    got = threading.Event()
+
+    def borrow():
+        with db.connection():
+            got.set()
+
+    with db.connection(), db.connection():
+        waiter = threading.Thread(target=borrow)
+        waiter.start()
+        assert not got.wait(0.1)
+
+    assert got.wait(5)
+    waiter.join()
+    assert db.stats()['waits'] == 1
+    assert db.stats()['in_use'] == 0
+
+
+def test_only_idle_connections_are_health_checked(db, monkeypatch):
+    with db.connection():
+        pass
+    with db.connection():
+        pass
+    assert db.stats()['health_checks'] == 0
+
+    monkeypatch.setattr(database, 'HEALTH_CHECK_AFTER', 0)
+    with db.connection():
+        pass
+    assert db.stats()['health_checks'] == 1
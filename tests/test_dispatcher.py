@@ -0,0 +1,83 @@
+import time
+from dispatcher import Dispatcher, TokenBucket
+from groupme import GroupMeError
+from scheduler import TripScheduler
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_coalesces_keyed_messages():
+    posted = []
+
+    async def post(text):
+        posted.append(text)
+
+    dispatcher = Dispatcher(post, TripScheduler(), rate=100, burst=10,
+                            coalesce_window=0.1)
+    dispatcher.send('You caught a fish!', key=1)
+    dispatcher.send('Level up!', key=1)
+    dispatcher.send('Hello', key=2)
+    wait_for(lambda: len(posted) == 2)
+    assert posted == ['You caught a fish!\n\nLevel up!', 'Hello']
+    assert dispatcher.stats()['coalesced'] == 1
+
+
+def test_retries_failed_posts():
+    posted = []
+
+    async def post(text):
+        if not posted:
+            posted.append(None)
+            raise GroupMeError('throttled', 429)
+        posted.append(text)
+
+    dispatcher = Dispatcher(post, TripScheduler(), backoff=0.01)
+    dispatcher.send('Hello')
+    wait_for(lambda: dispatcher.stats()['sent'] == 1)
+    assert posted == [None, 'Hello']
+    assert dispatcher.stats()['retried'] == 1
+
+
+def test_token_bucket_limits_rate():
+    import asyncio
+    bucket = TokenBucket(rate=50, burst=1)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    started = time.monotonic()
+    asyncio.run(take(6))
+    assert time.monotonic() - started >= 0.09
+
+
+def test_replies_dont_wait_behind_keyed_messages():
+    posted = []
+
+    async def post(text):
+        posted.append(text)
+
+    dispatcher = Dispatcher(post, TripScheduler(), coalesce_window=60)
+    dispatcher.send('You caught a fish!', key=1)
+    dispatcher.send('Hello')
+    wait_for(lambda: posted == ['Hello'], timeout=1)
+    assert dispatcher.stats()['pending'] == 1
+
+
+def test_only_transient_failures_are_retried():
+    attempts = []
+
+    async def post(text):
+        attempts.append(text)
+        raise KeyError('bot_id')
+
+    dispatcher = Dispatcher(post, TripScheduler(), backoff=0.01)
+    dispatcher.send('Hello')
+    wait_for(lambda: dispatcher.stats()['failed'] == 1)
+    assert attempts == ['Hello']
+    assert dispatcher.stats()['retried'] == 0
@@ -0,0 +1,60 @@
+import random
+import time
+
+from encounters import FisherIndex
+
+
+def test_index_merges_local_trips_with_the_table():
+    index = FisherIndex()
+    index.add(1, 'Lake', 100)
+    index.replace_table([(1, 'Lake', 90), (2, 'Lake', 50), (3, 'Reef', 80)],
+                        time.monotonic())
+
+    assert sorted(index.at('Lake', now=0)) == [(1, 100), (2, 50)]
+    # Trips which have resolved are left out
+    assert index.at('Lake', now=60) == [(1, 100)]
+
+    index.remove(1)
+    assert index.at('Lake', now=0) == [(2, 50)]
+    assert not index.is_fishing(1)
+
+
+def test_copying_the_table_keeps_newer_changes():
+    index = FisherIndex()
+    index.note(1, 'Lake', 90)
+    index.note(2, 'Lake', 50)
+    read_at = time.monotonic()
+    # Heard about while the table was being read
+    index.note(3, 'Reef', 80)
+    index.note(1, 'Reef', 90)
+    index.remove(2)
+    index.replace_table([(1, 'Lake', 90), (2, 'Lake', 50), (4, 'Lake', 70)],
+                        read_at)
+
+    assert index.at('Lake', now=0) == [(4, 70)]
+    assert sorted(index.at('Reef', now=0)) == [(1, 90), (3, 80)]
+
+    # The next copy is newer than all of them
+    index.replace_table([(4, 'Lake', 70)], time.monotonic())
+    assert index.at('Reef', now=0) == []
+
+
+def test_moving_a_trip_replaces_it():
+    index = FisherIndex()
+    index.add(1, 'Lake', 100)
+    index.add(1, 'Reef', 100)
+    assert index.at('Lake', now=0) == []
+    assert index.is_fishing(1)
+
+
+def test_encounters_happen_while_both_are_fishing():
+    index = FisherIndex()
+    assert index.plan_encounter(1, 'Lake', 600, random.Random(1)) is None
+
+    index.add(1, 'Lake', 600)
+    index.add(2, 'Lake', 30)
+    for seed in range(20):
+        other, after = index.plan_encounter(1, 'Lake', 600,
+                                            random.Random(seed), now=0)
+        assert other == 2
+        assert 0 <= after <= 30
@@ -0,0 +1,105 @@
+import asyncio
+import collections
+import json
+import socket
+
+import psycopg2
+import pytest
+
+import events
+
+
+@pytest.fixture
+def heard(monkeypatch):
+    monkeypatch.setattr(events, '_handlers',
+                        events.collections.defaultdict(list))
+    heard = []
+    events.subscribe('cancel')(lambda user_id: heard.append(user_id))
+    return heard
+
+
+def test_local_events_are_delivered_straight_away(heard):
+    events.LocalEventBus().publish('cancel', {'user_id': 1001})
+    assert heard == [1001]
+
+
+def test_a_failing_handler_doesnt_stop_the_others(heard):
+    errors = events.counters['errors']
+
+    @events.subscribe('cancel')
+    def broken(user_id):
+        raise RuntimeError
+
+    events.subscribe('cancel')(lambda user_id: heard.append(-user_id))
+    events.LocalEventBus().publish('cancel', {'user_id': 1001})
+    assert heard == [1001, -1001]
+    assert events.counters['errors'] == errors + 1
+
+
+def test_workers_ignore_their_own_notifications(heard):
+    bus = events.PostgresEventBus('postgres://unused')
+    other = events.PostgresEventBus('postgres://unused')
+    event = {'kind': 'cancel', 'data': {'user_id': 1001}}
+
+    bus.receive(json.dumps(dict(event, origin=bus.origin)))
+    assert heard == []
+    bus.receive(json.dumps(dict(event, origin=other.origin)))
+    assert heard == [1001]
+
+
+def test_a_bad_notification_is_skipped(heard, monkeypatch):
+    bus = events.PostgresEventBus('postgres://unused')
+    other = events.PostgresEventBus('postgres://unused')
+    readable, writer = socket.socketpair()
+    readable.setblocking(False)
+    Notify = collections.namedtuple('Notify', 'payload')
+
+    class FakeConnection:
+        notifies = []
+
+        def fileno(self):
+            return readable.fileno()
+
+        def set_isolation_level(self, level):
+            pass
+
+        def cursor(self):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+        def execute(self, sql):
+            pass
+
+        def poll(self):
+            try:
+                readable.recv(1)
+            except BlockingIOError:
+                pass
+
+        def close(self):
+            pass
+
+    conn = FakeConnection()
+    monkeypatch.setattr(psycopg2, 'connect', lambda *args, **kwargs: conn)
+    good = json.dumps({'origin': other.origin, 'kind': 'cancel',
+                       'data': {'user_id': 1001}})
+    conn.notifies.extend([Notify('not json'), Notify('{}'), Notify(good)])
+
+    async def listen():
+        listener = asyncio.ensure_future(bus.listen())
+        writer.send(b'!')
+        while not heard:
+            await asyncio.sleep(0.01)
+        listener.cancel()
+
+    try:
+        asyncio.run(asyncio.wait_for(listen(), 5))
+    finally:
+        readable.close()
+        writer.close()
+    assert heard == [1001]
@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database
+import events
+import fishing
+import leaderboard
+from catalogue import catalogue
+from encounters import fishers
+from rng import Stream, trip_stream
+from topics import add_topic
+
+# The player every test plays as
+PLAYER = 1001
+
+
+class FakeDirectory:
+    async def nickname(self, user_id, default='Someone'):
+        return f'Angler {user_id}'
+
+    async def first_name(self, user_id):
+        return 'Angler'
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, text, key=None):
+        self.sent.append((key, text))
+
+
+@pytest.fixture(scope='module', autouse=True)
+def game():
+    if database.dialect() != 'sqlite':
+        pytest.skip('the game is only played against the embedded database')
+    fishing.rebuildDB(reinsert=True)
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    dispatcher = FakeDispatcher()
+    monkeypatch.setattr(fishing, 'directory', FakeDirectory())
+    monkeypatch.setattr(fishing, 'dispatcher', dispatcher)
+    return dispatcher
+
+
+def test_rebuild_is_idempotent():
+    report = fishing.rebuildDB(reinsert=True)
+    assert report['fish_loaded'] == 0
+    assert report['fish_existing'] > 0
+    assert catalogue.habitat('Lake')
+
+
+def test_small_fish_are_floored_in_their_own_unit(monkeypatch):
+    crayfish = next(fish for fish in catalogue.habitat('Lake')
+                    if fish.name == 'Crayfish')
+    assert crayfish.size.endswith('oz')
+    monkeypatch.setattr(catalogue, 'pick', lambda *args: crayfish)
+
+    class Tiny(Stream):
+        def randints(self, n, a, b):
+            return [0, 100, 100]
+
+        def gauss(self, mu, sigma):
+            return -1.0
+
+    # 0.2 oz, not 0.2 lb
+    assert fishing.goFishing('Lake', 'kayak', len(fishing.BOATS), 1,
+                             Tiny(1)) == (crayfish.row, 0.01)
+
+
+def test_cast_and_claim():
+    cast = fishing.castLine(str(PLAYER), 'Flats', 'kayak')
+    assert cast[0] == (PLAYER, 1, 1)
+    assert cast[1] == 'Flats'
+    # They can't cast again until the trip is over
+    assert fishing.castLine(str(PLAYER)) is None
+    assert (PLAYER, 'Flats') in [fisher[:2]
+                                 for fisher in fishing.getAllFishers()]
+
+    trip, _ = fishing.claimTrip(PLAYER)
+    assert trip[:2] == (PLAYER, 'Flats')
+    assert fishing.claimTrip(PLAYER) is None
+    assert PLAYER not in [fisher[0] for fisher in fishing.getAllFishers()]
+
+
+def test_due_trips_are_swept():
+    fishing.castLine(str(PLAYER), 'Flats', 'kayak')
+    assert [trip[0] for trip, _ in fishing.claimDueTrips(grace=-10 ** 6)]\
+        == [PLAYER]
+    assert fishing.claimDueTrips(grace=-10 ** 6) == []
+
+
+def test_catch_levels_up_and_reaches_the_leaderboard(dispatcher,
+                                                     monkeypatch):
+    # Someone who hasn't caught anything yet
+    player = PLAYER + 4
+    fish = catalogue.habitat('Flats')[0]
+    monkeypatch.setattr(fishing, 'goFishing',
+                        lambda *args: (fish.row, 150.4))
+    fishing.castLine(str(player), 'Flats', 'kayak')
+
+    # The catch is stored as the trip is claimed
+    trip, player_stats = fishing.claimTrip(player)
+    assert player_stats[:3] == (150, 1, 1)
+    asyncio.run(fishing.finishTrip(trip, player_stats))
+
+    assert fishing.getPlayerStats(player)[:3] == (150, 1, 1)
+    assert fishing.getUser(player) == (player, 1, 2)
+    assert len(dispatcher.sent) == 2
+    assert all(key == player for key, _ in dispatcher.sent)
+    assert (player, fish.name, 150)\
+        in leaderboard.topEntries(leaderboard.habitatBoard('Flats'))
+    assert (player, None, 150) in leaderboard.topEntries(leaderboard.POUNDS)
+
+    # The species is in their set, and counted in every habitat it's in
+    assert fishing.countUniqueCatches(player) == 1
+    assert 'Flats: 1 out of' in fishing.countCatchesByHabitat(player)
+
+
+def test_trips_replay_from_their_seed():
+    first = fishing.castLine(str(PLAYER + 1), seed=1234)
+    trip, _ = fishing.claimTrip(PLAYER + 1)
+    again = fishing.castLine(str(PLAYER + 1), seed=1234)
+    assert again[1:] == first[1:]
+    assert fishing.claimTrip(PLAYER + 1)[0] == trip
+    assert trip[5] == 1234
+
+
+def test_fishers_meet_without_polling_the_table(dispatcher, monkeypatch):
+    add_topic('bait')
+    # A seed whose trip has an encounter
+    seed = next(seed for seed in range(100)
+                if trip_stream(seed, 'encounter').randint(1, 3) == 1)
+    monkeypatch.setattr(fishing, 'getAllFishers', None)
+
+    async def trip():
+        fishers.add(PLAYER + 2, 'Reef', time.time() + 60)
+        fishing.castLine(str(PLAYER), 'Flats', 'kayak')
+        await fishing.resolveFisher(PLAYER, 'Reef', 0.05, seed)
+
+    try:
+        asyncio.run(trip())
+    finally:
+        fishers.remove(PLAYER + 2)
+
+    key, text = dispatcher.sent[0]
+    assert key is None
+    assert text.startswith(f'Angler {PLAYER} encounters Angler {PLAYER + 2}')
+    assert text.endswith('conversation about bait.')
+    assert not fishers.is_fishing(PLAYER)
+
+
+def test_reeling_in_cancels_the_trip_wherever_it_is():
+    from scheduler import trips
+
+    fishing.castLine(str(PLAYER), 'Flats', 'kayak')
+    trip = trips.schedule(PLAYER, fishing.resolveFisher(PLAYER, 'Flats', 60))
+    events.publish('cancel', user_id=PLAYER)
+    fishing.resetFishingStatus(PLAYER)
+
+    assert trip.cancelled()
+    assert not fishers.is_fishing(PLAYER)
+
+
+def test_catch_stays_claimable_if_storing_it_fails(monkeypatch):
+    fish = catalogue.habitat('Flats')[0]
+    monkeypatch.setattr(fishing, 'goFishing',
+                        lambda *args: (fish.row, 12.0))
+    fishing.castLine(str(PLAYER + 3), 'Flats', 'kayak')
+
+    def broken(*args):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(leaderboard, 'recordCatch', broken)
+    with pytest.raises(database.Error):
+        fishing.claimTrip(PLAYER + 3)
+    monkeypatch.undo()
+
+    trip, player_stats = fishing.claimTrip(PLAYER + 3)
+    assert trip[0] == PLAYER + 3
+    assert player_stats[:3] == (12, 1, 1)
+
+
+def test_cast_loads_the_catalogue_before_borrowing_a_connection(monkeypatch):
+    import catalogue as catalogue_module
+
+    borrowed = []
+    connection = database.connection
+    load = catalogue.load
+
+    @contextlib.contextmanager
+    def counted():
+        borrowed.append(1)
+        try:
+            with connection() as conn:
+                yield conn
+        finally:
+            borrowed.pop()
+
+    def checked_load():
+        # Loading while the cast holds a connection needs a second one
+        assert not borrowed
+        load()
+
+    monkeypatch.setattr(database, 'connection', counted)
+    monkeypatch.setattr(catalogue, 'load', checked_load)
+    # Just short of stale, so a check mid-cast could find it stale
+    catalogue.loaded_at = time.time() - catalogue_module.MAX_AGE + 1
+
+    fishing.castLine(str(PLAYER + 5), 'Flats', 'kayak')
+    assert time.time() - catalogue.loaded_at < 60
+    fishing.resetFishingStatus(PLAYER + 5)
+
+
+def test_casting_again_while_a_trip_finishes_keeps_its_news(dispatcher,
+                                                            monkeypatch):
+    from scheduler import trips
+
+    player = PLAYER + 6
+    fish = catalogue.habitat('Flats')[0]
+    monkeypatch.setattr(fishing, 'goFishing',
+                        lambda *args: (fish.row, 20.0))
+    looked_up = threading.Event()
+    release = threading.Event()
+
+    class SlowDirectory(FakeDirectory):
+        async def nickname(self, user_id, default='Someone'):
+            looked_up.set()
+            while not release.is_set():
+                await asyncio.sleep(0.01)
+            return await super().nickname(user_id, default)
+
+    monkeypatch.setattr(fishing, 'directory', SlowDirectory())
+    # A meeting would look up nicknames too
+    monkeypatch.setattr(fishing.fishers, 'plan_encounter',
+                        lambda *args: None)
+    fishing.castLine(str(player), 'Flats', 'kayak')
+    trips.schedule(player, fishing.resolveFisher(player, 'Flats', 0))
+    assert looked_up.wait(5)
+
+    # The trip has been claimed, so the player can cast again, which
+    # cancels the old trip
+    trips.schedule(player, asyncio.sleep(60))
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while not dispatcher.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    trips.cancel(player)
+    key, text = dispatcher.sent[0]
+    assert key == player
+    assert text.startswith(f'Angler {player} ')
+    assert fish.name in text
+
+
+def test_casting_again_while_a_trip_is_claimed_keeps_its_news(dispatcher,
+                                                              monkeypatch):
+    from scheduler import trips
+
+    player = PLAYER + 7
+    fish = catalogue.habitat('Flats')[0]
+    monkeypatch.setattr(fishing, 'goFishing',
+                        lambda *args: (fish.row, 20.0))
+    claiming = threading.Event()
+    release = threading.Event()
+    claimTrip = fishing.claimTrip
+
+    def slowClaim(user_id):
+        claiming.set()
+        release.wait(5)
+        return claimTrip(user_id)
+
+    monkeypatch.setattr(fishing, 'claimTrip', slowClaim)
+    monkeypatch.setattr(fishing.fishers, 'plan_encounter',
+                        lambda *args: None)
+    fishing.castLine(str(player), 'Flats', 'kayak')
+    trips.schedule(player, fishing.resolveFisher(player, 'Flats', 0))
+    assert claiming.wait(5)
+
+    trips.schedule(player, asyncio.sleep(60))
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while not dispatcher.sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    trips.cancel(player)
+    key, text = dispatcher.sent[0]
+    assert key == player
+    assert text.startswith(f'Angler {player} ')
+    assert fish.name in text
+
+
+def test_sweeper_outlives_a_failed_sweep(monkeypatch, caplog):
+    sweeps = []
+
+    def claimDueTrips():
+        sweeps.append(1)
+        if len(sweeps) == 1:
+            raise RuntimeError('no such setting')
+        return []
+
+    monkeypatch.setattr(fishing, 'claimDueTrips', claimDueTrips)
+
+    async def sweep():
+        sweeper = asyncio.ensure_future(fishing.sweepTrips(interval=0.01))
+        while len(sweeps) < 3:
+            await asyncio.sleep(0.01)
+        sweeper.cancel()
+
+    asyncio.run(asyncio.wait_for(sweep(), 5))
+    assert 'RuntimeError: no such setting' in caplog.text
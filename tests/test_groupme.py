@@ -0,0 +1,53 @@
+import asyncio
+from aiohttp import web
+from groupme import GroupMeClient, GroupMeError
+
+
+async def serve(statuses):
+    '''Serve the given statuses in order, then 200s.'''
+
+    statuses = list(statuses)
+
+    async def handler(request):
+        status = statuses.pop(0) if statuses else 200
+        return web.json_response({'response': status}, status=status)
+
+    app = web.Application()
+    app.router.add_route('*', '/', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+def test_retries_server_errors():
+    async def run():
+        runner, url = await serve([503, 429])
+        try:
+            client = GroupMeClient(backoff=0.01)
+            return await client.request('GET', url)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == (200, {'response': 200})
+
+
+def test_gives_up():
+    async def run():
+        runner, url = await serve([500] * 5)
+        try:
+            client = GroupMeClient(retries=1, backoff=0.01)
+            await client.request('POST', url)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except GroupMeError as e:
+        assert e.status == 500
+    else:
+        assert False
@@ -0,0 +1,60 @@
+import logging
+import threading
+
+from ingest import CommandQueue
+
+
+def test_failed_commands_are_logged(caplog):
+    handled = threading.Event()
+
+    def handler(post):
+        handled.set()
+        raise ValueError('no such fish')
+
+    commands = CommandQueue(handler, workers=1, size=1)
+    with caplog.at_level(logging.ERROR, logger='ingest'):
+        assert commands.submit({'text': '!gofish'})
+        handled.wait(5)
+        commands._queue.join()
+
+    assert commands.stats()['errors'] == 1
+    assert "Command failed: '!gofish'" in caplog.text
+    assert 'ValueError: no such fish' in caplog.text
+
+
+def test_full_queue_is_reported():
+    release = threading.Event()
+    started = threading.Event()
+
+    def handler(post):
+        started.set()
+        release.wait(5)
+
+    commands = CommandQueue(handler, workers=1, size=1)
+    assert commands.submit({'text': '!gofish'})
+    started.wait(5)
+    assert commands.submit({'text': '!gofish'})
+    assert not commands.submit({'text': '!gofish'})
+    release.set()
+    commands._queue.join()
+
+    assert commands.stats()['overflowed'] == 1
+
+
+def test_counters_add_up_across_threads():
+    commands = CommandQueue(lambda post: None, workers=4, size=100)
+
+    def submit():
+        for _ in range(500):
+            commands.submit({'text': '!gofish'})
+
+    submitters = [threading.Thread(target=submit) for _ in range(8)]
+    for submitter in submitters:
+        submitter.start()
+    for submitter in submitters:
+        submitter.join()
+    commands._queue.join()
+
+    stats = commands.stats()
+    assert stats['accepted'] + stats['overflowed'] == 4000
+    assert stats['handled'] == stats['accepted']
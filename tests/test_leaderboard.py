@@ -0,0 +1,59 @@
+import pytest
+
+import database
+import fishing
+import leaderboard
+
+# Players who only ever show up on these boards
+PLAYERS = range(2001, 2009)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def players():
+    if database.dialect() != 'sqlite':
+        pytest.skip('boards are only tested against the embedded database')
+    fishing.rebuildDB(reinsert=True)
+    for player in PLAYERS:
+        fishing.getUser(player)
+
+
+def test_catch_boards_keep_the_biggest():
+    board = leaderboard.habitatBoard('Test pond')
+    with database.connection() as conn:
+        c = conn.cursor()
+        for size, player in enumerate(PLAYERS, start=1):
+            leaderboard.addToCatchBoard(c, board, player, 'Bass', size)
+
+    entries = leaderboard.topEntries(board, limit=100)
+    assert [score for _, _, score in entries] == [8, 7, 6, 5, 4]
+
+
+def test_catch_boards_are_trimmed_back_to_size():
+    board = leaderboard.habitatBoard('Crowded pond')
+    with database.connection() as conn:
+        c = conn.cursor()
+        # As a board left by two catches made at once might be
+        for size, player in enumerate(PLAYERS[:7], start=1):
+            c.execute('''
+              INSERT
+              INTO Leaderboards (Board, Player_ID, Label, Score)
+              VALUES (%s, %s, %s, %s)
+            ''', (board, player, 'Bass', size * 10))
+        leaderboard.addToCatchBoard(c, board, PLAYERS[7], 'Bass', 45)
+
+    entries = leaderboard.topEntries(board, limit=100)
+    assert [score for _, _, score in entries] == [70, 60, 50, 45, 40]
+
+
+def test_past_weeks_are_pruned():
+    week = 7 * 86400
+    with database.connection() as conn:
+        c = conn.cursor()
+        leaderboard.recordCatch(c, PLAYERS[0], 'Bass', 10, None,
+                                (10, 1, 1), when=0)
+        leaderboard.recordCatch(c, PLAYERS[0], 'Bass', 10, None,
+                                (20, 2, 1), when=week)
+
+    assert leaderboard.topEntries(leaderboard.weekBoard(0)) == []
+    assert leaderboard.topEntries(leaderboard.weekBoard(week))\
+        == [(PLAYERS[0], None, 10)]
@@ -0,0 +1,54 @@
+import asyncio
+from groupme import GroupMeError
+from members import MemberDirectory
+
+MEMBERS = [{'user_id': '1', 'nickname': 'Chris', 'name': 'Christopher Carbonaro'},
+           {'user_id': '2', 'nickname': 'Danny', 'name': 'Danny Boy'}]
+
+
+def directory_with_calls():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return MEMBERS
+
+    return MemberDirectory(fetch), calls
+
+
+def test_lookup_is_cached():
+    directory, calls = directory_with_calls()
+
+    async def lookups():
+        assert await directory.nickname(1) == 'Chris'
+        assert await directory.first_name('1') == 'Christopher'
+        assert await directory.nicknames() == {'1': 'Chris', '2': 'Danny'}
+
+    asyncio.run(lookups())
+    assert len(calls) == 1
+
+
+def test_unknown_user_refreshes():
+    directory, calls = directory_with_calls()
+
+    async def lookups():
+        await directory.refresh()
+        directory.invalidate()
+        assert await directory.nickname(3) == 'Someone'
+        assert await directory.first_name(3) is None
+
+    asyncio.run(lookups())
+    assert len(calls) == 2
+
+
+def test_failed_fetch_falls_back():
+    async def fetch():
+        raise GroupMeError('GET /groups returned 500', 500)
+
+    directory = MemberDirectory(fetch)
+
+    async def lookups():
+        assert await directory.nickname(1) == 'Someone'
+        assert await directory.first_name(1) is None
+
+    asyncio.run(lookups())
@@ -0,0 +1,53 @@
+import pytest
+
+import metrics
+from settings import Settings
+from sqlitedb import SQLiteCursor, SQLiteDatabase
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_histogram_renders_cumulative_buckets():
+    metrics.COMMAND_SECONDS.observe(0.003, '!gofish')
+    metrics.COMMAND_SECONDS.observe(20, '!gofish')
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE checkers_command_seconds histogram' in lines
+    assert 'checkers_command_seconds_bucket{command="!gofish",le="0.0025"} 0.0' in lines
+    assert 'checkers_command_seconds_bucket{command="!gofish",le="0.005"} 1.0' in lines
+    assert 'checkers_command_seconds_bucket{command="!gofish",le="+Inf"} 2.0' in lines
+    assert 'checkers_command_seconds_count{command="!gofish"} 2.0' in lines
+
+
+def test_command_errors_are_counted():
+    with pytest.raises(ValueError):
+        with metrics.command('!fish stats'):
+            raise ValueError
+
+    assert 'checkers_command_errors_total{command="!fish stats"} 1.0'\
+        in metrics.render().splitlines()
+
+
+def test_queries_are_timed_by_borrower():
+    db = SQLiteDatabase(':memory:', metrics.timed_cursor(SQLiteCursor))
+
+    def getUser():
+        with metrics.borrowed(db.connection(), 'getUser') as conn:
+            c = conn.cursor()
+            c.execute('SELECT 1')
+            c.execute('SELECT %s', (2,))
+            return c.fetchone()
+
+    assert getUser() == (2,)
+    assert 'checkers_db_query_seconds_count{function="getUser"} 2.0'\
+        in metrics.render().splitlines()
+
+
+def test_metrics_are_off_by_default():
+    assert Settings({}).metrics is False
+    assert Settings({'METRICS': 'on'}).metrics is True
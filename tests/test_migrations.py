@@ -0,0 +1,77 @@
+import os
+import re
+
+import pytest
+
+# These run against a real database, in a schema which is thrown away
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+if not TEST_DATABASE_URL:
+    pytest.skip('TEST_DATABASE_URL is not set', allow_module_level=True)
+
+import psycopg2
+
+import fishing
+import leaderboard
+import migrations
+
+
+@pytest.fixture
+def cursor():
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    c = conn.cursor()
+    c.execute('''CREATE SCHEMA migrations_test''')
+    c.execute('''SET LOCAL search_path TO migrations_test''')
+    try:
+        yield c
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def plan(c, query, args=()):
+    # The tables are empty, so make the planner use an index if it can
+    c.execute('''SET LOCAL enable_seqscan = off''')
+    c.execute('EXPLAIN ' + query, args)
+    return '\n'.join(row[0] for row in c.fetchall())
+
+
+def test_migrate_applies_everything_once(cursor):
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.migrate(cursor) == versions
+    assert migrations.migrate(cursor) == []
+    assert migrations.currentVersion(cursor) == versions[-1]
+
+
+@pytest.mark.parametrize('query, args, index', [
+    (leaderboard.TOP_ENTRIES, ('pounds', 5), 'leaderboards_board_score'),
+    (fishing.CLAIM_DUE_TRIPS, (0, 10), 'currentfishers_resolve_time'),
+    (fishing.PLAYER_STATS, (1,), 'playerstats_pkey'),
+    (leaderboard.ADD_TO_SCORE, (1, 'pounds', 1),
+     'leaderboards_board_player'),
+])
+def test_hot_queries_use_indexes(cursor, query, args, index):
+    migrations.migrate(cursor)
+    # The whole name, since some are the start of another's
+    assert re.search(rf'\b{index}\b', plan(cursor, query, args))
+
+
+def test_import_fishfacts_is_idempotent(cursor):
+    from catalogue import import_fishfacts
+
+    migrations.migrate(cursor)
+    fishfacts = {
+        'Bass': {'Size': '2 to 4 lbs', 'Food Value': 'Good',
+                 'Game Qualities': 'Good', 'Habitats': 'Lake, River'},
+        'Garfish': {'Size': '20-70" ', 'Food Value': 'Average',
+                    'Game Qualities': 'Good', 'Habitats': 'Inshore'},
+    }
+    assert import_fishfacts(cursor, fishfacts) == {'fish_loaded': 1,
+                                                   'fish_existing': 0,
+                                                   'fish_skipped': 1,
+                                                   'habitats_loaded': 2,
+                                                   'habitats_existing': 0}
+    assert import_fishfacts(cursor, fishfacts) == {'fish_loaded': 0,
+                                                   'fish_existing': 1,
+                                                   'fish_skipped': 1,
+                                                   'habitats_loaded': 0,
+                                                   'habitats_existing': 2}
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+CHECKER = os.path.join(os.path.dirname(__file__), '..', 'checker')
+
+
+def test_importing_the_app_starts_nothing():
+    environ = {name: value for name, value in os.environ.items()
+               if name not in ('DATABASE_URL', 'token', 'bot_id')}
+    environ['PYTHONPATH'] = CHECKER
+    subprocess.run([sys.executable, '-c', '''
+import threading
+import response
+from scheduler import trips
+
+assert trips.pending() == 0
+assert 'trip-scheduler' not in [thread.name
+                                for thread in threading.enumerate()]
+'''], env=environ, check=True)
+
+
+def test_first_request_starts_the_background_tasks(monkeypatch):
+    import response
+    from scheduler import TripScheduler
+
+    scheduler = TripScheduler()
+    monkeypatch.setattr(response, 'trips', scheduler)
+    client = response.app.test_client()
+    assert client.post('/', json={'name': 'x'}).status_code == 400
+    assert scheduler.is_pending('sweeper')
+    assert scheduler.is_pending('events')
+
+    # One which has died is started again
+    scheduler.cancel('events')
+    client.post('/', json={'name': 'x'})
+    assert scheduler.is_pending('events')
+    scheduler.cancel('sweeper')
+    scheduler.cancel('events')
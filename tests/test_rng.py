@@ -0,0 +1,41 @@
+import fishing
+from rng import RandomService, Stream, trip_stream
+
+
+def test_streams_repeat():
+    first = [Stream(7).randint(0, 100) for _ in range(3)]
+    assert first == [Stream(7).randint(0, 100) for _ in range(3)]
+
+    stream = Stream(7)
+    assert all(0 <= stream.randint(0, 100) <= 100 for _ in range(1000))
+
+
+def test_parts_are_independent():
+    finish = trip_stream(7, 'finish').random()
+    assert trip_stream(7, 'encounter').random() != finish
+    assert Stream(7).spawn('finish').random() == finish
+
+
+def test_trip_seeds_follow_each_players_casts():
+    service = RandomService(seed=1)
+    seeds = [service.trip_seed(1), service.trip_seed(2), service.trip_seed(1)]
+
+    replay = RandomService(seed=1)
+    assert replay.trip_seed('2') == seeds[1]
+    assert [replay.trip_seed(1), replay.trip_seed(1)] == [seeds[0], seeds[2]]
+    assert len(set(seeds)) == 3
+
+
+def test_problems_are_drawn_from_the_stream():
+    assert fishing.problem('rod', Stream(3)) == fishing.problem('rod', Stream(3))
+    assert fishing.tripDelay(1, Stream(3)) == fishing.tripDelay(1, Stream(3))
+
+
+def test_batches_match_single_draws():
+    single = Stream(11)
+    assert Stream(11).random_block(5) == [single.random() for _ in range(5)]
+
+    single = Stream(11)
+    batch = Stream(11).randints(1000, 3, 9)
+    assert batch == [single.randint(3, 9) for _ in range(1000)]
+    assert set(batch) == set(range(3, 10))
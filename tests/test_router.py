@@ -0,0 +1,25 @@
+from router import Router, Matcher, parse
+
+
+def test_parse():
+    message = parse('!Fish  Leaderboard Lake')
+    assert message.command == '!fish'
+    assert message.args == ('leaderboard', 'lake')
+    assert parse('').command == ''
+
+
+def test_matcher_prefers_longer_names():
+    boats = Matcher(['kayak', 'swamp boat', 'bass boat'])
+    assert boats.find('!gofish flats swamp boat') == 'swamp boat'
+    assert boats.find('!gofish flats') is None
+
+
+def test_route():
+    router = Router()
+    sub = Router(default=lambda post, message: 'help')
+    router.command('!fish')(lambda post, message: sub.route_args(post, message))
+    sub.command('stats')(lambda post, message: 'stats')
+
+    assert router.route({'text': '!fish my stats'}) == 'stats'
+    assert router.route({'text': '!fish'}) == 'help'
+    assert router.route({'text': 'hello'}) is None
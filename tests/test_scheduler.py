@@ -0,0 +1,58 @@
+import asyncio
+import contextvars
+import logging
+import time
+
+import pytest
+
+from scheduler import TripScheduler, in_thread
+
+
+def test_trip_runs():
+    scheduler = TripScheduler()
+
+    async def trip():
+        await asyncio.sleep(0.01)
+        return 'caught'
+
+    assert scheduler.schedule(1, trip()).result(1) == 'caught'
+    assert scheduler.pending() == 0
+
+
+def test_trip_cancel():
+    scheduler = TripScheduler()
+    future = scheduler.schedule(1, asyncio.sleep(60))
+    assert scheduler.is_pending(1)
+    assert scheduler.cancel(1)
+    assert future.cancelled()
+    assert not scheduler.cancel(1)
+
+
+def test_failed_trip_is_logged(caplog):
+    scheduler = TripScheduler()
+
+    async def trip():
+        raise ValueError('lost the fish')
+
+    with caplog.at_level(logging.ERROR, logger='scheduler'):
+        future = scheduler.schedule(1, trip())
+        with pytest.raises(ValueError):
+            future.result(1)
+        # The callbacks run just after the result is set
+        deadline = time.monotonic() + 1
+        while 'lost the fish' not in caplog.text\
+              and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert 'ValueError: lost the fish' in caplog.text
+
+
+def test_in_thread_sees_context():
+    scheduler = TripScheduler()
+    command = contextvars.ContextVar('command', default=None)
+
+    async def query():
+        return await in_thread(command.get)
+
+    command.set('!gofish')
+    assert scheduler.run(query(), 1) == '!gofish'
@@ -0,0 +1,28 @@
+import pytest
+
+from settings import ConfigurationError, Settings
+
+
+def test_settings_are_read_when_used():
+    environ = {'DB_POOL_SIZE': '8'}
+    settings = Settings(environ)
+    environ['DATABASE_URL'] = 'sqlite://'
+
+    assert settings.database_url == 'sqlite://'
+    assert settings.pool_size == 8
+    assert settings.ingest_mode == 'queue'
+
+
+def test_missing_setting_names_the_variable():
+    with pytest.raises(ConfigurationError, match='bot_id'):
+        Settings({}).bot_id
+
+
+def test_reset():
+    environ = {'INGEST_MODE': 'inline'}
+    settings = Settings(environ)
+    assert settings.ingest_mode == 'inline'
+    environ['INGEST_MODE'] = 'queue'
+    assert settings.ingest_mode == 'inline'
+    settings.reset()
+    assert settings.ingest_mode == 'queue'
@@ -0,0 +1,45 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import fishing
+import simulator
+
+
+@pytest.fixture(scope='module')
+def sim():
+    return simulator.Simulator(seed=1)
+
+
+def test_difficulty_matches_the_game():
+    sizes = np.array([0.2, 12.5, 50, 180])
+    assert simulator.fish_difficulty(sizes) == pytest.approx(
+        [fishing.calc_fish_difficulty(size) for size in sizes])
+
+
+def test_cast(sim):
+    outcomes, fish, sizes = sim.cast('Lake', 2, 1, 10000)
+    landed = outcomes == simulator.CATCH
+    assert (fish[landed] >= 0).all() and (fish[~landed] == -1).all()
+    floor_lb = dict(zip(sim.catalogue.fish['Lake'],
+                        sim.catalogue.floor_lb['Lake']))
+    floors = np.round([floor_lb[number] for number in fish[landed]], 2)
+    assert (sizes[landed] >= floors).all() and (sizes[~landed] == 0).all()
+    assert set(fish[landed]) <= set(sim.catalogue.fish['Lake'])
+
+
+def test_rates_only_cover_reachable_habitats(sim):
+    table = sim.rates(casts=1000)
+    assert {row['boat_level'] for row in table
+            if row['habitat'] == 'Offshore'} == {5}
+    for row in table:
+        assert row['nothing'] + row['catch'] + row['rod_problem']\
+            + row['boat_problem'] == pytest.approx(1)
+
+
+def test_progression_only_goes_up(sim):
+    boats, rods, hours = sim.progression(players=50, casts=100)
+    assert boats.shape == rods.shape == hours.shape == (100, 50)
+    assert (np.diff(boats, axis=0) >= 0).all()
+    assert (np.diff(rods, axis=0) <= 1).all()
+    assert simulator.casts_to_reach(boats, 2) is not None
@@ -0,0 +1,40 @@
+import migrations
+import species
+from sqlitedb import SQLiteDatabase
+
+
+def test_sets_round_trip_through_bytes():
+    bits = 1 << 3 | 1 << 169
+    assert species.from_bytes(species.to_bytes(bits)) == bits
+    assert species.from_bytes(None) == 0
+    assert species.to_bytes(0) == b'\x00'
+    assert species.popcount(bits) == 2
+
+
+def test_cached_sets_hear_about_catches():
+    sets = species.SpeciesSets()
+    sets.caught(1001, 5)
+    sets.remember(1001, 1 << 3)
+    sets.caught(1001, 5)
+    assert sets.get(1001) == 1 << 3 | 1 << 5
+
+
+def test_species_move_into_the_sets():
+    db = SQLiteDatabase(':memory:')
+    with db.connection() as conn:
+        c = conn.cursor()
+        migrations.createSQLiteSchema(c)
+        c.execute('''INSERT INTO Players VALUES (1001, 1, 1), (1002, 1, 1)''')
+        c.execute('''INSERT INTO Fish (ID, Name, Size, Food_Value, Game_Quality)
+                     VALUES (3, 'Bass', '5 lb', 'Good', 'Good'),
+                            (12, 'Pike', '9 lb', 'Good', 'Good')''')
+        c.execute('''INSERT INTO PlayerStats (Player_ID) VALUES (1001),
+                                                                (1002)''')
+        c.execute('''INSERT INTO PlayerSpecies VALUES (1001, 3), (1001, 12)''')
+        migrations.addSpeciesSets(c)
+
+        c.execute('''SELECT Player_ID, Species FROM PlayerStats
+                     ORDER BY Player_ID''')
+        assert [(player_id, species.from_bytes(value))
+                for player_id, value in c.fetchall()]\
+            == [(1001, 1 << 3 | 1 << 12), (1002, 0)]
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import database
+import fishing
+import migrations
+from sqlitedb import SQLiteDatabase
+from topics import TopicIndex, add_topic, topics
+
+
+@pytest.fixture(scope='module', autouse=True)
+def game():
+    if database.dialect() != 'sqlite':
+        pytest.skip('topics are only tested against the embedded database')
+    fishing.rebuildDB()
+
+
+def test_members_get_their_own_topics_or_everyones():
+    add_topic('the weather')
+    add_topic('tacos', user_id=1001)
+    add_topic('bass', member_name='Lars')
+
+    # Adding a topic reloads the copy in memory
+    assert topics.pick(1001, 'Christopher', random) == 'tacos'
+    assert topics.for_member('1002', 'lars') == ('bass',)
+    assert 'the weather' in topics.for_member(1003, 'Nobody')
+    assert 'tacos' not in topics.for_member(1003)
+
+
+def test_no_topics_means_nothing_to_say():
+    assert TopicIndex().pick(1001, 'Lars') is None
+
+
+def test_topic_columns_become_rows():
+    db = SQLiteDatabase(':memory:')
+    with db.connection() as conn:
+        c = conn.cursor()
+        migrations.createSQLiteSchema(c)
+        c.execute('''
+          INSERT INTO Topics (topic, Christopher, Lars, Everyone)
+          VALUES ('bait', 1, 1, 0), ('boats', NULL, NULL, 1)
+        ''')
+        migrations.addTopicMembers(c)
+
+        c.execute('''SELECT Member_name, Topic FROM TopicMembers
+                     ORDER BY Member_name''')
+        assert c.fetchall() == [('Christopher', 'bait'), ('Lars', 'bait')]
+        c.execute('''SELECT * FROM Topics ORDER BY topic''')
+        assert c.fetchall() == [('bait', 0), ('boats', 1)]